@@ -20,6 +20,32 @@ class Settings(BaseSettings):
     # Security
     SECRET_KEY: str = "your-secret-key-change-in-production"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    
+    # Matching
+    # Refit the in-memory recommender from the database this often, so profiles
+    # written by other workers are picked up (0 disables periodic reloads)
+    RECOMMENDER_RELOAD_SECONDS: float = 300.0
+
+    # Gyms
+    # Rebuild the in-memory gym indexes (spatial, search, member counts) this
+    # often, so gyms and check-ins from other workers are picked up (0 disables)
+    GYM_INDEX_RELOAD_SECONDS: float = 60.0
+
+    # Chat
+    CHAT_SEND_QUEUE_SIZE: int = 64
+    CHAT_SEND_TIMEOUT_SECONDS: float = 5.0
+    CHAT_TYPING_INTERVAL_SECONDS: float = 2.0
+    CHAT_PING_INTERVAL_SECONDS: float = 25.0
+    CHAT_IDLE_TIMEOUT_SECONDS: float = 60.0
+    CHAT_RATE_LIMIT_PER_SECOND: float = 5.0
+    CHAT_RATE_LIMIT_BURST: int = 20
+    CHAT_MAX_CONNECTIONS_PER_USER: int = 5
+    CHAT_MAX_MESSAGE_LENGTH: int = 2000
+    CHAT_FLUSH_INTERVAL_MS: int = 50
+    CHAT_FLUSH_BATCH_SIZE: int = 100
+    CHAT_FLUSH_RETRY_MAX_SECONDS: float = 5.0
+    # Empty for a single worker; redis://host:6379/0 to fan out across workers
+    CHAT_BROKER_URL: str = ""
 
 
 settings = Settings()
@@ -44,3 +44,31 @@ def get_current_user(
         )
     
     return user
+
+
+def get_current_user_id(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+) -> str:
+    """
+    Get the authenticated user's id from the JWT alone, without a database lookup.
+    For hot read-only endpoints; deactivation is only enforced once the token expires.
+    """
+    payload = decode_token(credentials.credentials)
+    
+    if not payload or payload.get("type") != "access" or not payload.get("sub"):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired token",
+        )
+    
+    return payload["sub"]
+
+
+def get_current_superuser(current_user: User = Depends(get_current_user)) -> User:
+    """Require an authenticated superuser (operational endpoints)."""
+    if not current_user.is_superuser:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions",
+        )
+    return current_user
@@ -2,15 +2,29 @@
 GymBuddy API - Main Application Entry Point
 """
 
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.routers import auth_router, users_router, profiles_router, matches_router, workouts_router, chat_router, gyms_router
+from app.routers.chat import manager as chat_manager
+from app.services.message_store import message_writer
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await chat_manager.close()
+    # Write out chat messages still buffered by the write-behind queue
+    message_writer.stop()
+
 
 app = FastAPI(
     title="GymBuddy API",
     description="AI-Powered Gym Partner Matching using Collaborative Filtering",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
 # CORS middleware configuration
@@ -20,6 +34,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Chat history paging cursor, read by the browser client
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Include routers
@@ -0,0 +1,86 @@
+"""
+Profile Feature Encoding
+Maps fitness profiles onto a fixed-layout numeric feature matrix
+"""
+
+import numpy as np
+from typing import List, Dict, Any, Iterable
+
+from app.schemas.profile import FitnessLevel, FitnessGoal, WorkoutType, WorkoutDay, PreferredSchedule
+
+
+class ProfileEncoder:
+    """
+    Vectorised encoder for recommender features.
+
+    The column layout is derived from the profile enums, so it is identical across
+    refits and a single profile can be encoded into an existing matrix row.
+    Layout: [level, schedule one-hot, goals multi-hot, workout types multi-hot, days multi-hot].
+    Values outside the enums are ignored.
+    """
+
+    # Ordinal level, normalised to 0-1 (unknown levels count as beginner)
+    LEVEL_VALUES = {
+        FitnessLevel.BEGINNER.value: 1 / 3,
+        FitnessLevel.INTERMEDIATE.value: 2 / 3,
+        FitnessLevel.ADVANCED.value: 1.0,
+    }
+
+    # (profile field, vocabulary) for the one-hot / multi-hot blocks, in column order
+    CATEGORICAL_FIELDS = (
+        ("preferred_schedule", PreferredSchedule),
+        ("goals", FitnessGoal),
+        ("workout_types", WorkoutType),
+        ("preferred_days", WorkoutDay),
+    )
+
+    def __init__(self, dtype=np.float32):
+        self.dtype = dtype
+        self.columns: List[str] = ["level_numeric"]
+        self._column_of: Dict[str, Dict[str, int]] = {}
+
+        for field, vocabulary in self.CATEGORICAL_FIELDS:
+            offsets = {}
+            for member in vocabulary:
+                offsets[member.value] = len(self.columns)
+                self.columns.append(f"{field}_{member.value}")
+            self._column_of[field] = offsets
+
+    @property
+    def n_features(self) -> int:
+        return len(self.columns)
+
+    def _hot_columns(self, profile: Dict[str, Any]) -> Iterable[int]:
+        """Yield the column index of every category set in the profile."""
+        for field, _ in self.CATEGORICAL_FIELDS:
+            offsets = self._column_of[field]
+            values = profile.get(field)
+            if isinstance(values, str):
+                values = (values,)
+            for value in values or ():
+                column = offsets.get(value)
+                if column is not None:
+                    yield column
+
+    def encode_into(self, out: np.ndarray, profiles: List[Dict[str, Any]]) -> np.ndarray:
+        """Encode profiles into the first len(profiles) rows of a preallocated matrix."""
+        n = len(profiles)
+        out[:n] = 0
+        out[:n, 0] = [self.LEVEL_VALUES.get(p.get("fitness_level"), 1 / 3) for p in profiles]
+
+        rows, cols = [], []
+        for i, profile in enumerate(profiles):
+            for column in self._hot_columns(profile):
+                rows.append(i)
+                cols.append(column)
+        out[rows, cols] = 1
+        return out[:n]
+
+    def encode_many(self, profiles: List[Dict[str, Any]]) -> np.ndarray:
+        """Encode profiles into a new (N, n_features) matrix."""
+        out = np.empty((len(profiles), self.n_features), dtype=self.dtype)
+        return self.encode_into(out, profiles)
+
+    def encode(self, profile: Dict[str, Any]) -> np.ndarray:
+        """Encode a single profile into a feature row."""
+        return self.encode_many([profile])[0]
@@ -1,107 +1,159 @@
-import pandas as pd
+import threading
+
 import numpy as np
-from typing import List, Dict, Any
-from sklearn.metrics.pairwise import cosine_similarity
+from typing import List, Dict, Any, Iterable, Optional, Set
+
+from app.ml.features import ProfileEncoder
 
 class FitnessRecommender:
     """
-    Content-Based Recommendation Engine using Scikit-Learn.
-    Computes similarity scores between users based on their fitness profiles.
+    Content-Based Recommendation Engine.
+    Computes cosine similarity scores between users based on their fitness profiles.
+
+    The recommender is long-lived: after an initial `fit`, single profiles can be
+    added, replaced or removed with `upsert` / `remove` without refitting everyone.
     """
-    
+
+    INITIAL_CAPACITY = 64
+
     def __init__(self):
-        self.user_data = None
-        self.feature_matrix = None
-        self.user_ids = []
-        
-    def _encode_multilabel(self, df: pd.DataFrame, column: str) -> pd.DataFrame:
-        """Helper to create dummy variables for list-like columns (Multi-hot encoding)"""
-        # Explode list column to separate rows, get dummies, then sum back by index
-        df_exploded = df[[column]].explode(column)
-        dummies = pd.get_dummies(df_exploded[column], prefix=column)
-        return dummies.groupby(dummies.index).sum()
+        self.encoder = ProfileEncoder()
+        # Preallocated L2-normalised feature rows, so a dot product is the cosine similarity.
+        # Only the first len(user_ids) rows are in use.
+        self._matrix = np.zeros((self.INITIAL_CAPACITY, self.encoder.n_features), dtype=np.float32)
+        self.user_ids: List[str] = []
+        self._row_index: Dict[str, int] = {}
+        self._lock = threading.RLock()
+
+    @property
+    def feature_matrix(self) -> np.ndarray:
+        """Normalised feature rows of every stored user, in `user_ids` order."""
+        return self._matrix[:len(self.user_ids)]
+
+    @staticmethod
+    def _normalize_rows(rows: np.ndarray) -> np.ndarray:
+        """L2-normalise rows in place (all-zero rows stay zero)."""
+        norms = np.linalg.norm(rows, axis=1, keepdims=True)
+        np.divide(rows, norms, out=rows, where=norms > 0)
+        return rows
+
+    def _reserve(self, size: int):
+        """Grow the row buffer (doubling) so it can hold `size` users."""
+        capacity = len(self._matrix)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        grown = np.zeros((capacity, self.encoder.n_features), dtype=np.float32)
+        grown[:len(self.user_ids)] = self.feature_matrix
+        self._matrix = grown
 
     def fit(self, profiles: List[Dict[str, Any]]):
         """
         Fit the model with current user profiles.
         Expects a list of dictionaries with profile data.
         """
-        if not profiles:
-            return
-            
-        df = pd.DataFrame(profiles)
-        self.user_ids = df['user_id'].tolist()
-        
-        # Base features
-        features = []
-        
-        # 1. Fitness Level (Ordinal encoding logic or One-hot)
-        if 'fitness_level' in df.columns:
-            level_map = {"beginner": 1, "intermediate": 2, "advanced": 3}
-            df['level_numeric'] = df['fitness_level'].map(level_map).fillna(1)
-            # Normalize to 0-1
-            df['level_numeric'] = df['level_numeric'] / 3.0
-            features.append(df[['level_numeric']])
-            
-        # 2. Preferred Schedule (One-hot)
-        if 'preferred_schedule' in df.columns:
-            schedule_dummies = pd.get_dummies(df['preferred_schedule'], prefix='schedule')
-            features.append(schedule_dummies)
-            
-        # 3. Goals (Multi-hot)
-        if 'goals' in df.columns:
-            goals_df = self._encode_multilabel(df, 'goals')
-            features.append(goals_df)
-            
-        # 4. Workout Types (Multi-hot)
-        if 'workout_types' in df.columns:
-            types_df = self._encode_multilabel(df, 'workout_types')
-            features.append(types_df)
-            
-        # 5. Preferred Days (Multi-hot)
-        if 'preferred_days' in df.columns:
-            days_df = self._encode_multilabel(df, 'preferred_days')
-            features.append(days_df)
-            
-        # Concatenate all features
-        if features:
-            self.user_data = pd.concat(features, axis=1).fillna(0)
-            # Calculate similarity matrix
-            self.feature_matrix = cosine_similarity(self.user_data)
-        else:
-            self.feature_matrix = np.array([])
-            
-    def get_recommendations(self, target_user_id: str, top_n: int = 10) -> List[Dict[str, float]]:
+        with self._lock:
+            profiles = list({p['user_id']: p for p in profiles}.values())
+            self._matrix = np.zeros(
+                (max(len(profiles), self.INITIAL_CAPACITY), self.encoder.n_features),
+                dtype=np.float32,
+            )
+            self._normalize_rows(self.encoder.encode_into(self._matrix, profiles))
+            self.user_ids = [p['user_id'] for p in profiles]
+            self._row_index = {uid: i for i, uid in enumerate(self.user_ids)}
+
+    def upsert(self, profile: Dict[str, Any]):
+        """Add or replace a single user's profile, updating only that user's feature row."""
+        with self._lock:
+            user_id = profile['user_id']
+            row = self._row_index.get(user_id)
+            if row is None:
+                row = len(self.user_ids)
+                self._reserve(row + 1)
+                self.user_ids.append(user_id)
+                self._row_index[user_id] = row
+
+            self._normalize_rows(self.encoder.encode_into(self._matrix[row:row + 1], [profile]))
+
+    def remove(self, user_id: str):
+        """Drop a user's feature row (e.g. when the account is deactivated)."""
+        with self._lock:
+            row = self._row_index.pop(user_id, None)
+            if row is None:
+                return
+
+            # Move the last row into the freed slot to keep rows contiguous
+            last = len(self.user_ids) - 1
+            if row != last:
+                moved_id = self.user_ids[last]
+                self._matrix[row] = self._matrix[last]
+                self.user_ids[row] = moved_id
+                self._row_index[moved_id] = row
+            self._matrix[last] = 0
+            self.user_ids.pop()
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._row_index
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
+
+    def get_recommendations(
+        self,
+        target_user_id: str,
+        top_n: int = 10,
+        candidates: Optional[Iterable[str]] = None,
+        exclude: Optional[Set[str]] = None,
+    ) -> List[Dict[str, float]]:
         """
         Get top N recommendations for a specific user ID based on fitted data.
+        Scores only the target user's row against the normalised matrix
+        (one matrix-vector product) and selects the top N with argpartition.
+        If `candidates` is given, only those user IDs are scored; IDs in
+        `exclude` are never returned.
         """
-        if self.feature_matrix is None or len(self.feature_matrix) == 0:
-            return []
-            
-        if target_user_id not in self.user_ids:
+        with self._lock:
+            user_index = self._row_index.get(target_user_id)
+            if user_index is None:
+                return []
+
+            target = self._matrix[user_index]
+            if candidates is None:
+                rows = None
+                # Cosine similarity of the target user against everyone
+                similarity_scores = (self.feature_matrix @ target).astype(np.float64)
+                # Exclude self and excluded users
+                excluded = [user_index]
+                excluded.extend(self._row_index[uid] for uid in exclude or () if uid in self._row_index)
+                similarity_scores[excluded] = -np.inf
+                available = len(similarity_scores) - len(set(excluded))
+            else:
+                exclude = exclude or set()
+                rows = np.fromiter(
+                    (
+                        self._row_index[c] for c in candidates
+                        if c in self._row_index and c != target_user_id and c not in exclude
+                    ),
+                    dtype=np.intp,
+                )
+                similarity_scores = (self._matrix[rows] @ target).astype(np.float64)
+                available = len(rows)
+            user_ids = list(self.user_ids)
+
+        k = min(top_n, available)
+        if k <= 0:
             return []
-            
-        user_index = self.user_ids.index(target_user_id)
-        
-        # Get similarity scores for the target user
-        similarity_scores = list(enumerate(self.feature_matrix[user_index]))
-        
-        # Sort by similarity score descending (exclude self)
-        similarity_scores = sorted(similarity_scores, key=lambda x: x[1], reverse=True)
-        
-        recommendations = []
-        for idx, score in similarity_scores:
-            matched_user_id = self.user_ids[idx]
-            if matched_user_id == target_user_id:
-                continue
-                
-            # Convert np float to python float
-            recommendations.append({
-                "user_id": matched_user_id,
-                "score": float(score) * 100.0  # Percentage
-            })
-            
-            if len(recommendations) >= top_n:
-                break
-                
-        return recommendations
+
+        top = np.argpartition(-similarity_scores, k - 1)[:k]
+        # Sort the selected rows by score descending (row order breaks ties)
+        top = top[np.lexsort((top, -similarity_scores[top]))]
+
+        # Convert np float to python float
+        return [
+            {
+                "user_id": user_ids[idx if rows is None else rows[idx]],
+                "score": float(similarity_scores[idx]) * 100.0  # Percentage
+            }
+            for idx in top
+        ]
@@ -16,7 +16,7 @@ from app.models.workout_session import WorkoutSession
 
 from app.models.user_stats import UserStats
 
-from app.models.chat import Message
+from app.models.chat import Message, ChatReadState
 
 __all__ = [
     "BaseModel",
@@ -28,6 +28,7 @@ __all__ = [
     "Match",
     "MatchStatus",
     "Message",
+    "ChatReadState",
     "MatchPreference",
     "GenderPreference",
     "WorkoutPlan",
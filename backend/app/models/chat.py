@@ -3,7 +3,7 @@ Chat Model
 Stores messages exchanged between matched users
 """
 
-from sqlalchemy import Column, String, Text, ForeignKey, Boolean, DateTime
+from sqlalchemy import Column, String, Text, ForeignKey, Boolean, DateTime, Index, Integer, UniqueConstraint
 from sqlalchemy.orm import relationship
 import datetime
 
@@ -43,9 +43,49 @@ class Message(BaseModel):
     match = relationship("Match")
     sender = relationship("User", foreign_keys=[sender_id])
 
+    # History pages, newest first, with keyset seeks on (created_at, id)
+    __table_args__ = (
+        Index('ix_messages_match_id_created_at_id', 'match_id', 'created_at', 'id'),
+    )
+
     def mark_read(self):
         self.is_read = True
         self.read_at = datetime.datetime.utcnow()
 
     def __repr__(self):
         return f"<Message {self.id} in Match {self.match_id}>"
+
+
+class ChatReadState(BaseModel):
+    """
+    Per-(match, user) inbox state, maintained when messages are saved and read
+    so listing rooms never scans the messages table.
+    """
+    __tablename__ = "chat_read_states"
+
+    match_id = Column(
+        String(36),
+        ForeignKey("matches.id", ondelete="CASCADE"),
+        nullable=False,
+    )
+    user_id = Column(
+        String(36),
+        ForeignKey("users.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+
+    # Newest message in the room and the newest one this user has read
+    last_message_id = Column(String(36), ForeignKey("messages.id", ondelete="SET NULL"), nullable=True)
+    last_message_at = Column(DateTime, nullable=True)
+    last_read_message_id = Column(String(36), ForeignKey("messages.id", ondelete="SET NULL"), nullable=True)
+
+    # Messages from the partner this user has not read yet
+    unread_count = Column(Integer, default=0, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint('match_id', 'user_id', name='unique_read_state'),
+    )
+
+    def __repr__(self):
+        return f"<ChatReadState {self.user_id} in Match {self.match_id} unread={self.unread_count}>"
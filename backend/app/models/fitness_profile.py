@@ -71,6 +71,7 @@ class FitnessProfile(BaseModel):
         String(36),
         ForeignKey("gyms.id", ondelete="SET NULL"),
         nullable=True,
+        index=True,
     )
     
     # Personal details
@@ -1,158 +1,342 @@
-from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import or_, and_
-from typing import List, Dict
+from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect, Query, Response, BackgroundTasks, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy import or_, and_, case, func, tuple_
+from typing import List, Optional, Tuple
+from datetime import datetime
+import json
 
+from app.config import settings
 from app.database import get_db
-from app.models import User, Match, Message, MatchStatus
+from app.models import User, Match, Message, MatchStatus, ChatReadState
 from app.schemas.chat import MessageResponse, ChatRoomResponse, MessageCreate
-from app.dependencies import get_current_user
+from app.dependencies import get_current_user, get_current_superuser
+from app.services.connection_manager import ConnectionManager
+from app.services.chat_broker import create_broker
+from app.services.message_store import message_writer
+from app.services.security import decode_token
+from app.services.wire_format import negotiate, from_msgpack
 
 router = APIRouter(prefix="/chat", tags=["Chat"])
 
-class ConnectionManager:
-    def __init__(self):
-        # Maps match_id to a list of active WebSocket connections
-        self.active_connections: Dict[str, List[WebSocket]] = {}
+# Browsers cannot set headers on a WebSocket, so they send the access token as
+# a subprotocol pair ["gymbuddy.bearer", "<token>"]; unlike a query parameter,
+# it stays out of server and proxy access logs
+BEARER_SUBPROTOCOL = "gymbuddy.bearer"
 
-    async def connect(self, websocket: WebSocket, match_id: str):
-        await websocket.accept()
-        if match_id not in self.active_connections:
-            self.active_connections[match_id] = []
-        self.active_connections[match_id].append(websocket)
+manager = ConnectionManager(broker=create_broker())
 
-    def disconnect(self, websocket: WebSocket, match_id: str):
-        if match_id in self.active_connections:
-            self.active_connections[match_id].remove(websocket)
-            if not self.active_connections[match_id]:
-                del self.active_connections[match_id]
+def _chat_rooms(db: Session, user_id: str) -> List[ChatRoomResponse]:
+    """The user's accepted matches with partner, last message and unread count, in one query."""
+    Partner = aliased(User, name="partner")
+    LastMessage = aliased(Message, name="last_message")
+    partner_id = case((Match.user_a_id == user_id, Match.user_b_id), else_=Match.user_a_id)
 
-    async def broadcast_to_match(self, message: dict, match_id: str):
-        if match_id in self.active_connections:
-            for connection in self.active_connections[match_id]:
-                await connection.send_json(message)
+    rows = (
+        db.query(Match.id, Partner, LastMessage, func.coalesce(ChatReadState.unread_count, 0))
+        .join(Partner, Partner.id == partner_id)
+        .outerjoin(
+            ChatReadState,
+            and_(ChatReadState.match_id == Match.id, ChatReadState.user_id == user_id),
+        )
+        .outerjoin(LastMessage, LastMessage.id == ChatReadState.last_message_id)
+        .filter(
+            or_(Match.user_a_id == user_id, Match.user_b_id == user_id),
+            Match.status == MatchStatus.ACCEPTED.value,
+        )
+        .order_by(func.coalesce(ChatReadState.last_message_at, Match.created_at).desc())
+        .all()
+    )
 
-manager = ConnectionManager()
+    return [
+        ChatRoomResponse(
+            match_id=match_id,
+            partner_id=partner.id,
+            partner_name=partner.full_name,
+            partner_avatar=partner.avatar_url,
+            last_message=MessageResponse.model_validate(last_message) if last_message else None,
+            unread_count=unread_count,
+        )
+        for match_id, partner, last_message, unread_count in rows
+    ]
 
 @router.get("/rooms", response_model=List[ChatRoomResponse])
-def get_chat_rooms(
+async def get_chat_rooms(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Get all chat rooms (accepted matches) for the user."""
-    matches = db.query(Match).filter(
-        or_(Match.user_a_id == current_user.id, Match.user_b_id == current_user.id),
-        Match.status == MatchStatus.ACCEPTED.value
-    ).all()
-    
-    rooms = []
-    for match in matches:
-        partner = match.user_b if match.user_a_id == current_user.id else match.user_a
-        
-        # Get last message
-        last_message = db.query(Message).filter(Message.match_id == match.id).order_by(Message.created_at.desc()).first()
-        
-        # Get unread count
-        unread = db.query(Message).filter(
-            Message.match_id == match.id,
-            Message.sender_id != current_user.id,
-            Message.is_read == False
-        ).count()
-        
-        last_msg_resp = None
-        if last_message:
-            last_msg_resp = MessageResponse(
-                id=last_message.id,
-                match_id=last_message.match_id,
-                sender_id=last_message.sender_id,
-                content=last_message.content,
-                is_read=last_message.is_read,
-                read_at=last_message.read_at,
-                created_at=last_message.created_at
-            )
-            
-        rooms.append(ChatRoomResponse(
-            match_id=match.id,
-            partner_id=partner.id,
-            partner_name=partner.full_name,
-            partner_avatar=partner.avatar_url,
-            last_message=last_msg_resp,
-            unread_count=unread
-        ))
-        
-    # Sort rooms by last message time if available
-    rooms.sort(key=lambda x: x.last_message.created_at if x.last_message else match.created_at, reverse=True)
+    """
+    Get all chat rooms (accepted matches) for the user, most recent activity first.
+    Last message and unread count come from the user's read state, not a scan of messages;
+    partner presence comes from the connection manager. The query runs in the threadpool
+    while presence is read here, on the event loop that updates it.
+    """
+    rooms = await run_in_threadpool(_chat_rooms, db, current_user.id)
+    for room in rooms:
+        room.partner_online = manager.is_online(room.partner_id)
     return rooms
 
+def _get_room(db: Session, match_id: str, user: User) -> Match:
+    """The match, if it exists and the user is part of it."""
+    match = db.query(Match).filter(Match.id == match_id).first()
+    if not match:
+        raise HTTPException(status_code=404, detail="Match not found")
+        
+    if match.user_a_id != user.id and match.user_b_id != user.id:
+        raise HTTPException(status_code=403, detail="Not authorized to view these messages")
+    return match
+
+
+def _queue_read_receipt(
+    background_tasks: BackgroundTasks,
+    match_id: str,
+    reader_id: str,
+    message_id: str,
+    created_at: datetime,
+    move_pointer: bool = True,
+):
+    """
+    Queue one bulk UPDATE marking the partner's messages up to the given one read,
+    and push a single read-receipt event to the room once the response is sent.
+    """
+    message_writer.enqueue_read(match_id, reader_id, created_at, message_id if move_pointer else None)
+    background_tasks.add_task(
+        manager.broadcast_to_match,
+        {
+            "type": "read_receipt",
+            "match_id": match_id,
+            "reader_id": reader_id,
+            "up_to": message_id,
+            "read_at": datetime.utcnow().isoformat(),
+        },
+        match_id,
+    )
+
+
+def _encode_cursor(message: Message) -> str:
+    return f"{message.created_at.isoformat()},{message.id}"
+
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        created_at, message_id = cursor.split(",", 1)
+        return datetime.fromisoformat(created_at), message_id
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@router.get("/metrics")
+async def get_chat_metrics(current_user: User = Depends(get_current_superuser)):
+    """
+    Live WebSocket gauges and eviction / rate-limit counters for this worker (superusers only).
+    Async so the connection state is read on the event loop that changes it.
+    """
+    return manager.metrics()
+
 @router.get("/{match_id}/messages", response_model=List[MessageResponse])
 def get_messages(
     match_id: str,
-    limit: int = 50,
-    offset: int = 0,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    limit: int = Query(default=50, ge=1, le=200),
+    before: Optional[str] = Query(None, description="Cursor '<created_at>,<id>' from X-Next-Cursor"),
+    offset: int = Query(default=0, ge=0, deprecated=True),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Get history of messages for a specific match/room."""
-    # Verify match exists and user is part of it
-    match = db.query(Match).filter(Match.id == match_id).first()
-    if not match:
-        raise HTTPException(status_code=404, detail="Match not found")
-        
-    if match.user_a_id != current_user.id and match.user_b_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Not authorized to view these messages")
+    """
+    Get history of messages for a specific match/room, newest page first.
+    Pass the X-Next-Cursor response header back as `before` to fetch older messages;
+    the header is absent on the last page.
+    """
+    _get_room(db, match_id, current_user)
         
-    messages = db.query(Message).filter(Message.match_id == match_id).order_by(Message.created_at.desc()).offset(offset).limit(limit).all()
+    query = db.query(Message).filter(Message.match_id == match_id)
+    if before:
+        # Keyset seek on (created_at, id), served by the (match_id, created_at, id) index
+        query = query.filter(tuple_(Message.created_at, Message.id) < _decode_cursor(before))
+    elif offset:
+        query = query.offset(offset)
+    # One extra row tells whether an older page exists
+    messages = query.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit + 1).all()
+    if len(messages) > limit:
+        messages = messages[:limit]
+        response.headers["X-Next-Cursor"] = _encode_cursor(messages[-1])
     
-    # Mark as read the ones sent by partner
-    unread_messages = [m for m in messages if m.sender_id != current_user.id and not m.is_read]
-    for m in unread_messages:
-        m.mark_read()
-    if unread_messages:
-        db.commit()
+    # Mark partner messages up to this page read, after the response is sent
+    if any(m.sender_id != current_user.id and not m.is_read for m in messages):
+        newest_page = not before and not offset
+        newest = messages[0]
+        _queue_read_receipt(
+            background_tasks, match_id, current_user.id, newest.id, newest.created_at, move_pointer=newest_page,
+        )
     
     # Return reversed to show chronological order
     return messages[::-1]
 
+def _message_created_at(db: Session, match_id: str, message_id: str) -> datetime:
+    """
+    Timestamp of a message in the room, or 404. A message sent moments ago may
+    still be buffered by the write-behind writer, so a miss flushes it once.
+    """
+    for attempt in range(2):
+        row = db.query(Message.created_at).filter(Message.id == message_id, Message.match_id == match_id).first()
+        if row:
+            return row.created_at
+        if attempt == 0:
+            message_writer.flush()
+    raise HTTPException(status_code=404, detail="Message not found")
+
+
+@router.post("/{match_id}/read")
+def mark_messages_read(
+    match_id: str,
+    background_tasks: BackgroundTasks,
+    up_to: Optional[str] = Query(None, description="Cursor '<created_at>,<id>'; defaults to the latest message"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Mark every partner message up to a cursor (or the latest message) as read."""
+    _get_room(db, match_id, current_user)
+
+    if up_to:
+        _, message_id = _decode_cursor(up_to)
+        created_at = _message_created_at(db, match_id, message_id)
+    else:
+        state = db.query(ChatReadState.last_message_id, ChatReadState.last_message_at).filter(
+            ChatReadState.match_id == match_id, ChatReadState.user_id == current_user.id
+        ).first()
+        if not state or not state.last_message_id:
+            return {"match_id": match_id, "read_up_to": None}
+        created_at, message_id = state.last_message_at, state.last_message_id
+
+    _queue_read_receipt(background_tasks, match_id, current_user.id, message_id, created_at)
+    return {"match_id": match_id, "read_up_to": message_id}
+
+def _socket_token(websocket: WebSocket) -> Optional[str]:
+    """Access token from the bearer subprotocol pair or an Authorization header."""
+    protocols = websocket.scope.get("subprotocols") or []
+    if BEARER_SUBPROTOCOL in protocols:
+        index = protocols.index(BEARER_SUBPROTOCOL) + 1
+        return protocols[index] if index < len(protocols) else None
+
+    scheme, _, token = websocket.headers.get("authorization", "").partition(" ")
+    return token if scheme.lower() == "bearer" and token else None
+
+
+def _authenticate_member(db: Session, match_id: str, token: Optional[str]) -> Optional[str]:
+    """
+    User id from an access token, if that user is active and part of the accepted
+    match (one query). The session is released before the socket starts streaming.
+    """
+    payload = decode_token(token) if token else None
+    if not payload or payload.get("type") != "access" or not payload.get("sub"):
+        return None
+
+    user_id = payload["sub"]
+    try:
+        member = (
+            db.query(Match.id)
+            .join(User, and_(User.id == user_id, User.is_active == True))
+            .filter(
+                Match.id == match_id,
+                or_(Match.user_a_id == user_id, Match.user_b_id == user_id),
+                Match.status == MatchStatus.ACCEPTED.value,
+            )
+            .first()
+        )
+    finally:
+        db.close()
+    return user_id if member else None
+
+
+def _decode_frame(message: dict, binary: bool) -> Optional[dict]:
+    """
+    Client frame from a raw ASGI receive, or None if it cannot be decoded: MessagePack
+    sockets take binary frames and JSON sockets text frames.
+    """
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", status.WS_1000_NORMAL_CLOSURE))
+    if binary:
+        data = message.get("bytes")
+        return from_msgpack(data) if data is not None else None
+    text = message.get("text")
+    if text is None:
+        return None
+    try:
+        return json.loads(text)
+    except ValueError:
+        return None
+
+
 @router.websocket("/ws/{match_id}")
 async def websocket_endpoint(
     websocket: WebSocket,
     match_id: str,
     db: Session = Depends(get_db),
-    # In a real app with WebSockets, we would extract token from query or headers to authenticate
-    # current_user: User = Depends(get_current_user)
-    # For now, we'll accept the user_id in the JSON payload or query param for simplicity.
 ):
-    await manager.connect(websocket, match_id)
+    """
+    Chat socket for one accepted match.
+
+    Authenticate with the subprotocol pair ["gymbuddy.bearer", <access token>]
+    (browsers) or an Authorization: Bearer header; offer "gymbuddy.msgpack" as
+    well for binary frames.
+
+    Client frames: {"content": str} sends a message (non-empty, at most
+    CHAT_MAX_MESSAGE_LENGTH characters), {"type": "typing"} signals
+    typing, {"type": "pong"} answers a ping.
+
+    Server frames: messages (no "type"), and {"type": ...} events "presence",
+    "typing", "read_receipt", "error" and "ping". A ping is sent every
+    CHAT_PING_INTERVAL_SECONDS and must be answered with a pong: a socket
+    that sends nothing for CHAT_IDLE_TIMEOUT_SECONDS is closed (1001).
+    """
+    # Authenticate once at connect; the identity is cached for the life of the connection
+    user_id = await run_in_threadpool(_authenticate_member, db, match_id, _socket_token(websocket))
+    if user_id is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    # Opt-in compact frames: clients offering the "gymbuddy.msgpack" subprotocol get MessagePack.
+    # Otherwise the bearer marker is echoed, as browsers require one of their offers back.
+    protocols = websocket.scope.get("subprotocols") or []
+    subprotocol = negotiate(protocols) or (BEARER_SUBPROTOCOL if BEARER_SUBPROTOCOL in protocols else None)
+    connection = await manager.connect(websocket, match_id, user_id, subprotocol)
     try:
         while True:
-            data = await websocket.receive_json()
-            # Expecting data format: {"sender_id": str, "content": str}
-            sender_id = data.get("sender_id")
+            data = _decode_frame(await websocket.receive(), connection.binary)
+            if not manager.receive(connection):
+                continue
+            if not isinstance(data, dict):
+                manager.error(connection, "frame must be an object")
+                continue
+
+            # Any frame counts as activity; pongs carry nothing else
+            if data.get("type") == "pong":
+                continue
+
+            # Ephemeral, never persisted: {"type": "typing"}
+            if data.get("type") == "typing":
+                await manager.typing(match_id, user_id)
+                continue
+
+            # Expecting data format: {"content": str}; the sender is the authenticated user.
+            # Checked before broadcasting, as the partner sees the message before it is stored
             content = data.get("content")
-            
-            if not sender_id or not content:
+            if not isinstance(content, str) or not content:
+                manager.error(connection, "content must be a non-empty string")
                 continue
-                
-            # Save to DB
-            new_message = Message(
-                match_id=match_id,
-                sender_id=sender_id,
-                content=content
-            )
-            db.add(new_message)
-            db.commit()
-            db.refresh(new_message)
+            if len(content) > settings.CHAT_MAX_MESSAGE_LENGTH:
+                manager.error(connection, f"content is longer than {settings.CHAT_MAX_MESSAGE_LENGTH} characters")
+                continue
+
+            # Buffered for a batched insert; broadcast right away without waiting on the DB
+            msg_payload = message_writer.enqueue(match_id, user_id, content)
             
             # Broadcast to all connected clients in this room (both users if online)
-            msg_payload = {
-                "id": new_message.id,
-                "match_id": match_id,
-                "sender_id": sender_id,
-                "content": content,
-                "created_at": new_message.created_at.isoformat(),
-                "is_read": False
-            }
             await manager.broadcast_to_match(msg_payload, match_id)
             
     except WebSocketDisconnect:
-        manager.disconnect(websocket, match_id)
+        pass
+    finally:
+        await manager.leave(websocket, match_id, user_id)
@@ -6,67 +6,162 @@ Endpoints for Gym Discovery and Check-in
 from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
 from sqlalchemy import func
-from typing import List
+from typing import List, Optional, Dict
+import numpy as np
 
 from app.database import get_db
 from app.models import User, Gym, FitnessProfile
-from app.schemas.gym import GymCreate, GymResponse, GymRecommendationResponse
-from app.dependencies import get_current_user
-import math
+from app.schemas.gym import GymCreate, GymResponse, GymRecommendationResponse, GymSuggestion
+from app.dependencies import get_current_user, get_current_user_id
+from app.services.geo_index import gym_index, haversine_km, bounding_box
+from app.services.gym_search import gym_search, normalize
 
 router = APIRouter(prefix="/gyms", tags=["Gyms"])
 
-def haversine(lat1, lon1, lat2, lon2):
-    """Calculate distance in km"""
-    if None in (lat1, lon1, lat2, lon2):
-        return None
-    R = 6371
-    dlat = math.radians(lat2 - lat1)
-    dlon = math.radians(lon2 - lon1)
-    a = math.sin(dlat/2)**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon/2)**2
-    c = 2 * math.asin(math.sqrt(a))
-    return R * c
+def _member_count_subquery(db: Session):
+    """Members (profiles using the gym as their preference) per gym, as (gym_id, member_count)."""
+    return (
+        db.query(
+            FitnessProfile.preferred_gym_id.label("gym_id"),
+            func.count(FitnessProfile.id).label("member_count"),
+        )
+        .filter(FitnessProfile.preferred_gym_id.isnot(None))
+        .group_by(FitnessProfile.preferred_gym_id)
+        .subquery()
+    )
+
+
+def _member_counts(db: Session, gym_ids: List[str]) -> Dict[str, int]:
+    """Member counts for the given gyms in one grouped query."""
+    if not gym_ids:
+        return {}
+    rows = (
+        db.query(FitnessProfile.preferred_gym_id, func.count(FitnessProfile.id))
+        .filter(FitnessProfile.preferred_gym_id.in_(gym_ids))
+        .group_by(FitnessProfile.preferred_gym_id)
+        .all()
+    )
+    return dict(rows)
+
+
+def _nearest_gyms(db: Session, lat: float, lon: float, radius_km: Optional[float], limit: int, offset: int):
+    """Page of (gym, distance_km) nearest to a point, served from the spatial index."""
+    gym_index.ensure_loaded(db)
+    if radius_km is not None:
+        hits = gym_index.within(lat, lon, radius_km)[offset:offset + limit]
+    else:
+        hits = gym_index.nearest(lat, lon, offset + limit)[offset:]
+
+    if not hits:
+        return []
+    gyms = {
+        g.id: g for g in db.query(Gym).filter(Gym.id.in_([gym_id for gym_id, _ in hits]), Gym.is_active == True)
+    }
+    return [(gyms[gym_id], dist) for gym_id, dist in hits if gym_id in gyms]
+
+
+def _filtered_gyms_by_distance(db_query, lat: float, lon: float, radius_km: Optional[float], limit: int, offset: int):
+    """Page of (gym, distance_km) for an already-filtered query, bounding-box prefiltered in SQL."""
+    db_query = db_query.filter(Gym.latitude.isnot(None), Gym.longitude.isnot(None))
+    if radius_km is not None:
+        min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+        db_query = db_query.filter(Gym.latitude.between(min_lat, max_lat))
+        if min_lon is not None:
+            db_query = db_query.filter(Gym.longitude.between(min_lon, max_lon))
+
+    gyms = db_query.all()
+    if not gyms:
+        return []
+
+    distances = haversine_km(lat, lon, [g.latitude for g in gyms], [g.longitude for g in gyms])
+    order = np.argsort(distances, kind="stable")
+    if radius_km is not None:
+        order = order[distances[order] <= radius_km]
+    return [(gyms[i], float(distances[i])) for i in order[offset:offset + limit]]
+
 
 @router.get("", response_model=List[GymRecommendationResponse])
 def search_gyms(
     query: str = Query(None, description="Search by name or city"),
     lat: float = Query(None, description="User latitude"),
     lon: float = Query(None, description="User longitude"),
+    radius_km: float = Query(None, gt=0, description="Only gyms within this distance (requires lat/lon)"),
+    limit: int = Query(default=50, ge=1, le=100),
+    offset: int = Query(default=0, ge=0),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
-    """Search for gyms, optionally sorted by distance."""
+    """
+    Search for gyms, optionally sorted by distance.
+    With lat/lon, results are the nearest gyms (with known coordinates) first;
+    otherwise text matches are ordered by relevance and the rest by popularity.
+    """
+    by_distance = lat is not None and lon is not None
+    if radius_km is not None and not by_distance:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="radius_km requires lat and lon",
+        )
+
     db_query = db.query(Gym).filter(Gym.is_active == True)
     
-    if query:
-        search = f"%{query}%"
-        db_query = db_query.filter(
-            (Gym.name.ilike(search)) | (Gym.city.ilike(search))
+    matched_ids = None
+    if query and normalize(query):
+        # Name / city matching is served from the in-memory search index
+        gym_search.ensure_loaded(db)
+        matched_ids = gym_search.search(query)
+        db_query = db_query.filter(Gym.id.in_(matched_ids))
+
+    if by_distance:
+        if matched_ids is not None:
+            page = _filtered_gyms_by_distance(db_query, lat, lon, radius_km, limit, offset)
+        else:
+            page = _nearest_gyms(db, lat, lon, radius_km, limit, offset)
+        member_counts = _member_counts(db, [gym.id for gym, _ in page])
+        page = [(gym, dist, member_counts.get(gym.id, 0)) for gym, dist in page]
+    elif matched_ids is not None:
+        # Sort by relevance
+        page_ids = matched_ids[offset:offset + limit]
+        gyms = {g.id: g for g in db.query(Gym).filter(Gym.id.in_(page_ids), Gym.is_active == True)}
+        member_counts = _member_counts(db, page_ids)
+        page = [(gyms[gym_id], None, member_counts.get(gym_id, 0)) for gym_id in page_ids if gym_id in gyms]
+    else:
+        # Sort by popularity
+        counts = _member_count_subquery(db)
+        member_count = func.coalesce(counts.c.member_count, 0)
+        rows = (
+            db_query.outerjoin(counts, counts.c.gym_id == Gym.id)
+            .add_columns(member_count)
+            .order_by(member_count.desc(), Gym.name)
+            .offset(offset)
+            .limit(limit)
+            .all()
         )
-        
-    gyms = db_query.limit(50).all()
+        page = [(gym, None, count) for gym, count in rows]
     
     results = []
-    for gym in gyms:
-        dist = haversine(lat, lon, gym.latitude, gym.longitude) if lat and lon else None
-        
-        # Count members using this gym as their preference
-        member_count = db.query(FitnessProfile).filter(FitnessProfile.preferred_gym_id == gym.id).count()
-        
+    for gym, dist, member_count in page:
         gym_dict = gym.__dict__.copy()
         gym_dict["distance_km"] = dist
         gym_dict["member_count"] = member_count
         results.append(GymRecommendationResponse(**gym_dict))
         
-    if lat and lon:
-        # Sort by distance
-        results.sort(key=lambda x: x.distance_km if x.distance_km is not None else float('inf'))
-    else:
-        # Sort by popularity
-        results.sort(key=lambda x: x.member_count, reverse=True)
-        
     return results
 
+@router.get("/suggest", response_model=List[GymSuggestion])
+def suggest_gyms(
+    q: str = Query(..., min_length=1, description="Prefix of a gym name, name word or city"),
+    limit: int = Query(default=10, ge=1, le=50),
+    db: Session = Depends(get_db),
+    current_user_id: str = Depends(get_current_user_id),
+):
+    """
+    Autocomplete for the gym picker: most popular gyms matching the prefix.
+    Served from the in-memory search index; the database is only read when it (re)loads.
+    """
+    gym_search.ensure_loaded(db)
+    return gym_search.suggest(q, limit)
+
 @router.post("", response_model=GymResponse, status_code=status.HTTP_201_CREATED)
 def create_gym(
     gym_data: GymCreate,
@@ -83,6 +178,8 @@ def create_gym(
     db.add(new_gym)
     db.commit()
     db.refresh(new_gym)
+    gym_index.upsert(new_gym)
+    gym_search.upsert(new_gym)
     
     return new_gym
 
@@ -101,7 +198,9 @@ def check_in_gym(
     if not profile:
         raise HTTPException(status_code=400, detail="Please complete fitness profile first")
         
+    previous_gym_id = profile.preferred_gym_id
     profile.preferred_gym_id = gym.id
     db.commit()
+    gym_search.move_member(previous_gym_id, gym.id)
     
     return {"message": f"Checked into {gym.name} successfully."}
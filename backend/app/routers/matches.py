@@ -12,10 +12,10 @@ from app.database import get_db
 from app.models import User, Match, MatchStatus
 from app.schemas.matching import MatchRecommendation, MatchResponse, MatchRequestCreate
 from app.dependencies import get_current_user
-from app.services.matching_service import MatchingService
+from app.services.matching_service import matching_service
+from app.services.candidate_loader import load_matching_user
 
 router = APIRouter(prefix="/matches", tags=["Matches"])
-matching_service = MatchingService()
 
 
 @router.get("/recommendations", response_model=List[MatchRecommendation])
@@ -53,8 +53,8 @@ def send_match_request(
     db: Session = Depends(get_db),
 ):
     """Send a match request to another user."""
-    # Validate candidate exists
-    candidate = db.query(User).filter(User.id == candidate_id).first()
+    # Validate candidate exists (profile and gym are needed for scoring)
+    candidate = load_matching_user(db, candidate_id)
     if not candidate:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -86,6 +86,7 @@ def send_match_request(
     db.add(match)
     db.commit()
     db.refresh(match)
+    matching_service.exclusions.record(match.user_a_id, match.user_b_id, match.status)
     
     return {"message": "Match request sent", "match_id": match.id}
 
@@ -110,6 +111,7 @@ def accept_match(
     
     match.status = MatchStatus.ACCEPTED.value
     db.commit()
+    matching_service.exclusions.record(match.user_a_id, match.user_b_id, match.status)
     
     return {"message": "Match accepted"}
 
@@ -134,6 +136,7 @@ def reject_match(
     
     match.status = MatchStatus.REJECTED.value
     db.commit()
+    matching_service.exclusions.record(match.user_a_id, match.user_b_id, match.status)
     
     return {"message": "Match rejected"}
 
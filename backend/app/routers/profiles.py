@@ -10,6 +10,8 @@ from app.database import get_db
 from app.models import User, FitnessProfile
 from app.schemas.profile import FitnessProfileUpdate, FitnessProfileResponse
 from app.dependencies import get_current_user
+from app.services.matching_service import matching_service
+from app.services.gym_search import gym_search
 
 router = APIRouter(prefix="/profiles", tags=["Profiles"])
 
@@ -37,6 +39,7 @@ def get_my_fitness_profile(
         db.add(profile)
         db.commit()
         db.refresh(profile)
+        matching_service.sync_profile(profile)
     
     return profile
 
@@ -70,9 +73,12 @@ def update_my_fitness_profile(
         profile.preferred_days = profile_data.preferred_days
     if profile_data.bio is not None:
         profile.bio = profile_data.bio
+    previous_gym_id = profile.preferred_gym_id
     if profile_data.preferred_gym_id is not None:
         profile.preferred_gym_id = profile_data.preferred_gym_id
     
     db.commit()
     db.refresh(profile)
+    matching_service.sync_profile(profile)
+    gym_search.move_member(previous_gym_id, profile.preferred_gym_id)
     return profile
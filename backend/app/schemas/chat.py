@@ -24,5 +24,6 @@ class ChatRoomResponse(BaseModel):
     partner_id: str
     partner_name: str
     partner_avatar: Optional[str] = None
+    partner_online: bool = False
     last_message: Optional[MessageResponse] = None
     unread_count: int = 0
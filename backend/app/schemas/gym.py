@@ -24,3 +24,9 @@ class GymResponse(GymBase):
 class GymRecommendationResponse(GymResponse):
     distance_km: Optional[float] = None
     member_count: int = 0
+
+class GymSuggestion(BaseModel):
+    id: str
+    name: str
+    city: Optional[str] = None
+    member_count: int = 0
@@ -0,0 +1,77 @@
+"""
+Candidate Loader
+Query helpers that fetch users with everything matching needs in one round-trip
+"""
+
+from typing import List, Optional, Iterable
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import or_
+
+from app.models import User, FitnessProfile, GenderPreference
+
+
+def matching_load_options():
+    """
+    Eager-load options for the fields read by the recommender and the scorer:
+    the fitness profile, its preferred gym (coordinates) and the match preferences.
+    All are many-to-one / one-to-one, so they are joined into the same SELECT.
+    """
+    return (
+        joinedload(User.fitness_profile).joinedload(FitnessProfile.preferred_gym),
+        joinedload(User.match_preference),
+    )
+
+
+def load_matching_user(db: Session, user_id: str) -> Optional[User]:
+    """Load a single user with profile, gym and preferences eagerly."""
+    return db.query(User).options(*matching_load_options()).filter(User.id == user_id).first()
+
+
+def load_candidates(db: Session, user_ids: Iterable[str]) -> List[User]:
+    """Load active candidate users (with profiles) by id in a single query."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return []
+
+    return (
+        db.query(User)
+        .options(*matching_load_options())
+        .filter(User.id.in_(user_ids), User.is_active == True)
+        .all()
+    )
+
+
+def eligible_candidate_ids(db: Session, user: User, gym_ids: Optional[List[str]] = None) -> List[str]:
+    """
+    IDs of users the given user may be recommended, filtered in SQL:
+    active, has a profile, not the user, and within the user's gender / age
+    preferences (unknown gender or age passes). If `gym_ids` is given, only
+    users whose preferred gym is one of them, or who have not picked a gym
+    (unknown location passes too), are kept. Existing matches are
+    excluded separately via the in-memory MatchExclusionIndex.
+    """
+    query = (
+        db.query(User.id)
+        .join(FitnessProfile, FitnessProfile.user_id == User.id)
+        .filter(User.is_active == True, User.id != user.id)
+    )
+
+    prefs = user.match_preference
+    if prefs:
+        if prefs.gender_preference != GenderPreference.ANY.value:
+            query = query.filter(or_(
+                FitnessProfile.gender.is_(None),
+                FitnessProfile.gender == prefs.gender_preference,
+            ))
+        query = query.filter(or_(
+            FitnessProfile.age.is_(None),
+            FitnessProfile.age.between(prefs.min_age, prefs.max_age),
+        ))
+
+    if gym_ids is not None:
+        query = query.filter(or_(
+            FitnessProfile.preferred_gym_id.is_(None),
+            FitnessProfile.preferred_gym_id.in_(gym_ids),
+        ))
+
+    return [row.id for row in query.all()]
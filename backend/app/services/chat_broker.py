@@ -0,0 +1,192 @@
+"""
+Chat Broker
+Pub/sub backends that carry chat frames between ConnectionManagers
+"""
+
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, List, Optional, Set
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Called with (match_id, serialised frame) for every published frame
+Handler = Callable[[str, str], Awaitable[None]]
+
+
+class ChatBroker(ABC):
+    """
+    Interface between ConnectionManager and the transport that reaches every
+    worker. Each manager registers its handler once with `start`, then calls
+    `subscribe` when its first local socket joins a room and `unsubscribe`
+    when the last one leaves. `publish` delivers a frame to every manager
+    subscribed to the room, including the publishing one.
+
+    Backends may deliver frames for rooms that are not subscribed; managers
+    ignore rooms without local sockets.
+    """
+
+    @abstractmethod
+    async def start(self, handler: Handler) -> None:
+        ...
+
+    async def subscribe(self, match_id: str) -> None:
+        pass
+
+    async def unsubscribe(self, match_id: str) -> None:
+        pass
+
+    @abstractmethod
+    async def publish(self, match_id: str, text: str) -> None:
+        ...
+
+    async def stop(self) -> None:
+        pass
+
+
+class InProcessBroker(ChatBroker):
+    """Delivers directly to the managers of this process (single worker)."""
+
+    def __init__(self):
+        self._handlers: List[Handler] = []
+
+    async def start(self, handler: Handler) -> None:
+        self._handlers.append(handler)
+
+    async def publish(self, match_id: str, text: str) -> None:
+        for handler in list(self._handlers):
+            await handler(match_id, text)
+
+    async def stop(self) -> None:
+        self._handlers.clear()
+
+
+class RedisBroker(ChatBroker):
+    """
+    Redis pub/sub on one channel per match (`<prefix><match_id>`). Each worker
+    subscribes only to the rooms it has sockets in, so adding workers spreads
+    the fan-in instead of multiplying it. Requires the optional `redis`
+    package (or a compatible `client`, e.g. fakeredis in tests).
+
+    The listener survives handler errors (logged per frame) and lost
+    connections: it reconnects with exponential backoff, up to `retry_max`
+    seconds apart, and resubscribes to the current rooms. Frames published
+    while disconnected are lost, as with any Redis pub/sub consumer.
+    """
+
+    def __init__(
+        self,
+        url: str = "",
+        prefix: str = "gymbuddy:chat:",
+        client=None,
+        retry_max: float = 5.0,
+        poll_timeout: float = 1.0,
+    ):
+        if client is None:
+            try:
+                import redis.asyncio as aioredis
+            except ImportError as exc:
+                raise RuntimeError("RedisBroker requires the 'redis' package (pip install redis)") from exc
+            client = aioredis.from_url(url, decode_responses=True)
+
+        self._redis = client
+        self.prefix = prefix
+        self.retry_max = retry_max
+        self.poll_timeout = poll_timeout
+        self.rooms: Set[str] = set()
+        self._handler: Optional[Handler] = None
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+        # Set once a room has been subscribed, cleared when none are left
+        self._joined = asyncio.Event()
+
+    def _channel(self, match_id: str) -> str:
+        return f"{self.prefix}{match_id}"
+
+    async def start(self, handler: Handler) -> None:
+        self._handler = handler
+        self._pubsub = self._redis.pubsub()
+        self._listener = asyncio.create_task(self._listen())
+
+    async def subscribe(self, match_id: str) -> None:
+        self.rooms.add(match_id)
+        try:
+            await self._pubsub.subscribe(self._channel(match_id))
+        except Exception:
+            # The listener fails on the same connection and resubscribes every room
+            logger.warning("Could not subscribe to chat room %s", match_id, exc_info=True)
+        finally:
+            self._joined.set()
+
+    async def unsubscribe(self, match_id: str) -> None:
+        self.rooms.discard(match_id)
+        if not self.rooms:
+            self._joined.clear()
+        try:
+            await self._pubsub.unsubscribe(self._channel(match_id))
+        except Exception:
+            logger.warning("Could not unsubscribe from chat room %s", match_id, exc_info=True)
+
+    async def _resubscribe(self) -> None:
+        """Replace the pub/sub connection and subscribe to the current rooms again."""
+        stale, self._pubsub = self._pubsub, self._redis.pubsub()
+        try:
+            await stale.aclose()
+        except Exception:
+            pass
+        if self.rooms:
+            await self._pubsub.subscribe(*(self._channel(match_id) for match_id in self.rooms))
+
+    async def _listen(self) -> None:
+        delay = 0.0
+        reconnect = False
+        while True:
+            try:
+                if reconnect:
+                    await self._resubscribe()
+                    reconnect = False
+                if not self._joined.is_set():
+                    # Nothing to read until the first room is subscribed
+                    await self._joined.wait()
+                    continue
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=self.poll_timeout)
+                delay = 0.0
+            except Exception:
+                reconnect = True
+                delay = min(max(delay * 2, 0.1), self.retry_max)
+                logger.warning("Chat broker lost its Redis subscription, retrying in %.1fs", delay, exc_info=True)
+                await asyncio.sleep(delay)
+                continue
+
+            if message is None or message["type"] != "message":
+                continue
+            match_id = message["channel"][len(self.prefix):]
+            try:
+                await self._handler(match_id, message["data"])
+            except Exception:
+                logger.exception("Could not deliver a chat frame for room %s", match_id)
+
+    async def publish(self, match_id: str, text: str) -> None:
+        await self._redis.publish(self._channel(match_id), text)
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+        self.rooms.clear()
+        self._joined.clear()
+        await self._redis.aclose()
+
+
+def create_broker(url: str = settings.CHAT_BROKER_URL) -> ChatBroker:
+    """Broker for the configured URL: empty for in-process, `redis://...` for Redis."""
+    if not url:
+        return InProcessBroker()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBroker(url)
+    raise ValueError(f"Unsupported CHAT_BROKER_URL: {url}")
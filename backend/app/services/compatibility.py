@@ -0,0 +1,141 @@
+"""
+Compatibility Kernel
+Bitset-packed profile attributes and popcount-based overlap scoring
+"""
+
+from typing import Iterable, NamedTuple, Optional, Tuple, Type
+from enum import Enum
+
+import numpy as np
+
+from app.schemas.profile import FitnessGoal, WorkoutType, WorkoutDay
+
+MASK_BITS = 64
+
+
+class BitVocabulary:
+    """
+    Maps category values to fixed bit positions in a 64-bit mask.
+
+    Values outside the enum (legacy rows) are ignored, as in the recommender's
+    ProfileEncoder, so both scorers see the same categories.
+    """
+
+    def __init__(self, vocabulary: Type[Enum]):
+        self._bits = {member.value: i for i, member in enumerate(vocabulary)}
+        if len(self._bits) > MASK_BITS:
+            raise ValueError(f"{vocabulary.__name__} has more than {MASK_BITS} members")
+
+    def bit(self, value: str) -> Optional[int]:
+        """Bit position of a value, or None if it is not in the vocabulary."""
+        return self._bits.get(value)
+
+    def mask(self, values: Optional[Iterable[str]]) -> int:
+        """Pack a list of values into an integer bitmask, skipping unknown values."""
+        mask = 0
+        for value in values or ():
+            bit = self._bits.get(value)
+            if bit is not None:
+                mask |= 1 << bit
+        return mask
+
+
+GOALS = BitVocabulary(FitnessGoal)
+WORKOUT_TYPES = BitVocabulary(WorkoutType)
+DAYS = BitVocabulary(WorkoutDay)
+
+
+class ProfileBits(NamedTuple):
+    """Bitmask form of the set-valued profile fields."""
+    goals: int
+    workout_types: int
+    days: int
+
+
+def pack_profile(profile) -> ProfileBits:
+    """Pack a FitnessProfile's goals, workout types and preferred days into bitmasks."""
+    return ProfileBits(
+        goals=GOALS.mask(profile.goals),
+        workout_types=WORKOUT_TYPES.mask(profile.workout_types),
+        days=DAYS.mask(profile.preferred_days),
+    )
+
+
+def pack_profiles(profiles) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Pack many profiles into (goals, workout_types, days) uint64 arrays."""
+    packed = [pack_profile(p) for p in profiles]
+    return tuple(
+        np.fromiter((bits[i] for bits in packed), dtype=np.uint64, count=len(packed))
+        for i in range(3)
+    )
+
+
+def jaccard(a: int, b: int) -> float:
+    """Jaccard overlap of two bitmasks (0.0 when both are empty)."""
+    union = (a | b).bit_count()
+    if not union:
+        return 0.0
+    return (a & b).bit_count() / union
+
+
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def popcount(masks: np.ndarray) -> np.ndarray:
+    """Per-element popcount of a uint64 array."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(masks)
+    masks = np.ascontiguousarray(masks, dtype=np.uint64)
+    return _POPCOUNT_TABLE[masks.view(np.uint8)].reshape(masks.shape + (8,)).sum(axis=-1)
+
+
+def jaccard_many(a: int, b: np.ndarray) -> np.ndarray:
+    """Jaccard overlap of one bitmask against an array of candidate bitmasks."""
+    a = np.uint64(a)
+    union = popcount(b | a).astype(np.float64)
+    shared = popcount(b & a).astype(np.float64)
+    return np.divide(shared, union, out=np.zeros_like(union), where=union > 0)
+
+
+def goal_alignment(a: ProfileBits, b: ProfileBits) -> float:
+    """Score (0-1) from shared goals (60%) and workout types (40%)."""
+    if not a.goals or not b.goals:
+        return 0.0
+
+    goals_score = jaccard(a.goals, b.goals)
+
+    if not a.workout_types or not b.workout_types:
+        types_score = 0.0
+    else:
+        types_score = jaccard(a.workout_types, b.workout_types)
+
+    return (goals_score * 0.6) + (types_score * 0.4)
+
+
+def goal_alignment_many(a: ProfileBits, goals: np.ndarray, workout_types: np.ndarray) -> np.ndarray:
+    """Batched `goal_alignment` of one user against candidate goal / type arrays."""
+    if not a.goals:
+        return np.zeros(len(goals))
+
+    goals_score = np.where(goals != 0, jaccard_many(a.goals, goals), 0.0)
+
+    if not a.workout_types:
+        types_score = np.zeros(len(workout_types))
+    else:
+        types_score = np.where(workout_types != 0, jaccard_many(a.workout_types, workout_types), 0.0)
+
+    return np.where(goals != 0, (goals_score * 0.6) + (types_score * 0.4), 0.0)
+
+
+def days_overlap(a: ProfileBits, b: ProfileBits) -> float:
+    """Score (0-1) from shared preferred days."""
+    if not a.days or not b.days:
+        return 0.0
+    return jaccard(a.days, b.days)
+
+
+def days_overlap_many(a: ProfileBits, days: np.ndarray) -> np.ndarray:
+    """Batched `days_overlap` of one user against a candidate days array."""
+    if not a.days:
+        return np.zeros(len(days))
+    return np.where(days != 0, jaccard_many(a.days, days), 0.0)
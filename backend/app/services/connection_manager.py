@@ -0,0 +1,419 @@
+"""
+Chat Connection Manager
+Tracks WebSocket connections per match room and fans messages out to them
+"""
+
+import asyncio
+import json
+import time
+import uuid
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+
+from fastapi import WebSocket
+
+from app.config import settings
+from app.services.chat_broker import ChatBroker, InProcessBroker
+from app.services.wire_format import MSGPACK_SUBPROTOCOL, to_msgpack
+
+# Broker channel for user-level presence between workers (match ids are UUIDs)
+PRESENCE_CHANNEL = "presence"
+PING_FRAME = '{"type":"ping"}'
+
+
+class Connection:
+    """
+    One open WebSocket with its own bounded send queue.
+
+    A background task drains the queue so a slow client only delays itself;
+    a client whose queue overflows or whose send times out or fails is dropped.
+    Inbound frames are metered by a token bucket (`rate` per second, up to
+    `burst` at once), and `last_seen` tracks activity for idle eviction.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        match_id: str,
+        queue_size: int,
+        user_id: Optional[str] = None,
+        rate: float = settings.CHAT_RATE_LIMIT_PER_SECOND,
+        burst: int = settings.CHAT_RATE_LIMIT_BURST,
+        subprotocol: Optional[str] = None,
+    ):
+        self.websocket = websocket
+        self.match_id = match_id
+        self.user_id = user_id
+        # Frames are queued as JSON text and re-encoded at send time for MessagePack sockets
+        self.binary = subprotocol == MSGPACK_SUBPROTOCOL
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.sender: Optional[asyncio.Task] = None
+        self.closed = False
+        self.last_seen = time.monotonic()
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+
+    def touch(self) -> bool:
+        """Record an inbound frame. False if it exceeds the rate limit."""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self.last_seen) * self.rate)
+        self.last_seen = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+
+class ConnectionManager:
+    """
+    Local WebSocket connections of this worker, grouped by match room.
+
+    Broadcasts go through the broker, which hands every frame back to each
+    subscribed manager (in this or another process) for delivery to its own
+    sockets. The manager subscribes to a room when its first local socket
+    joins and unsubscribes once the room has no local sockets left.
+
+    Presence and typing are ephemeral and never persisted. `online` holds the
+    open sockets per user on this worker; a presence event is sent to a room
+    only when a user's first socket joins it or their last one leaves, and
+    typing events are coalesced to one per `typing_interval` per user and room.
+    Across workers, each manager announces on the broker's presence channel
+    when a user's first local socket opens or their last one closes, and
+    re-announces its online users every heartbeat. `remote_online` collects
+    other workers' announcements; entries a worker stops refreshing (e.g.
+    it crashed) expire after three ping intervals.
+
+    To keep memory bounded under flaky mobile connections, a heartbeat pings
+    every socket each `ping_interval` and evicts those silent for longer than
+    `idle_timeout`, and a user's oldest socket is closed once they exceed
+    `max_connections_per_user`.
+    """
+
+    def __init__(
+        self,
+        broker: Optional[ChatBroker] = None,
+        queue_size: int = settings.CHAT_SEND_QUEUE_SIZE,
+        send_timeout: float = settings.CHAT_SEND_TIMEOUT_SECONDS,
+        typing_interval: float = settings.CHAT_TYPING_INTERVAL_SECONDS,
+        ping_interval: float = settings.CHAT_PING_INTERVAL_SECONDS,
+        idle_timeout: float = settings.CHAT_IDLE_TIMEOUT_SECONDS,
+        max_connections_per_user: int = settings.CHAT_MAX_CONNECTIONS_PER_USER,
+    ):
+        # Maps match_id to the active connections in that room
+        self.active_connections: Dict[str, List[Connection]] = {}
+        self.broker = broker or InProcessBroker()
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self.typing_interval = typing_interval
+        self.ping_interval = ping_interval
+        self.idle_timeout = idle_timeout
+        self.max_connections_per_user = max_connections_per_user
+        self.online: Dict[str, List[Connection]] = {}
+        self.worker_id = uuid.uuid4().hex
+        # user_id -> {worker_id: expiry (monotonic, None = until announced offline)}
+        self.remote_online: Dict[str, Dict[str, Optional[float]]] = {}
+        self.counters: Counter = Counter()
+        self._last_typing: Dict[Tuple[str, str], float] = {}
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._subscribed = False
+        # Rooms this manager is subscribed to on the broker
+        self._rooms: Set[str] = set()
+        # Users this manager has announced as online to other workers
+        self._announced: Set[str] = set()
+
+    async def _ensure_subscribed(self):
+        if not self._subscribed:
+            self._subscribed = True
+            await self.broker.start(self.deliver)
+            await self.broker.subscribe(PRESENCE_CHANNEL)
+            # Ask the other workers who is online instead of waiting for their heartbeat
+            await self._announce([], True, sync=True)
+        if self._heartbeat is None and self.ping_interval:
+            self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+
+    async def close(self):
+        """Unsubscribe from the broker and stop the heartbeat (on shutdown)."""
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+        if self._subscribed:
+            if self._announced:
+                await self._announce(self._announced, False)
+            self._subscribed = False
+            self._rooms.clear()
+            self._announced.clear()
+            await self.broker.stop()
+
+    async def connect(
+        self,
+        websocket: WebSocket,
+        match_id: str,
+        user_id: Optional[str] = None,
+        subprotocol: Optional[str] = None,
+    ) -> Connection:
+        await self._ensure_subscribed()
+        await websocket.accept(subprotocol=subprotocol)
+        connection = Connection(websocket, match_id, self.queue_size, user_id, subprotocol=subprotocol)
+        connection.sender = asyncio.create_task(self._send_loop(connection))
+        room = self.active_connections.get(match_id, [])
+        self.counters["connections_opened"] += 1
+
+        if user_id is not None:
+            sockets = self.online.setdefault(user_id, [])
+            sockets.append(connection)
+            # Oldest sockets first: usually half-open ones left behind by a reconnect
+            while len(sockets) > self.max_connections_per_user:
+                self.counters["evicted_over_cap"] += 1
+                await self._drop(sockets[0], code=1008)
+
+            # Tell the room the user arrived (before joining, so not echoed locally)
+            if all(c.user_id != user_id for c in room):
+                await self.broker.publish(match_id, self._presence_frame(match_id, user_id, True))
+            # ...and the newcomer who is already here
+            for other_id in {c.user_id for c in room if c.user_id and c.user_id != user_id}:
+                connection.queue.put_nowait(self._presence_frame(match_id, other_id, True))
+
+        self.active_connections.setdefault(match_id, []).append(connection)
+        # Registered first, so a concurrent `_sync_broker` cannot drop the subscription
+        if match_id not in self._rooms:
+            self._rooms.add(match_id)
+            await self.broker.subscribe(match_id)
+        if user_id is not None and user_id not in self._announced:
+            self._announced.add(user_id)
+            await self._announce([user_id], True)
+        return connection
+
+    def disconnect(self, websocket: WebSocket, match_id: str) -> bool:
+        """Unregister a socket. True if that was its user's last socket in the room."""
+        left = False
+        for connection in list(self.active_connections.get(match_id, [])):
+            if connection.websocket is websocket:
+                left = self._remove(connection) or left
+        return left
+
+    async def leave(self, websocket: WebSocket, match_id: str, user_id: Optional[str] = None):
+        """Unregister a socket and announce the user going offline in the room."""
+        if self.disconnect(websocket, match_id) and user_id is not None:
+            await self.broker.publish(match_id, self._presence_frame(match_id, user_id, False))
+        await self._sync_broker()
+
+    async def _sync_broker(self):
+        """
+        Unsubscribe from rooms that no longer have local sockets and announce
+        users whose last local socket closed as offline.
+        """
+        for match_id in [m for m in self._rooms if m not in self.active_connections]:
+            self._rooms.discard(match_id)
+            await self.broker.unsubscribe(match_id)
+        departed = [user_id for user_id in self._announced if user_id not in self.online]
+        if departed:
+            self._announced.difference_update(departed)
+            await self._announce(departed, False)
+
+    async def _announce(self, user_ids, online: bool, sync: bool = False):
+        frame = {"worker": self.worker_id, "users": sorted(user_ids), "online": online}
+        if sync:
+            frame["sync"] = True
+        await self.broker.publish(PRESENCE_CHANNEL, json.dumps(frame, separators=(",", ":")))
+
+    async def _track_remote(self, text: str):
+        """Apply another worker's presence announcement (answering a new worker's sync request)."""
+        frame = json.loads(text)
+        worker = frame["worker"]
+        if worker == self.worker_id:
+            return
+        if frame.get("sync") and self._announced:
+            await self._announce(self._announced, True)
+        expires = time.monotonic() + 3 * self.ping_interval if self.ping_interval else None
+        for user_id in frame["users"]:
+            workers = self.remote_online.setdefault(user_id, {})
+            if frame["online"]:
+                workers[worker] = expires
+            else:
+                workers.pop(worker, None)
+            if not workers:
+                del self.remote_online[user_id]
+
+    def is_online(self, user_id: str) -> bool:
+        """True if the user has a socket on this or (per its announcements) any other worker."""
+        if self.online.get(user_id):
+            return True
+        now = time.monotonic()
+        workers = self.remote_online.get(user_id, {})
+        return any(expires is None or expires > now for expires in workers.values())
+
+    def _remove(self, connection: Connection) -> bool:
+        """
+        Detach a connection from its room and stop its sender (idempotent).
+        Returns True if it was its user's last connection in the room.
+        """
+        if connection.closed:
+            return False
+        connection.closed = True
+
+        room = self.active_connections.get(connection.match_id)
+        if room and connection in room:
+            room.remove(connection)
+            if not room:
+                del self.active_connections[connection.match_id]
+
+        if connection.sender and connection.sender is not asyncio.current_task():
+            connection.sender.cancel()
+
+        user_id = connection.user_id
+        if user_id is None:
+            return False
+        sockets = self.online.get(user_id, [])
+        if connection in sockets:
+            sockets.remove(connection)
+        if not sockets:
+            self.online.pop(user_id, None)
+        if any(c.user_id == user_id for c in room or []):
+            return False
+        self._last_typing.pop((connection.match_id, user_id), None)
+        return True
+
+    @staticmethod
+    def _presence_frame(match_id: str, user_id: str, online: bool) -> str:
+        return json.dumps(
+            {"type": "presence", "match_id": match_id, "user_id": user_id, "online": online},
+            separators=(",", ":"),
+        )
+
+    def receive(self, connection: Connection) -> bool:
+        """
+        Account for an inbound frame. False if the frame should be ignored because
+        the connection is over its rate limit (the client gets an error frame).
+        """
+        if connection.touch():
+            return True
+        self.counters["frames_rate_limited"] += 1
+        self.error(connection, "rate limited")
+        return False
+
+    def error(self, connection: Connection, detail: str):
+        """Queue an error frame for one client; skipped if its send queue is full."""
+        try:
+            connection.queue.put_nowait(
+                json.dumps({"type": "error", "detail": detail}, separators=(",", ":"))
+            )
+        except asyncio.QueueFull:
+            pass
+
+    async def typing(self, match_id: str, user_id: str):
+        """Broadcast a typing event, at most once per `typing_interval` per user and room."""
+        now = time.monotonic()
+        key = (match_id, user_id)
+        last = self._last_typing.get(key)
+        if last is not None and now - last < self.typing_interval:
+            return
+        self._last_typing[key] = now
+        await self.broadcast_to_match({"type": "typing", "match_id": match_id, "user_id": user_id}, match_id)
+
+    async def _drop(self, connection: Connection, code: int = 1011):
+        """Remove a dead, too-slow or evicted client and close its socket (best effort)."""
+        if self._remove(connection) and connection.user_id is not None:
+            await self.broker.publish(
+                connection.match_id, self._presence_frame(connection.match_id, connection.user_id, False)
+            )
+        await self._sync_broker()
+        try:
+            await asyncio.wait_for(connection.websocket.close(code=code), self.send_timeout)
+        except Exception:
+            pass
+
+    async def _send_loop(self, connection: Connection):
+        while True:
+            text = await connection.queue.get()
+            try:
+                if connection.binary:
+                    send = connection.websocket.send_bytes(to_msgpack(text))
+                else:
+                    send = connection.websocket.send_text(text)
+                await asyncio.wait_for(send, self.send_timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.counters["dropped_send_failed"] += 1
+                await self._drop(connection)
+                return
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            await self.sweep()
+
+    async def sweep(self):
+        """Evict connections idle past `idle_timeout` and ping the rest."""
+        now = time.monotonic()
+        for connection in [c for room in self.active_connections.values() for c in room]:
+            if now - connection.last_seen > self.idle_timeout:
+                self.counters["evicted_idle"] += 1
+                await self._drop(connection, code=1001)
+                continue
+            try:
+                connection.queue.put_nowait(PING_FRAME)
+            except asyncio.QueueFull:
+                self.counters["dropped_slow"] += 1
+                await self._drop(connection)
+        # Also catches sockets removed through the synchronous `disconnect`
+        await self._sync_broker()
+        # Refresh this worker's users on the others, and forget expired remote entries
+        if self._announced:
+            await self._announce(self._announced, True)
+        for user_id, workers in list(self.remote_online.items()):
+            for worker, expires in list(workers.items()):
+                if expires is not None and expires <= now:
+                    del workers[worker]
+            if not workers:
+                del self.remote_online[user_id]
+
+    def metrics(self) -> Dict[str, int]:
+        """Live socket gauges and lifetime counters for this worker."""
+        return {
+            "connections": sum(len(room) for room in self.active_connections.values()),
+            "rooms": len(self.active_connections),
+            "users_online": len(self.online),
+            "queued_frames": sum(c.queue.qsize() for room in self.active_connections.values() for c in room),
+            **{name: self.counters[name] for name in (
+                "connections_opened",
+                "evicted_idle",
+                "evicted_over_cap",
+                "dropped_slow",
+                "dropped_send_failed",
+                "frames_rate_limited",
+            )},
+        }
+
+    async def broadcast_to_match(self, message: dict, match_id: str):
+        """
+        Publish a message to the room on every worker. The payload is
+        serialised once and shared by all recipients.
+        """
+        await self._ensure_subscribed()
+        text = json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+        await self.broker.publish(match_id, text)
+
+    async def deliver(self, match_id: str, text: str):
+        """
+        Queue a frame for every local connection in the room without waiting
+        on any of them.
+        """
+        if match_id == PRESENCE_CHANNEL:
+            await self._track_remote(text)
+            return
+        connections = self.active_connections.get(match_id)
+        if not connections:
+            return
+
+        overflowed = []
+        for connection in list(connections):
+            try:
+                connection.queue.put_nowait(text)
+            except asyncio.QueueFull:
+                overflowed.append(connection)
+
+        if overflowed:
+            self.counters["dropped_slow"] += len(overflowed)
+            await asyncio.gather(*(self._drop(connection) for connection in overflowed))
@@ -0,0 +1,104 @@
+"""
+Match Exclusion Index
+In-memory record of who each user already has a match with
+"""
+
+import threading
+import time
+from typing import Dict, Iterable, Set, Tuple
+from sqlalchemy.orm import Session
+from sqlalchemy import and_, or_
+
+from app.config import settings
+from app.models import Match
+
+
+class MatchExclusionIndex:
+    """
+    Per-user map of partner_id -> match status, covering both match directions.
+
+    A user's entry is loaded from the `matches` table on first use, kept current
+    by `record` when matches are created, accepted or rejected in this process,
+    and reloaded once it is older than `ttl` seconds so matches written by other
+    workers are picked up (0 keeps entries until `clear`). Any status (pending,
+    accepted, rejected) excludes the pair from recommendations.
+    """
+
+    def __init__(self, ttl: float = settings.RECOMMENDER_RELOAD_SECONDS):
+        self.ttl = ttl
+        self._partners: Dict[str, Tuple[float, Dict[str, str]]] = {}
+        self._swept_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _load(self, db: Session, user_id: str) -> Dict[str, str]:
+        rows = db.query(Match.user_a_id, Match.user_b_id, Match.status).filter(
+            or_(Match.user_a_id == user_id, Match.user_b_id == user_id)
+        ).all()
+        return {
+            (row.user_b_id if row.user_a_id == user_id else row.user_a_id): row.status
+            for row in rows
+        }
+
+    def _expired(self, loaded_at: float, now: float) -> bool:
+        return bool(self.ttl) and now - loaded_at >= self.ttl
+
+    def _sweep(self, now: float) -> None:
+        """Drop expired entries so users who went quiet don't stay cached (caller holds the lock)."""
+        if not self.ttl or now - self._swept_at < self.ttl:
+            return
+        for user_id in [u for u, (loaded_at, _) in self._partners.items() if self._expired(loaded_at, now)]:
+            del self._partners[user_id]
+        self._swept_at = now
+
+    def excluded(self, db: Session, user_id: str) -> Set[str]:
+        """IDs of every user the given user already has a match with."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._partners.get(user_id)
+        if entry is None or self._expired(entry[0], now):
+            partners = self._load(db, user_id)
+            with self._lock:
+                self._sweep(now)
+                current = self._partners.get(user_id)
+                if current is None or current[0] < now:
+                    self._partners[user_id] = (now, partners)
+                else:
+                    partners = current[1]
+        else:
+            partners = entry[1]
+        with self._lock:
+            return set(partners)
+
+    def matched(self, db: Session, user_id: str, candidate_ids: Iterable[str]) -> Set[str]:
+        """
+        Which of `candidate_ids` already have a match with the user, read from the
+        database. Catches matches made on other workers since the entry was loaded;
+        any found are recorded so later calls exclude them up front.
+        """
+        candidate_ids = list(candidate_ids)
+        if not candidate_ids:
+            return set()
+        rows = db.query(Match.user_a_id, Match.user_b_id, Match.status).filter(
+            or_(
+                and_(Match.user_a_id == user_id, Match.user_b_id.in_(candidate_ids)),
+                and_(Match.user_b_id == user_id, Match.user_a_id.in_(candidate_ids)),
+            )
+        ).all()
+        found = set()
+        for row in rows:
+            self.record(row.user_a_id, row.user_b_id, row.status)
+            found.add(row.user_b_id if row.user_a_id == user_id else row.user_a_id)
+        return found
+
+    def record(self, user_a_id: str, user_b_id: str, status: str) -> None:
+        """Record a match creation or status change for both users."""
+        with self._lock:
+            # Users not loaded yet will read the committed row on first use
+            if user_a_id in self._partners:
+                self._partners[user_a_id][1][user_b_id] = status
+            if user_b_id in self._partners:
+                self._partners[user_b_id][1][user_a_id] = status
+
+    def clear(self) -> None:
+        with self._lock:
+            self._partners.clear()
@@ -0,0 +1,135 @@
+"""
+Gym Geo Index
+In-process spatial index over gym coordinates
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sklearn.neighbors import BallTree
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models import Gym
+from app.services.periodic_reload import PeriodicReload
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE_LAT = 111.0
+
+
+def haversine_km(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Vectorised Haversine distance (km) from one point to arrays of points."""
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    lats, lons = np.radians(np.asarray(lats, dtype=np.float64)), np.radians(np.asarray(lons, dtype=np.float64))
+    a = np.sin((lats - lat1) / 2)**2 + np.cos(lat1) * np.cos(lats) * np.sin((lons - lon1) / 2)**2
+    return EARTH_RADIUS_KM * 2 * np.arcsin(np.sqrt(a))
+
+
+def bounding_box(lat: float, lon: float, radius_km: float) -> Tuple[float, float, Optional[float], Optional[float]]:
+    """
+    (min_lat, max_lat, min_lon, max_lon) enclosing a circle of `radius_km`, for SQL prefiltering.
+    Longitude bounds are None when the box reaches a pole or crosses the antimeridian.
+    """
+    dlat = radius_km / KM_PER_DEGREE_LAT
+    min_lat, max_lat = lat - dlat, lat + dlat
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90.0), min(max_lat, 90.0), None, None
+
+    dlon = dlat / np.cos(np.radians(lat))
+    min_lon, max_lon = lon - dlon, lon + dlon
+    if min_lon < -180 or max_lon > 180:
+        return min_lat, max_lat, None, None
+    return min_lat, max_lat, float(min_lon), float(max_lon)
+
+
+def _load_coords(db: Session) -> Dict[str, Tuple[float, float]]:
+    rows = db.query(Gym.id, Gym.latitude, Gym.longitude).filter(
+        Gym.is_active == True,
+        Gym.latitude.isnot(None),
+        Gym.longitude.isnot(None),
+    ).all()
+    return {row.id: (row.latitude, row.longitude) for row in rows}
+
+
+def _apply_coords(coords: Dict[str, Tuple[float, float]], gym_id: str, point: Optional[Tuple[float, float]]) -> None:
+    if point is None:
+        coords.pop(gym_id, None)
+    else:
+        coords[gym_id] = point
+
+
+class GymGeoIndex:
+    """
+    Ball tree (haversine metric, radians) over the coordinates of active gyms.
+
+    The coordinates are loaded and periodically reloaded from the database via
+    `PeriodicReload` (every `reload_interval` seconds), which picks up gyms
+    created or changed on other workers; in between, `upsert` / `remove`
+    apply this worker's changes. The tree is rebuilt lazily on the next query
+    after a change.
+    """
+
+    def __init__(self, reload_interval: float = settings.GYM_INDEX_RELOAD_SECONDS):
+        self._reload: PeriodicReload[Dict[str, Tuple[float, float]]] = PeriodicReload(
+            _load_coords, _apply_coords, reload_interval,
+        )
+        self._gym_ids: List[str] = []
+        self._tree: Optional[BallTree] = None
+        # Reload version the tree was built from
+        self._tree_version = -1
+
+    def ensure_loaded(self, db: Session) -> None:
+        """Load every active gym with coordinates, on first use and once stale."""
+        self._reload.ensure_loaded(db)
+
+    def upsert(self, gym: Gym) -> None:
+        """Add or move a gym (inactive gyms or gyms without coordinates are dropped)."""
+        if not gym.is_active or gym.latitude is None or gym.longitude is None:
+            self._reload.change(gym.id, None)
+        else:
+            self._reload.change(gym.id, (gym.latitude, gym.longitude))
+
+    def remove(self, gym_id: str) -> None:
+        self._reload.change(gym_id, None)
+
+    def clear(self) -> None:
+        self._reload.clear()
+
+    def _current_tree(self) -> Tuple[Optional[BallTree], List[str]]:
+        with self._reload.lock:
+            if self._tree_version != self._reload.version:
+                coords = self._reload.value or {}
+                self._gym_ids = list(coords)
+                if self._gym_ids:
+                    points = np.radians(np.array([coords[g] for g in self._gym_ids], dtype=np.float64))
+                    self._tree = BallTree(points, metric="haversine")
+                else:
+                    self._tree = None
+                self._tree_version = self._reload.version
+            return self._tree, self._gym_ids
+
+    def within(self, lat: float, lon: float, radius_km: float) -> List[Tuple[str, float]]:
+        """(gym_id, distance_km) of every gym within `radius_km`, nearest first."""
+        tree, gym_ids = self._current_tree()
+        if tree is None:
+            return []
+
+        point = np.radians([[lat, lon]])
+        indices, distances = tree.query_radius(
+            point, r=radius_km / EARTH_RADIUS_KM, return_distance=True, sort_results=True
+        )
+        return [(gym_ids[i], float(d) * EARTH_RADIUS_KM) for i, d in zip(indices[0], distances[0])]
+
+    def nearest(self, lat: float, lon: float, k: int) -> List[Tuple[str, float]]:
+        """(gym_id, distance_km) of the `k` nearest gyms, nearest first."""
+        tree, gym_ids = self._current_tree()
+        if tree is None or k <= 0:
+            return []
+
+        point = np.radians([[lat, lon]])
+        distances, indices = tree.query(point, k=min(k, len(gym_ids)))
+        return [(gym_ids[i], float(d) * EARTH_RADIUS_KM) for i, d in zip(indices[0], distances[0])]
+
+
+# Shared instance, used by recommendations and gym search
+gym_index = GymGeoIndex()
@@ -0,0 +1,277 @@
+"""
+Gym Search Index
+In-process trigram / prefix inverted index over gym names and cities
+"""
+
+import bisect
+import heapq
+import re
+import unicodedata
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+from sqlalchemy import func
+
+from app.config import settings
+from app.models import Gym, FitnessProfile
+from app.services.periodic_reload import PeriodicReload
+
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+
+def normalize(text: str) -> str:
+    """Lowercase, strip accents and collapse punctuation / whitespace to single spaces."""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    return _NON_ALNUM.sub(" ", text.lower()).strip()
+
+
+def trigrams(token: str) -> Set[str]:
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+class _SearchState:
+    """
+    One generation of the index: postings, sorted prefix arrays and member
+    counts. Built in bulk by a load (sorted once by `finish_load`), then kept
+    sorted incrementally by `replace`.
+    """
+
+    def __init__(self):
+        self.docs: Dict[str, Tuple[str, str]] = {}
+        self.trigrams: Dict[str, Set[str]] = {}
+        self.words: Dict[str, Set[str]] = {}
+        self.sorted_words: List[str] = []
+        self.display: Dict[str, Tuple[str, Optional[str]]] = {}
+        self.suggest_keys: List[Tuple[str, str]] = []
+        self.members: Dict[str, int] = {}
+        self._sorted = True
+
+    @staticmethod
+    def _keys(doc: Tuple[str, str]) -> Set[str]:
+        """Autocomplete keys for a normalised (name, city) pair."""
+        name, city = doc
+        keys = {name, city} | set(name.split())
+        keys.discard("")
+        return keys
+
+    def bulk_add(self, gym_id: str, name: str, city: str) -> None:
+        """Add a gym during a load; `finish_load` sorts the prefix arrays once."""
+        self._sorted = False
+        self._add(gym_id, name, city)
+
+    def finish_load(self) -> None:
+        self.sorted_words = sorted(self.words)
+        self.suggest_keys.sort()
+        self._sorted = True
+
+    def _add(self, gym_id: str, name: str, city: str) -> None:
+        doc = (normalize(name), normalize(city))
+        self.docs[gym_id] = doc
+        self.display[gym_id] = (name, city)
+        for field in doc:
+            for word in field.split():
+                if word not in self.words:
+                    self.words[word] = set()
+                    if self._sorted:
+                        bisect.insort(self.sorted_words, word)
+                self.words[word].add(gym_id)
+                for gram in trigrams(word):
+                    self.trigrams.setdefault(gram, set()).add(gym_id)
+        for key in self._keys(doc):
+            if self._sorted:
+                bisect.insort(self.suggest_keys, (key, gym_id))
+            else:
+                self.suggest_keys.append((key, gym_id))
+
+    def _discard(self, gym_id: str) -> None:
+        doc = self.docs.pop(gym_id, None)
+        if doc is None:
+            return
+        self.display.pop(gym_id, None)
+        for key in self._keys(doc):
+            i = bisect.bisect_left(self.suggest_keys, (key, gym_id))
+            if i < len(self.suggest_keys) and self.suggest_keys[i] == (key, gym_id):
+                del self.suggest_keys[i]
+        for field in doc:
+            for word in field.split():
+                self.words.get(word, set()).discard(gym_id)
+                if not self.words.get(word, True):
+                    del self.words[word]
+                    i = bisect.bisect_left(self.sorted_words, word)
+                    if i < len(self.sorted_words) and self.sorted_words[i] == word:
+                        del self.sorted_words[i]
+                for gram in trigrams(word):
+                    self.trigrams.get(gram, set()).discard(gym_id)
+
+    def replace(self, gym_id: str, display: Optional[Tuple[str, Optional[str]]]) -> None:
+        """Re-index one gym from its (name, city), or drop it for None."""
+        self._discard(gym_id)
+        if display is not None:
+            self._add(gym_id, *display)
+
+    def candidates(self, token: str) -> Set[str]:
+        """Gyms that may contain the token: trigram intersection, or word prefix for short tokens."""
+        if len(token) >= 3:
+            postings = [self.trigrams.get(gram, set()) for gram in trigrams(token)]
+            postings.sort(key=len)
+            return set.intersection(*postings) if postings else set()
+
+        found: Set[str] = set()
+        words = self.sorted_words
+        start = bisect.bisect_left(words, token)
+        end = bisect.bisect_left(words, token + "\uffff", start)
+        for i in range(start, end):
+            found |= self.words[words[i]]
+        return found
+
+    def prefix_matches(self, prefix: str) -> Set[str]:
+        """Gyms with an autocomplete key starting with the (normalised) prefix."""
+        # Every key starting with the prefix sorts between prefix and prefix + U+FFFF
+        keys = self.suggest_keys
+        start = bisect.bisect_left(keys, (prefix, ""))
+        end = bisect.bisect_left(keys, (prefix + "\uffff",), start)
+        return {keys[i][1] for i in range(start, end)}
+
+
+def _load_state(db: Session) -> _SearchState:
+    rows = db.query(Gym.id, Gym.name, Gym.city).filter(Gym.is_active == True).all()
+    counts = (
+        db.query(FitnessProfile.preferred_gym_id, func.count(FitnessProfile.id))
+        .filter(FitnessProfile.preferred_gym_id.isnot(None))
+        .group_by(FitnessProfile.preferred_gym_id)
+        .all()
+    )
+    state = _SearchState()
+    state.members = dict(counts)
+    for row in rows:
+        state.bulk_add(row.id, row.name, row.city)
+    state.finish_load()
+    return state
+
+
+class GymSearchIndex:
+    """
+    Inverted index over the normalised name and city of active gyms.
+
+    Query tokens of 3+ characters are looked up by trigram (substring match),
+    shorter tokens by word prefix. A gym matches when every query token occurs
+    in its name or city. Loaded and periodically rebuilt from the database via
+    `PeriodicReload` (every `reload_interval` seconds), which picks up gyms
+    created or changed on other workers; in between, `upsert` applies this
+    worker's changes.
+
+    For autocomplete it also keeps a sorted array of (key, gym_id) entries,
+    where keys are the normalised name, city and name words, plus per-gym
+    member counts maintained via `move_member` (and recounted on reload), so
+    `suggest` is served from memory only.
+    """
+
+    def __init__(self, reload_interval: float = settings.GYM_INDEX_RELOAD_SECONDS):
+        self._reload: PeriodicReload[_SearchState] = PeriodicReload(
+            _load_state, lambda state, gym_id, display: state.replace(gym_id, display), reload_interval,
+        )
+
+    @property
+    def reload_interval(self) -> float:
+        return self._reload.interval
+
+    def ensure_loaded(self, db: Session) -> None:
+        """Index every active gym, on first use and once stale."""
+        self._reload.ensure_loaded(db)
+
+    def upsert(self, gym: Gym) -> None:
+        """Add or re-index a gym (inactive gyms are removed)."""
+        self._reload.change(gym.id, (gym.name, gym.city) if gym.is_active else None)
+
+    def remove(self, gym_id: str) -> None:
+        self._reload.change(gym_id, None)
+
+    def clear(self) -> None:
+        self._reload.clear()
+
+    def move_member(self, old_gym_id: Optional[str], new_gym_id: Optional[str]) -> None:
+        """Keep member counts current when a profile's preferred gym changes."""
+        if old_gym_id == new_gym_id:
+            return
+        with self._reload.lock:
+            state = self._reload.value
+            if state is None:
+                return
+            if old_gym_id and state.members.get(old_gym_id):
+                state.members[old_gym_id] -= 1
+            if new_gym_id:
+                state.members[new_gym_id] = state.members.get(new_gym_id, 0) + 1
+
+    def suggest(self, prefix: str, limit: int = 10) -> List[Dict]:
+        """Top `limit` gyms (by member count) whose name, city or a name word starts with `prefix`."""
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+
+        with self._reload.lock:
+            state = self._reload.value
+            if state is None:
+                return []
+            top = heapq.nsmallest(
+                limit,
+                state.prefix_matches(prefix),
+                key=lambda gym_id: (-state.members.get(gym_id, 0), state.docs[gym_id][0]),
+            )
+            return [
+                {
+                    "id": gym_id,
+                    "name": state.display[gym_id][0],
+                    "city": state.display[gym_id][1],
+                    "member_count": state.members.get(gym_id, 0),
+                }
+                for gym_id in top
+            ]
+
+    @staticmethod
+    def _rank(query: str, tokens: List[str], name: str, city: str) -> int:
+        """Higher is better: name prefix, then phrase in name, then word-prefix matches, then city."""
+        words = (name + " " + city).split()
+        rank = 0
+        if name.startswith(query):
+            rank += 8
+        if query in name:
+            rank += 4
+        if all(any(word.startswith(token) for word in words) for token in tokens):
+            rank += 2
+        if query in city:
+            rank += 1
+        return rank
+
+    def search(self, query: str) -> List[str]:
+        """IDs of matching gyms, best match first (ties by name)."""
+        query = normalize(query)
+        tokens = query.split()
+        if not tokens:
+            return []
+
+        with self._reload.lock:
+            state = self._reload.value
+            if state is None:
+                return []
+            ids = None
+            for token in sorted(tokens, key=len, reverse=True):
+                found = state.candidates(token)
+                ids = found if ids is None else ids & found
+                if not ids:
+                    return []
+
+            ranked = []
+            for gym_id in ids:
+                name, city = state.docs[gym_id]
+                # Trigram hits are candidates only; verify every token really occurs
+                if all(token in name or token in city for token in tokens):
+                    ranked.append((-self._rank(query, tokens, name, city), name, gym_id))
+
+        ranked.sort()
+        return [gym_id for _, _, gym_id in ranked]
+
+
+# Shared instance, kept in sync by the gyms router
+gym_search = GymSearchIndex()
@@ -7,9 +7,23 @@ from typing import List, Dict, Optional, Tuple
 from math import radians, cos, sin, asin, sqrt
 from sqlalchemy.orm import Session
 from sqlalchemy import not_
+import numpy as np
 
+from app.config import settings
 from app.models import User, FitnessProfile, Match, MatchPreference, MatchStatus, Gym
 from app.ml.recommender import FitnessRecommender
+from app.services.exclusion_index import MatchExclusionIndex
+from app.services.periodic_reload import PeriodicReload
+from app.services.geo_index import gym_index
+from app.services.candidate_loader import load_matching_user, load_candidates, eligible_candidate_ids
+from app.services.compatibility import (
+    pack_profile,
+    pack_profiles,
+    goal_alignment,
+    goal_alignment_many,
+    days_overlap,
+    days_overlap_many,
+)
 
 
 class MatchingService:
@@ -30,6 +44,16 @@ class MatchingService:
         "advanced": 3,
     }
 
+    def __init__(self, reload_interval: float = settings.RECOMMENDER_RELOAD_SECONDS):
+        self.reload_interval = reload_interval
+        self._reload: PeriodicReload[FitnessRecommender] = PeriodicReload(
+            self._fit_recommender, lambda recommender, user_id, features: recommender.upsert(features),
+            reload_interval,
+        )
+        # Served until the first load completes
+        self._empty = FitnessRecommender()
+        self.exclusions = MatchExclusionIndex(ttl=reload_interval)
+
     @staticmethod
     def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
         """
@@ -45,30 +69,27 @@ class MatchingService:
         c = 2 * asin(sqrt(a))
         return R * c
 
-    def calculate_goal_alignment(self, profile_a: FitnessProfile, profile_b: FitnessProfile) -> float:
+    @staticmethod
+    def calculate_distances(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
         """
-        Calculate score (0-1) based on shared fitness goals and workout types.
+        Vectorised Haversine distance (km) from one point to arrays of points.
+        Missing coordinates (NaN) give an infinite distance.
         """
-        if not profile_a.goals or not profile_b.goals:
-            return 0.0
-
-        # Goals overlap
-        goals_a = set(profile_a.goals)
-        goals_b = set(profile_b.goals)
-        shared_goals = goals_a.intersection(goals_b)
-        goals_score = len(shared_goals) / max(len(goals_a.union(goals_b)), 1)
+        if lat is None or lon is None:
+            return np.full(len(lats), np.inf)
 
-        # Workout types overlap
-        types_a = set(profile_a.workout_types)
-        types_b = set(profile_b.workout_types)
-        
-        if not types_a or not types_b:
-            types_score = 0.0
-        else:
-            shared_types = types_a.intersection(types_b)
-            types_score = len(shared_types) / max(len(types_a.union(types_b)), 1)
+        R = 6371  # Earth radius in km
+        lat1, lon1 = np.radians(lat), np.radians(lon)
+        lats, lons = np.radians(lats), np.radians(lons)
+        a = np.sin((lats - lat1) / 2)**2 + np.cos(lat1) * np.cos(lats) * np.sin((lons - lon1) / 2)**2
+        dist = R * 2 * np.arcsin(np.sqrt(a))
+        return np.where(np.isnan(dist), np.inf, dist)
 
-        return (goals_score * 0.6) + (types_score * 0.4)
+    def calculate_goal_alignment(self, profile_a: FitnessProfile, profile_b: FitnessProfile) -> float:
+        """
+        Calculate score (0-1) based on shared fitness goals and workout types.
+        """
+        return goal_alignment(pack_profile(profile_a), pack_profile(profile_b))
 
     def calculate_schedule_compatibility(self, profile_a: FitnessProfile, profile_b: FitnessProfile) -> float:
         """
@@ -79,14 +100,7 @@ class MatchingService:
         # If adjacent schedules (e.g. morning vs early_morning), give partial credit
         # For simplicity, precise match is 1.0, otherwise 0.0 for now unless we define partials.
         
-        days_a = set(profile_a.preferred_days)
-        days_b = set(profile_b.preferred_days)
-        
-        if not days_a or not days_b:
-            days_score = 0.0
-        else:
-            shared_days = days_a.intersection(days_b)
-            days_score = len(shared_days) / max(len(days_a.union(days_b)), 1)
+        days_score = days_overlap(pack_profile(profile_a), pack_profile(profile_b))
             
         return (schedule_score * 0.5) + (days_score * 0.5)
 
@@ -171,83 +185,206 @@ class MatchingService:
             }
         }
 
+    def score_many(self, user: User, candidates: List[User]) -> List[Dict]:
+        """
+        Vectorised `calculate_match_score` of one user against many candidates.
+        Returns one score dict per candidate, in the same order and format.
+        """
+        prof_a = user.fitness_profile
+        empty = {"overall_score": 0.0, "breakdown": {}}
+        if not prof_a:
+            return [dict(empty) for _ in candidates]
+
+        scored = [i for i, c in enumerate(candidates) if c.fitness_profile]
+        profiles = [candidates[i].fitness_profile for i in scored]
+        results = [dict(empty) for _ in candidates]
+        if not profiles:
+            return results
+
+        # Goals & schedule via batched bitset overlaps
+        bits = pack_profile(prof_a)
+        goals, types, days = pack_profiles(profiles)
+        goal_scores = goal_alignment_many(bits, goals, types)
+        same_schedule = np.array([p.preferred_schedule == prof_a.preferred_schedule for p in profiles], dtype=np.float64)
+        schedule_scores = (same_schedule * 0.5) + (days_overlap_many(bits, days) * 0.5)
+
+        # Fitness level: 1.0 same, 0.5 adjacent, 0.0 otherwise
+        level_a = self.FITNESS_LEVEL_MAP.get(prof_a.fitness_level, 1)
+        levels = np.array([self.FITNESS_LEVEL_MAP.get(p.fitness_level, 1) for p in profiles])
+        diff = np.abs(levels - level_a)
+        level_scores = np.select([diff == 0, diff == 1], [1.0, 0.5], 0.0)
+
+        # Location: same gym is 1.0, otherwise linear decay to 0 at 50km
+        MAX_DIST = 50.0  # km
+        gym_a = prof_a.preferred_gym
+        lats = np.array([p.preferred_gym.latitude if p.preferred_gym else None for p in profiles], dtype=np.float64)
+        lons = np.array([p.preferred_gym.longitude if p.preferred_gym else None for p in profiles], dtype=np.float64)
+        dist = self.calculate_distances(
+            gym_a.latitude if gym_a else None,
+            gym_a.longitude if gym_a else None,
+            lats,
+            lons,
+        )
+        location_scores = np.maximum(0.0, (MAX_DIST - dist) / MAX_DIST)
+        if prof_a.preferred_gym_id:
+            same_gym = np.array([p.preferred_gym_id == prof_a.preferred_gym_id for p in profiles])
+            location_scores = np.where(same_gym, 1.0, location_scores)
+
+        overall = (
+            (goal_scores * self.WEIGHT_GOALS) +
+            (schedule_scores * self.WEIGHT_SCHEDULE) +
+            (level_scores * self.WEIGHT_FITNESS_LEVEL) +
+            (location_scores * self.WEIGHT_LOCATION)
+        )
+
+        for j, i in enumerate(scored):
+            results[i] = {
+                "overall_score": round(float(overall[j]) * 100, 1),  # 0-100 scale
+                "breakdown": {
+                    "goals": round(float(goal_scores[j]) * 100, 1),
+                    "schedule": round(float(schedule_scores[j]) * 100, 1),
+                    "level": round(float(level_scores[j]) * 100, 1),
+                    "location": round(float(location_scores[j]) * 100, 1),
+                }
+            }
+        return results
+
+    def _profile_features(self, user_id: str, profile: FitnessProfile) -> Dict:
+        """Extract the recommender's input fields from a fitness profile."""
+        return {
+            "user_id": user_id,
+            "fitness_level": profile.fitness_level,
+            "preferred_schedule": profile.preferred_schedule,
+            "goals": profile.goals or [],
+            "workout_types": profile.workout_types or [],
+            "preferred_days": profile.preferred_days or [],
+        }
+
+    @property
+    def recommender(self) -> FitnessRecommender:
+        """The current fitted recommender (empty before the first load)."""
+        recommender = self._reload.value
+        return recommender if recommender is not None else self._empty
+
+    def _fit_recommender(self, db: Session) -> FitnessRecommender:
+        profiles = db.query(FitnessProfile).join(User).filter(User.is_active == True).all()
+        recommender = FitnessRecommender()
+        recommender.fit([self._profile_features(p.user_id, p) for p in profiles])
+        return recommender
+
+    def load_recommender(self, db: Session) -> None:
+        """
+        Fit the long-lived recommender from every active user's profile.
+        Runs on first use and again every `reload_interval` seconds (via
+        `PeriodicReload`), which picks up profiles written by other workers; in
+        between, this worker's own writes are applied via `sync_profile`.
+        """
+        self._reload.ensure_loaded(db)
+
+    def sync_profile(self, profile: FitnessProfile) -> None:
+        """Update a single user's feature row after their profile changed."""
+        self._reload.change(profile.user_id, self._profile_features(profile.user_id, profile))
+
+    def _upsert_missing(self, db: Session, user_ids: List[str]) -> None:
+        """Add eligible users that are not in the matrix yet (e.g. created on another worker)."""
+        missing = [user_id for user_id in user_ids if user_id not in self.recommender]
+        if not missing:
+            return
+        for profile in db.query(FitnessProfile).filter(FitnessProfile.user_id.in_(missing)).all():
+            self.sync_profile(profile)
+
+    def reset(self) -> None:
+        """Discard the in-memory recommender and exclusion state (forces a reload on next use)."""
+        self._reload.clear()
+        self.exclusions.clear()
+
+    def _nearby_gym_ids(self, db: Session, user: User) -> Optional[List[str]]:
+        """
+        IDs of gyms within the user's max_distance_km of their preferred gym,
+        or None when no distance filter applies (no preferences or no gym location).
+        """
+        prefs = user.match_preference
+        gym = user.fitness_profile.preferred_gym
+        if not prefs or not gym or gym.latitude is None or gym.longitude is None:
+            return None
+
+        gym_index.ensure_loaded(db)
+        nearby = [gym_id for gym_id, _ in gym_index.within(gym.latitude, gym.longitude, prefs.max_distance_km)]
+        if gym.id not in nearby:
+            nearby.append(gym.id)
+        return nearby
+
     def get_match_recommendations(self, db: Session, user_id: str, limit: int = 10) -> List[Dict]:
         """
         Get compatible match recommendations for a user.
         """
-        user = db.query(User).filter(User.id == user_id).first()
+        user = load_matching_user(db, user_id)
         if not user or not user.fitness_profile:
             return []
 
-        # Get user preferences
-        prefs = user.match_preference
-        
-        # Query ALL active users to build ML profile matrix
-        all_users = db.query(User).filter(
-            User.is_active == True,
-        ).join(FitnessProfile).all()
-
-        # Build profiles for ML
-        profiles_data = []
-        for u in all_users:
-            if not u.fitness_profile:
-                continue
-            
-            p = u.fitness_profile
-            profiles_data.append({
-                "user_id": u.id,
-                "fitness_level": p.fitness_level,
-                "preferred_schedule": p.preferred_schedule,
-                "goals": p.goals or [],
-                "workout_types": p.workout_types or [],
-                "preferred_days": p.preferred_days or [],
-            })
-            
-        # Fit ML Recommender
-        recommender = FitnessRecommender()
-        recommender.fit(profiles_data)
-        
-        # Get ML scores
-        ml_recommendations = recommender.get_recommendations(user_id, top_n=limit * 2)  # Get extra to account for filters
-        
-        # Create map of candidate user_id to user object
-        candidate_map = {u.id: u for u in all_users if u.id != user_id}
-        
-        recommendations = []
-        for rec in ml_recommendations:
-            candidate_id = rec["user_id"]
-            if candidate_id not in candidate_map:
-                continue
-                
-            candidate = candidate_map[candidate_id]
-            ml_score = rec["score"]
-            
-            # Filtering based on preferences
-            if prefs:
-                # Gender filter
-                if prefs.gender_preference != "any" and candidate.fitness_profile.gender:
-                    if candidate.fitness_profile.gender != prefs.gender_preference:
-                        continue
-                
-                # Age filter
-                if candidate.fitness_profile.age:
-                     if not (prefs.min_age <= candidate.fitness_profile.age <= prefs.max_age):
-                         continue
-
-            # Calculate heuristic match score for the UI breakdown representation
-            score_data = self.calculate_match_score(user, candidate)
-            
-            # Use ML score as the overall score
-            overall_score = round(ml_score, 1)
-            
-            if overall_score > 20:  # Arbitrary threshold
-                recommendations.append({
-                    "user": candidate,
-                    "score": overall_score,
-                    "breakdown": score_data["breakdown"]
-                })
-                
+        self.load_recommender(db)
+        # The profile was just read, so this row is current even if it was edited on another worker
+        self.sync_profile(user.fitness_profile)
+
+        # Preference and activity filters are applied in SQL, existing matches in memory
+        candidate_ids = eligible_candidate_ids(db, user, gym_ids=self._nearby_gym_ids(db, user))
+        self._upsert_missing(db, candidate_ids)
+        excluded = self.exclusions.excluded(db, user_id)
+
+        eligible = []
+        seen = 0
+        top_n = limit * 2  # Get extra to account for candidates dropped below
+        while True:
+            # Get ML scores
+            ml_recommendations = self.recommender.get_recommendations(
+                user_id, top_n=top_n, candidates=candidate_ids, exclude=excluded
+            )
+            batch = ml_recommendations[seen:]
+            batch_ids = [rec["user_id"] for rec in batch]
+            # The cached exclusions may predate matches made on other workers
+            matched = self.exclusions.matched(db, user_id, batch_ids)
+
+            # Create map of candidate user_id to user object
+            candidate_map = {
+                u.id: u for u in load_candidates(db, [i for i in batch_ids if i not in matched])
+                if u.fitness_profile
+            }
+
+            below_threshold = False
+            for rec in batch:
+                # Use ML score as the overall score
+                overall_score = round(rec["score"], 1)
+                if overall_score <= 20:  # Arbitrary threshold
+                    below_threshold = True
+                    break
+
+                candidate = candidate_map.get(rec["user_id"])
+                if candidate:
+                    eligible.append((candidate, overall_score))
+
+            # Stop once filled, or when the ranking is exhausted / below threshold
+            if len(eligible) >= limit or below_threshold or len(ml_recommendations) < top_n:
+                break
+            seen = len(ml_recommendations)
+            top_n *= 2
+
         # Limit the results
-        recommendations = recommendations[:limit]
+        eligible = eligible[:limit]
+
+        # Calculate heuristic match scores for the UI breakdown representation in one batch
+        score_data = self.score_many(user, [candidate for candidate, _ in eligible])
+
+        recommendations = [
+            {
+                "user": candidate,
+                "score": overall_score,
+                "breakdown": scores["breakdown"]
+            }
+            for (candidate, overall_score), scores in zip(eligible, score_data)
+        ]
         
         return recommendations
+
+
+# Shared instance so the fitted recommender outlives individual requests
+matching_service = MatchingService()
@@ -0,0 +1,244 @@
+"""
+Message Store
+Write-behind persistence for chat messages
+"""
+
+import logging
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.exc import InterfaceError, OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import SessionLocal
+from app.models import Message
+from app.services.read_state import record_messages, mark_read_up_to
+
+logger = logging.getLogger(__name__)
+
+# Errors that say nothing about the rows themselves (database locked or
+# unreachable, pool exhausted): the batch is kept and retried
+TRANSIENT_ERRORS = (OperationalError, InterfaceError, PoolTimeoutError)
+
+
+class MessageWriteBehind:
+    """
+    Buffers chat messages in memory and inserts them in batches from a
+    dedicated writer thread.
+
+    `enqueue` assigns the id and timestamp, so the message can be broadcast
+    immediately without waiting for the database. The writer flushes every
+    `flush_interval` seconds, or as soon as `batch_size` messages are pending,
+    using one multi-row INSERT and one commit per batch (which also updates
+    the participants' read state). `stop` (called on application shutdown)
+    writes out everything still buffered.
+
+    Messages have already been broadcast when they are written, so they are
+    only dropped for errors in the data itself (a batch that fails that way
+    is retried row by row to isolate the bad rows). On transient errors such
+    as SQLite's "database is locked" the unwritten rows stay queued and the
+    writer retries with exponential backoff, up to `retry_max` seconds apart.
+
+    Read receipts queued with `enqueue_read` are applied after the messages of
+    the same flush, so a receipt always covers messages sent before it.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        flush_interval: float = settings.CHAT_FLUSH_INTERVAL_MS / 1000,
+        batch_size: int = settings.CHAT_FLUSH_BATCH_SIZE,
+        retry_max: float = settings.CHAT_FLUSH_RETRY_MAX_SECONDS,
+    ):
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.retry_max = retry_max
+        self._pending: List[Dict] = []
+        self._pending_reads: List[Dict] = []
+        self._cond = threading.Condition()
+        # Held for the whole write so `flush` also waits for an in-flight batch
+        self._write_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+
+    def enqueue(self, match_id: str, sender_id: str, content: str) -> Dict:
+        """Buffer a message and return its broadcast payload. Never blocks on the database."""
+        row = {
+            "id": str(uuid.uuid4()),
+            "match_id": match_id,
+            "sender_id": sender_id,
+            "content": content,
+            "is_read": False,
+            "created_at": datetime.utcnow(),
+        }
+        row["updated_at"] = row["created_at"]
+
+        with self._cond:
+            self._pending.append(row)
+            self._ensure_running()
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+
+        return {
+            "id": row["id"],
+            "match_id": match_id,
+            "sender_id": sender_id,
+            "content": content,
+            "created_at": row["created_at"].isoformat(),
+            "is_read": False,
+        }
+
+    def enqueue_read(
+        self,
+        match_id: str,
+        user_id: str,
+        up_to: datetime,
+        last_read_message_id: Optional[str] = None,
+    ) -> None:
+        """Queue marking the user's partner messages up to `up_to` as read."""
+        with self._cond:
+            self._pending_reads.append({
+                "match_id": match_id,
+                "user_id": user_id,
+                "up_to": up_to,
+                "last_read_message_id": last_read_message_id,
+            })
+            self._ensure_running()
+
+    def _ensure_running(self):
+        # Caller holds self._cond
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="chat-writer", daemon=True)
+            self._thread.start()
+
+    def _take(self) -> Tuple[List[Dict], List[Dict]]:
+        with self._cond:
+            rows, self._pending = self._pending, []
+            reads, self._pending_reads = self._pending_reads, []
+        return rows, reads
+
+    def _requeue(self, rows: List[Dict], reads: List[Dict]) -> None:
+        """Put unwritten work back in front of anything queued since, keeping order."""
+        with self._cond:
+            self._pending[:0] = rows
+            self._pending_reads[:0] = reads
+
+    def _run(self):
+        delay = 0.0
+        while True:
+            with self._cond:
+                if delay:
+                    # Back off without being woken early by new messages
+                    retry_at = time.monotonic() + delay
+                    while not self._stopping and time.monotonic() < retry_at:
+                        self._cond.wait(retry_at - time.monotonic())
+                elif not self._stopping and len(self._pending) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                if self._stopping and (delay or (not self._pending and not self._pending_reads)):
+                    # A failing database gets one more attempt from `stop`
+                    return
+            if self.flush():
+                delay = 0.0
+            else:
+                delay = min(max(delay * 2, self.flush_interval), self.retry_max)
+
+    def _write(self, rows: List[Dict]) -> int:
+        """
+        Insert rows in one transaction. Returns how many leading rows were dealt
+        with (saved, or dropped as bad data); fewer than all of them means a
+        transient error and the rest should be retried.
+        """
+        db = self.session_factory()
+        try:
+            db.execute(insert(Message), rows)
+            record_messages(db, rows)
+            db.commit()
+            return len(rows)
+        except TRANSIENT_ERRORS:
+            db.rollback()
+            logger.warning("Could not save %d chat message(s), will retry", len(rows), exc_info=True)
+            return 0
+        except Exception:
+            db.rollback()
+            if len(rows) == 1:
+                logger.exception("Dropping chat message %s that could not be saved", rows[0]["id"])
+                return 1
+        finally:
+            db.close()
+
+        # Isolate the bad row(s) so one message cannot sink the whole batch
+        for i, row in enumerate(rows):
+            if not self._write([row]):
+                return i
+        return len(rows)
+
+    def _apply_reads(self, reads: List[Dict]) -> bool:
+        """
+        Apply read receipts in one transaction. False on a transient error (retry
+        them); receipts that fail otherwise are dropped one by one.
+        """
+        db = self.session_factory()
+        try:
+            for read in reads:
+                mark_read_up_to(db, **read)
+            db.commit()
+            return True
+        except TRANSIENT_ERRORS:
+            db.rollback()
+            logger.warning("Could not save %d read receipt(s), will retry", len(reads), exc_info=True)
+            return False
+        except Exception:
+            db.rollback()
+            if len(reads) == 1:
+                logger.exception("Dropping read receipt for %s that could not be saved", reads[0]["match_id"])
+                return True
+        finally:
+            db.close()
+
+        # Isolate the bad receipt(s) so one cannot sink the others; re-marking is idempotent
+        return all(self._apply_reads([read]) for read in reads)
+
+    def flush(self) -> bool:
+        """
+        Write every buffered message and read receipt now (blocking). Returns
+        False if a transient database error left work queued for a retry.
+        """
+        with self._write_lock:
+            while True:
+                rows, reads = self._take()
+                if not rows and not reads:
+                    return True
+                for start in range(0, len(rows), self.batch_size):
+                    batch = rows[start:start + self.batch_size]
+                    written = self._write(batch)
+                    if written < len(batch):
+                        self._requeue(rows[start + written:], reads)
+                        return False
+                if reads and not self._apply_reads(reads):
+                    self._requeue([], reads)
+                    return False
+
+    def stop(self) -> None:
+        """Flush everything and stop the writer thread (it restarts on the next enqueue)."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        if not self.flush():
+            with self._cond:
+                lost = len(self._pending), len(self._pending_reads)
+                self._pending, self._pending_reads = [], []
+            logger.error("Database unavailable at shutdown: lost %d chat message(s) and %d read receipt(s)", *lost)
+
+
+# Shared instance, flushed on application shutdown
+message_writer = MessageWriteBehind()
@@ -0,0 +1,103 @@
+"""
+Periodic Reload
+Load-then-refresh policy shared by the in-memory indexes built from the database
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, Generic, Hashable, Optional, TypeVar
+
+from sqlalchemy.orm import Session
+
+T = TypeVar("T")
+
+
+class PeriodicReload(Generic[T]):
+    """
+    Holds a value built by `load(db)` (an index, a fitted model, ...) and rebuilds
+    it on first use and every `interval` seconds, so rows written by other
+    workers are picked up (0 loads once). In between, this worker's own writes
+    go through `change(key, value)`, which calls `apply(target, key, value)` on
+    the current value.
+
+    A reload runs off to the side while readers keep using the current value;
+    only the first load makes callers wait. Changes made while it runs are
+    recorded and replayed onto its result before it is swapped in, so an update
+    committed after the load read the database is not lost.
+
+    Readers take `lock` to read `value` consistently with `change`; `version`
+    increases on every swap or change, for owners that cache derived data.
+    """
+
+    def __init__(
+        self,
+        load: Callable[[Session], T],
+        apply: Callable[[T, Hashable, Any], None],
+        interval: float,
+    ):
+        self.load = load
+        self.apply = apply
+        self.interval = interval
+        self.value: Optional[T] = None
+        self.loaded_at = 0.0
+        self.version = 0
+        self.lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._pending: Optional[Dict[Hashable, Any]] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.value is not None
+
+    def is_stale(self) -> bool:
+        if not self.loaded:
+            return True
+        return bool(self.interval) and time.monotonic() - self.loaded_at >= self.interval
+
+    def ensure_loaded(self, db: Session) -> None:
+        """Load the value on first use and reload it once stale."""
+        if not self.is_stale():
+            return
+
+        if self.loaded:
+            # Another request is already reloading; keep serving the current value
+            if not self._reload_lock.acquire(blocking=False):
+                return
+        else:
+            self._reload_lock.acquire()
+        try:
+            if not self.is_stale():
+                return
+            with self.lock:
+                self._pending = {}
+
+            fresh = self.load(db)
+
+            with self.lock:
+                for key, value in self._pending.items():
+                    self.apply(fresh, key, value)
+                self.value = fresh
+                self.loaded_at = time.monotonic()
+                self.version += 1
+        finally:
+            with self.lock:
+                self._pending = None
+            self._reload_lock.release()
+
+    def change(self, key: Hashable, value: Any) -> None:
+        """Apply one local change now, and again to a load in progress."""
+        with self.lock:
+            if self._pending is not None:
+                self._pending[key] = value
+            if self.value is None:
+                # The load will read the committed row
+                return
+            self.apply(self.value, key, value)
+            self.version += 1
+
+    def clear(self) -> None:
+        """Drop the value; the next `ensure_loaded` loads it again."""
+        with self.lock:
+            self.value = None
+            self.loaded_at = 0.0
+            self.version += 1
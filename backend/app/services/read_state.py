@@ -0,0 +1,153 @@
+"""
+Chat Read State
+Keeps the per-(match, user) inbox counters in step with message writes and reads
+"""
+
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import and_, bindparam, case, insert, or_, select, update
+from sqlalchemy.orm import Session
+
+from app.models import Match, Message, ChatReadState
+
+_read_states = ChatReadState.__table__
+
+# Bump unread for the recipient and move the last-message pointer forward only
+_apply_messages = (
+    update(_read_states)
+    .where(and_(_read_states.c.match_id == bindparam("m"), _read_states.c.user_id == bindparam("u")))
+    .values(
+        unread_count=_read_states.c.unread_count + bindparam("n"),
+        last_message_id=case(
+            (or_(_read_states.c.last_message_at.is_(None), _read_states.c.last_message_at <= bindparam("at")),
+             bindparam("mid")),
+            else_=_read_states.c.last_message_id,
+        ),
+        last_message_at=case(
+            (or_(_read_states.c.last_message_at.is_(None), _read_states.c.last_message_at <= bindparam("at")),
+             bindparam("at")),
+            else_=_read_states.c.last_message_at,
+        ),
+    )
+)
+
+
+def record_messages(db: Session, rows: List[Dict]) -> None:
+    """
+    Fold a batch of newly inserted messages (dicts with id, match_id, sender_id,
+    created_at and optionally is_read) into both participants' read state,
+    creating missing rows.
+    Runs in the caller's transaction.
+    """
+    if not rows:
+        return
+
+    # Unread messages per room, and per (room, sender)
+    latest: Dict[str, Dict] = {}
+    per_match: Counter = Counter()
+    per_sender: Counter = Counter()
+    for row in rows:
+        match_id = row["match_id"]
+        if not row.get("is_read"):
+            per_match[match_id] += 1
+            per_sender[(match_id, row["sender_id"])] += 1
+        current = latest.get(match_id)
+        if current is None or (row["created_at"], row["id"]) > (current["created_at"], current["id"]):
+            latest[match_id] = row
+
+    participants = db.query(Match.id, Match.user_a_id, Match.user_b_id).filter(Match.id.in_(list(latest))).all()
+    existing = set(
+        db.query(ChatReadState.match_id, ChatReadState.user_id)
+        .filter(ChatReadState.match_id.in_(list(latest)))
+        .all()
+    )
+
+    missing, updates = [], []
+    for match_id, user_a_id, user_b_id in participants:
+        last = latest[match_id]
+        for user_id in (user_a_id, user_b_id):
+            if (match_id, user_id) not in existing:
+                missing.append({"match_id": match_id, "user_id": user_id, "unread_count": 0})
+            updates.append({
+                "m": match_id,
+                "u": user_id,
+                "n": per_match[match_id] - per_sender[(match_id, user_id)],
+                "mid": last["id"],
+                "at": last["created_at"],
+            })
+
+    if missing:
+        db.execute(insert(ChatReadState), missing)
+    if updates:
+        db.connection().execute(_apply_messages, updates)
+
+
+def mark_read(
+    db: Session,
+    match_id: str,
+    user_id: str,
+    count: int,
+    last_read_message_id: Optional[str] = None,
+    up_to: Optional[datetime] = None,
+) -> None:
+    """
+    Take `count` messages off the user's unread counter and move the read
+    pointer to `last_read_message_id`; with its `up_to` timestamp, only if the
+    pointer is not already at a later message (in the caller's transaction).
+    """
+    values = {
+        "unread_count": case(
+            (ChatReadState.unread_count > count, ChatReadState.unread_count - count),
+            else_=0,
+        ),
+    }
+    if last_read_message_id is not None and up_to is None:
+        values["last_read_message_id"] = last_read_message_id
+    elif last_read_message_id is not None:
+        # Compared against the message the pointer is at now, so it never moves backwards
+        current_at = (
+            select(Message.created_at)
+            .where(Message.id == ChatReadState.last_read_message_id)
+            .scalar_subquery()
+        )
+        values["last_read_message_id"] = case(
+            (or_(current_at.is_(None), current_at <= up_to), last_read_message_id),
+            else_=ChatReadState.last_read_message_id,
+        )
+
+    db.execute(
+        update(ChatReadState)
+        .where(ChatReadState.match_id == match_id, ChatReadState.user_id == user_id)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def mark_read_up_to(
+    db: Session,
+    match_id: str,
+    user_id: str,
+    up_to: datetime,
+    last_read_message_id: Optional[str] = None,
+) -> int:
+    """
+    Mark every partner message in the room created at or before `up_to` as read
+    with a single UPDATE, and adjust the user's read state to match. Returns the
+    number of messages marked (in the caller's transaction).
+    """
+    result = db.execute(
+        update(Message)
+        .where(
+            Message.match_id == match_id,
+            Message.sender_id != user_id,
+            Message.is_read == False,
+            Message.created_at <= up_to,
+        )
+        .values(is_read=True, read_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount or last_read_message_id is not None:
+        mark_read(db, match_id, user_id, result.rowcount, last_read_message_id, up_to)
+    return result.rowcount
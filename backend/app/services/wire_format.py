@@ -0,0 +1,77 @@
+"""
+Chat Wire Format
+Compact MessagePack encoding of chat frames, negotiated per WebSocket
+"""
+
+import json
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Dict, Optional
+
+try:
+    import msgpack
+except ImportError:  # optional: without it every socket speaks JSON
+    msgpack = None
+
+MSGPACK_SUBPROTOCOL = "gymbuddy.msgpack"
+
+# JSON key -> compact key; must stay unique in both directions
+COMPACT_KEYS = {
+    "type": "y",
+    "id": "i",
+    "match_id": "m",
+    "sender_id": "s",
+    "content": "c",
+    "created_at": "t",
+    "is_read": "r",
+    "read_at": "ra",
+    "user_id": "u",
+    "online": "o",
+    "reader_id": "rd",
+    "up_to": "ut",
+    "detail": "d",
+}
+EXPANDED_KEYS = {compact: key for key, compact in COMPACT_KEYS.items()}
+
+# ISO timestamps travel as integer milliseconds since the epoch (UTC)
+TIMESTAMP_KEYS = {"created_at", "read_at"}
+
+
+def negotiate(requested) -> Optional[str]:
+    """The subprotocol to accept from the client's list, or None for JSON."""
+    if msgpack is not None and MSGPACK_SUBPROTOCOL in (requested or []):
+        return MSGPACK_SUBPROTOCOL
+    return None
+
+
+def _to_millis(value: str) -> int:
+    return int(datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+@lru_cache(maxsize=1024)
+def to_msgpack(text: str) -> bytes:
+    """
+    Re-encode a JSON frame with compact keys and integer timestamps. Cached, so
+    a frame fanned out to many MessagePack sockets is encoded once.
+    """
+    frame = json.loads(text)
+    compact = {}
+    for key, value in frame.items():
+        if key in TIMESTAMP_KEYS and isinstance(value, str):
+            value = _to_millis(value)
+        compact[COMPACT_KEYS.get(key, key)] = value
+    return msgpack.packb(compact)
+
+
+def from_msgpack(data: bytes) -> Optional[Dict]:
+    """
+    Decode an inbound MessagePack frame back to the JSON field names.
+    None if the payload is malformed or not a map.
+    """
+    try:
+        frame = msgpack.unpackb(data)
+    except Exception:  # ExtraData, FormatError, StackError, unhashable keys, ...
+        return None
+    if not isinstance(frame, dict):
+        return None
+    return {EXPANDED_KEYS.get(key, key): value for key, value in frame.items()}
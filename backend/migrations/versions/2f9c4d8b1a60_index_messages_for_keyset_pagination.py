@@ -0,0 +1,33 @@
+"""Index messages on (match_id, created_at, id) for keyset pagination
+
+Revision ID: 2f9c4d8b1a60
+Revises: e4b71f0a9c38
+Create Date: 2026-10-18 20:21:47.530912
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2f9c4d8b1a60'
+down_revision: Union[str, Sequence[str], None] = 'e4b71f0a9c38'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.create_index('ix_messages_match_id_created_at_id', ['match_id', 'created_at', 'id'], unique=False)
+        # Superseded by the wider index above
+        batch_op.drop_index('ix_messages_match_id_created_at')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.create_index('ix_messages_match_id_created_at', ['match_id', 'created_at'], unique=False)
+        batch_op.drop_index('ix_messages_match_id_created_at_id')
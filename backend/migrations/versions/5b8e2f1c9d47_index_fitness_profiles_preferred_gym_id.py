@@ -0,0 +1,30 @@
+"""Index fitness_profiles.preferred_gym_id
+
+Revision ID: 5b8e2f1c9d47
+Revises: 381cf8b29cb7
+Create Date: 2026-10-18 10:12:31.204518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b8e2f1c9d47'
+down_revision: Union[str, Sequence[str], None] = '381cf8b29cb7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('fitness_profiles', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_fitness_profiles_preferred_gym_id'), ['preferred_gym_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('fitness_profiles', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_fitness_profiles_preferred_gym_id'))
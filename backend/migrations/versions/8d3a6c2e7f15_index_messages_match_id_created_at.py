@@ -0,0 +1,30 @@
+"""Index messages on (match_id, created_at)
+
+Revision ID: 8d3a6c2e7f15
+Revises: 5b8e2f1c9d47
+Create Date: 2026-10-18 19:05:12.448310
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d3a6c2e7f15'
+down_revision: Union[str, Sequence[str], None] = '5b8e2f1c9d47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.create_index('ix_messages_match_id_created_at', ['match_id', 'created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.drop_index('ix_messages_match_id_created_at')
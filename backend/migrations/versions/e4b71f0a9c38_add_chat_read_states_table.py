@@ -0,0 +1,84 @@
+"""Add chat read states table
+
+Revision ID: e4b71f0a9c38
+Revises: 8d3a6c2e7f15
+Create Date: 2026-10-18 19:48:03.916254
+
+"""
+from typing import Sequence, Union
+import uuid
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4b71f0a9c38'
+down_revision: Union[str, Sequence[str], None] = '8d3a6c2e7f15'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    read_states = op.create_table('chat_read_states',
+    sa.Column('match_id', sa.String(length=36), nullable=False),
+    sa.Column('user_id', sa.String(length=36), nullable=False),
+    sa.Column('last_message_id', sa.String(length=36), nullable=True),
+    sa.Column('last_message_at', sa.DateTime(), nullable=True),
+    sa.Column('last_read_message_id', sa.String(length=36), nullable=True),
+    sa.Column('unread_count', sa.Integer(), nullable=False),
+    sa.Column('id', sa.String(length=36), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['last_message_id'], ['messages.id'], ondelete='SET NULL'),
+    sa.ForeignKeyConstraint(['last_read_message_id'], ['messages.id'], ondelete='SET NULL'),
+    sa.ForeignKeyConstraint(['match_id'], ['matches.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('match_id', 'user_id', name='unique_read_state')
+    )
+    with op.batch_alter_table('chat_read_states', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_chat_read_states_id'), ['id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_chat_read_states_user_id'), ['user_id'], unique=False)
+
+    # Backfill from existing history, one row per participant of every room with messages
+    conn = op.get_bind()
+    now = datetime.utcnow()
+    rows = []
+    rooms = conn.execute(sa.text(
+        "SELECT DISTINCT m.id, m.user_a_id, m.user_b_id FROM matches m "
+        "JOIN messages msg ON msg.match_id = m.id"
+    )).fetchall()
+    for match_id, user_a_id, user_b_id in rooms:
+        last = conn.execute(sa.text(
+            "SELECT id, created_at FROM messages WHERE match_id = :m "
+            "ORDER BY created_at DESC, id DESC LIMIT 1"
+        ).columns(id=sa.String, created_at=sa.DateTime), {"m": match_id}).first()
+        for user_id in (user_a_id, user_b_id):
+            unread = conn.execute(sa.text(
+                "SELECT COUNT(*) FROM messages WHERE match_id = :m AND sender_id != :u AND is_read = :f"
+            ), {"m": match_id, "u": user_id, "f": False}).scalar()
+            rows.append({
+                "id": str(uuid.uuid4()),
+                "match_id": match_id,
+                "user_id": user_id,
+                "last_message_id": last.id,
+                "last_message_at": last.created_at,
+                "last_read_message_id": None,
+                "unread_count": unread,
+                "created_at": now,
+                "updated_at": now,
+            })
+    if rows:
+        op.bulk_insert(read_states, rows)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('chat_read_states', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_chat_read_states_user_id'))
+        batch_op.drop_index(batch_op.f('ix_chat_read_states_id'))
+
+    op.drop_table('chat_read_states')
@@ -10,6 +10,10 @@ from sqlalchemy.pool import StaticPool
 
 from app.database import Base, get_db
 from app.main import app
+from app.services.matching_service import matching_service
+from app.services.geo_index import gym_index
+from app.services.gym_search import gym_search
+from app.services.message_store import message_writer
 
 # Test database setup
 SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
@@ -32,6 +36,7 @@ def override_get_db():
 
 # Override the get_db dependency globally
 app.dependency_overrides[get_db] = override_get_db
+message_writer.session_factory = TestingSessionLocal
 
 
 @pytest.fixture(autouse=True)
@@ -39,7 +44,12 @@ def setup_database():
     """Create tables before each test, drop after."""
     Base.metadata.create_all(bind=engine)
     yield
+    message_writer.stop()
     Base.metadata.drop_all(bind=engine)
+    # In-memory indexes would otherwise outlive the dropped tables
+    matching_service.reset()
+    gym_index.clear()
+    gym_search.clear()
 
 
 @pytest.fixture
@@ -0,0 +1,993 @@
+"""
+Tests for Chat endpoints and the WebSocket connection manager
+"""
+
+import asyncio
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import msgpack
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from app.config import settings
+from app.main import app
+from app.routers.chat import BEARER_SUBPROTOCOL
+from app.models import User, Match, MatchStatus, Message, ChatReadState
+from app.services.connection_manager import ConnectionManager
+from app.services.chat_broker import ChatBroker, InProcessBroker, RedisBroker, create_broker
+from app.services.message_store import MessageWriteBehind, message_writer
+from app.services.security import create_access_token
+from app.services.read_state import record_messages
+from app.services.wire_format import MSGPACK_SUBPROTOCOL, from_msgpack
+
+client = TestClient(app)
+
+
+def create_match(db_session):
+    """Two users with an accepted match between them."""
+    alice = User(email="alice@test.com", hashed_password="pw", full_name="Alice")
+    bob = User(email="bob@test.com", hashed_password="pw", full_name="Bob")
+    db_session.add_all([alice, bob])
+    db_session.flush()
+    match = Match(
+        user_a_id=alice.id, user_b_id=bob.id, overall_score=80.0, status=MatchStatus.ACCEPTED.value,
+    )
+    db_session.add(match)
+    db_session.commit()
+    return alice, bob, match
+
+
+def auth_header(user):
+    return {"Authorization": f"Bearer {create_access_token({'sub': user.id})}"}
+
+
+def ws_args(match, user, *subprotocols):
+    """websocket_connect() arguments for a user, with the token sent as a subprotocol."""
+    token = create_access_token({'sub': user.id})
+    return {"url": f"/chat/ws/{match.id}", "subprotocols": [*subprotocols, BEARER_SUBPROTOCOL, token]}
+
+
+def receive_message(ws):
+    """Next chat message frame, skipping presence / typing events."""
+    while True:
+        frame = ws.receive_json()
+        if frame.get("type") not in ("presence", "typing"):
+            return frame
+
+
+def add_message(db_session, match, sender, content, minutes_ago, is_read=False):
+    message = Message(
+        match_id=match.id, sender_id=sender.id, content=content, is_read=is_read,
+        created_at=datetime.utcnow() - timedelta(minutes=minutes_ago),
+    )
+    db_session.add(message)
+    db_session.flush()
+    record_messages(db_session, [{
+        "id": message.id, "match_id": match.id, "sender_id": sender.id,
+        "created_at": message.created_at, "is_read": is_read,
+    }])
+    db_session.commit()
+    return message
+
+
+class FakeWebSocket:
+    """Records sent frames; can be made slow or broken."""
+
+    def __init__(self, delay=0.0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.sent = []
+        self.closed = False
+        self.close_code = None
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, text):
+        if self.fail:
+            raise RuntimeError("connection reset")
+        await asyncio.sleep(self.delay)
+        self.sent.append(text)
+
+    async def send_bytes(self, data):
+        await self.send_text(data)
+
+    async def close(self, code=1000):
+        self.closed = True
+        self.close_code = code
+
+
+class TestChatWebSocket:
+    """Tests for /chat/ws/{match_id}"""
+
+    def test_message_reaches_both_sockets(self, db_session):
+        alice, bob, match = create_match(db_session)
+
+        # One client context keeps both sockets on the same event loop
+        with TestClient(app) as client:
+            with client.websocket_connect(**ws_args(match, alice)) as ws_a, \
+                    client.websocket_connect(**ws_args(match, bob)) as ws_b:
+                ws_a.send_json({"content": "Leg day?"})
+                received_a = receive_message(ws_a)
+                received_b = receive_message(ws_b)
+
+        assert received_a == received_b
+        assert received_b["content"] == "Leg day?"
+        assert received_b["sender_id"] == alice.id
+
+    def test_message_is_persisted(self, db_session):
+        alice, bob, match = create_match(db_session)
+
+        with TestClient(app) as client:
+            with client.websocket_connect(**ws_args(match, bob)) as ws:
+                ws.send_json({"content": "Sure"})
+                payload = ws.receive_json()
+
+        stored = db_session.query(Message).filter(Message.id == payload["id"]).one()
+        assert stored.content == "Sure"
+        assert stored.sender_id == bob.id
+        assert stored.created_at.isoformat() == payload["created_at"]
+
+    def test_invalid_content_is_rejected_before_broadcast(self, db_session):
+        alice, bob, match = create_match(db_session)
+
+        with TestClient(app) as client:
+            with client.websocket_connect(**ws_args(match, alice)) as ws:
+                for content in ({"a": 1}, ["x"], 7, "", "x" * (settings.CHAT_MAX_MESSAGE_LENGTH + 1)):
+                    ws.send_json({"content": content})
+                    frame = receive_message(ws)
+                    assert frame["type"] == "error"
+                # The socket stays usable
+                ws.send_json({"content": "ok"})
+                assert receive_message(ws)["content"] == "ok"
+
+        assert [m.content for m in db_session.query(Message).all()] == ["ok"]
+
+    def test_non_object_frames_get_an_error(self, db_session):
+        alice, bob, match = create_match(db_session)
+
+        with TestClient(app) as client:
+            with client.websocket_connect(**ws_args(match, alice)) as ws:
+                for frame in ("[1, 2]", '"x"', "1", "null", "{not json"):
+                    ws.send_text(frame)
+                    assert receive_message(ws) == {"type": "error", "detail": "frame must be an object"}
+                ws.send_json({"content": "still here"})
+                assert receive_message(ws)["content"] == "still here"
+
+    def test_rejects_missing_or_foreign_tokens(self, db_session):
+        alice, bob, match = create_match(db_session)
+        stranger = User(email="stranger@test.com", hashed_password="pw")
+        db_session.add(stranger)
+        db_session.flush()
+        pending = Match(user_a_id=alice.id, user_b_id=stranger.id, overall_score=50.0)
+        db_session.add(pending)
+        db_session.commit()
+
+        for args in (
+            {"url": f"/chat/ws/{match.id}"},
+            {"url": f"/chat/ws/{match.id}", "subprotocols": [BEARER_SUBPROTOCOL, "garbage"]},
+            # Tokens in the URL end up in access logs and are not accepted
+            {"url": f"/chat/ws/{match.id}?token={create_access_token({'sub': alice.id})}"},
+            ws_args(match, stranger),
+            ws_args(pending, alice),
+        ):
+            with pytest.raises(WebSocketDisconnect) as exc:
+                with client.websocket_connect(**args) as ws:
+                    ws.receive_json()
+            assert exc.value.code == 1008
+
+    def test_token_transports(self, db_session):
+        alice, bob, match = create_match(db_session)
+
+        with TestClient(app) as client:
+            # Browsers: the token rides in Sec-WebSocket-Protocol, the marker is echoed back
+            with client.websocket_connect(**ws_args(match, alice)) as ws:
+                assert ws.accepted_subprotocol == BEARER_SUBPROTOCOL
+            # Other clients can send a normal Authorization header
+            with client.websocket_connect(f"/chat/ws/{match.id}", headers=auth_header(bob)) as ws:
+                ws.send_json({"content": "header auth"})
+                assert receive_message(ws)["sender_id"] == bob.id
+
+    def test_sender_comes_from_token_without_queries(self, db_session):
+        alice, bob, match = create_match(db_session)
+        alice_id, url = alice.id, ws_args(match, alice)
+
+        with TestClient(app) as client:
+            with client.websocket_connect(**url) as ws:
+                statements = []
+                bind = db_session.get_bind()
+                listener = lambda *args: statements.append(args[2])
+                event.listen(bind, "before_cursor_execute", listener)
+                try:
+                    ws.send_json({"sender_id": "someone-else", "content": "spoof"})
+                    payload = receive_message(ws)
+                finally:
+                    event.remove(bind, "before_cursor_execute", listener)
+
+        assert payload["sender_id"] == alice_id
+        # Messages are written by the write-behind writer; the socket itself reads nothing
+        assert not [s for s in statements if s.startswith("SELECT")]
+
+    def test_msgpack_subprotocol_is_opt_in(self, db_session):
+        alice, bob, match = create_match(db_session)
+
+        with TestClient(app) as client:
+            with client.websocket_connect(**ws_args(match, alice, MSGPACK_SUBPROTOCOL)) as ws_a, \
+                    client.websocket_connect(**ws_args(match, bob)) as ws_b:
+                assert ws_a.accepted_subprotocol == MSGPACK_SUBPROTOCOL
+                assert ws_b.accepted_subprotocol == BEARER_SUBPROTOCOL
+
+                ws_a.send_bytes(msgpack.packb({"c": "Bench at 6?"}))
+                binary = msgpack.unpackb(ws_a.receive_bytes())
+                while binary.get("y") in ("presence", "typing"):
+                    binary = msgpack.unpackb(ws_a.receive_bytes())
+                text = receive_message(ws_b)
+
+        # Same message, compact keys and epoch milliseconds on the binary socket
+        assert binary["i"] == text["id"]
+        assert binary["c"] == text["content"] == "Bench at 6?"
+        assert binary["s"] == text["sender_id"] == alice.id
+        created_at = datetime.fromisoformat(text["created_at"]).replace(tzinfo=timezone.utc)
+        assert binary["t"] == int(created_at.timestamp() * 1000)
+
+
+    def test_undecodable_msgpack_frames_get_an_error(self, db_session):
+        alice, bob, match = create_match(db_session)
+
+        def next_frame(ws):
+            frame = msgpack.unpackb(ws.receive_bytes())
+            while frame.get("y") in ("presence", "typing"):
+                frame = msgpack.unpackb(ws.receive_bytes())
+            return frame
+
+        with TestClient(app) as client:
+            with client.websocket_connect(**ws_args(match, alice, MSGPACK_SUBPROTOCOL)) as ws:
+                for send in (
+                    lambda: ws.send_bytes(b"\xc1"),  # reserved byte, never valid MessagePack
+                    lambda: ws.send_bytes(msgpack.packb([1, 2])),
+                    lambda: ws.send_text('{"content": "text on a binary socket"}'),
+                ):
+                    send()
+                    assert next_frame(ws) == {"y": "error", "d": "frame must be an object"}
+                ws.send_bytes(msgpack.packb({"c": "still here"}))
+                assert next_frame(ws)["c"] == "still here"
+
+
+class TestPresence:
+    """Tests for presence and typing events"""
+
+    def test_presence_events_and_room_status(self, db_session):
+        alice, bob, match = create_match(db_session)
+        alice_id, bob_id = alice.id, bob.id
+        alice_url, bob_url, headers = ws_args(match, alice), ws_args(match, bob), auth_header(alice)
+
+        with TestClient(app) as client:
+            with client.websocket_connect(**alice_url) as ws_a:
+                with client.websocket_connect(**bob_url) as ws_b:
+                    assert ws_a.receive_json() == {
+                        "type": "presence", "match_id": match.id, "user_id": bob_id, "online": True,
+                    }
+                    # The newcomer learns who is already in the room
+                    assert ws_b.receive_json()["user_id"] == alice_id
+                    rooms = client.get("/chat/rooms", headers=headers).json()
+                    assert rooms[0]["partner_online"] is True
+
+                offline = ws_a.receive_json()
+                assert (offline["user_id"], offline["online"]) == (bob_id, False)
+                rooms = client.get("/chat/rooms", headers=headers).json()
+                assert rooms[0]["partner_online"] is False
+
+    def test_typing_is_not_persisted(self, db_session):
+        alice, bob, match = create_match(db_session)
+        alice_url, bob_url = ws_args(match, alice), ws_args(match, bob)
+
+        with TestClient(app) as client:
+            with client.websocket_connect(**alice_url) as ws_a, client.websocket_connect(**bob_url) as ws_b:
+                ws_b.receive_json()  # alice's presence
+                ws_a.send_json({"type": "typing"})
+                assert ws_b.receive_json()["type"] == "typing"
+
+        assert db_session.query(Message).count() == 0
+
+    @pytest.mark.asyncio
+    async def test_typing_is_coalesced(self):
+        manager = ConnectionManager(typing_interval=0.2)
+        alice, bob = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(alice, "room", "alice")
+        await manager.connect(bob, "room", "bob")
+        await asyncio.sleep(0.01)
+        alice.sent.clear()
+
+        for _ in range(5):
+            await manager.typing("room", "bob")
+        await asyncio.sleep(0.25)
+        await manager.typing("room", "bob")
+        await asyncio.sleep(0.01)
+
+        assert [json.loads(t)["type"] for t in alice.sent] == ["typing", "typing"]
+
+    @pytest.mark.asyncio
+    async def test_online_counts_every_socket(self):
+        manager = ConnectionManager()
+        phone, laptop = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(phone, "room", "alice")
+        await manager.connect(laptop, "other-room", "alice")
+
+        assert manager.disconnect(phone, "room") is True
+        assert manager.is_online("alice")
+        manager.disconnect(laptop, "other-room")
+        assert not manager.is_online("alice")
+
+
+    @pytest.mark.asyncio
+    async def test_presence_is_shared_across_workers(self):
+        broker = InProcessBroker()
+        worker_a = ConnectionManager(broker=broker, ping_interval=0)
+        worker_b = ConnectionManager(broker=broker, ping_interval=0)
+        await worker_b.connect(FakeWebSocket(), "room", "bob")
+        phone, laptop = FakeWebSocket(), FakeWebSocket()
+
+        await worker_a.connect(phone, "room", "alice")
+        await worker_a.connect(laptop, "other-room", "alice")
+        assert worker_b.is_online("alice")
+
+        # Still online on worker A through the laptop
+        await worker_a.leave(phone, "room", "alice")
+        assert worker_b.is_online("alice")
+
+        await worker_a.leave(laptop, "other-room", "alice")
+        assert not worker_b.is_online("alice")
+        assert worker_a.is_online("bob")
+
+    @pytest.mark.asyncio
+    async def test_remote_presence_expires_without_heartbeats(self):
+        broker = InProcessBroker()
+        crashed = ConnectionManager(broker=broker, ping_interval=0)
+        observer = ConnectionManager(broker=broker, ping_interval=10)
+        await observer.connect(FakeWebSocket(), "room", "bob")
+        await crashed.connect(FakeWebSocket(), "room", "alice")
+        assert observer.is_online("alice")
+
+        # The crashed worker never refreshes or retracts its announcement
+        observer.remote_online["alice"][crashed.worker_id] = time.monotonic() - 1
+        assert not observer.is_online("alice")
+        await observer.sweep()
+        assert "alice" not in observer.remote_online
+
+
+class TestConnectionLimits:
+    """Tests for heartbeats, idle eviction, rate limits and connection caps"""
+
+    @pytest.mark.asyncio
+    async def test_heartbeat_pings_and_evicts_idle(self):
+        manager = ConnectionManager(ping_interval=0.05, idle_timeout=0.12)
+        quiet, chatty = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(quiet, "room", "alice")
+        chatty_conn = await manager.connect(chatty, "room", "bob")
+
+        for _ in range(5):
+            await asyncio.sleep(0.05)
+            manager.receive(chatty_conn)
+        await manager.close()
+
+        assert '{"type":"ping"}' in quiet.sent
+        assert quiet.closed and quiet.close_code == 1001
+        assert not chatty.closed
+        assert manager.metrics()["evicted_idle"] == 1
+        assert [c.websocket for c in manager.active_connections["room"]] == [chatty]
+
+    @pytest.mark.asyncio
+    async def test_inbound_rate_limit(self):
+        manager = ConnectionManager(ping_interval=0)
+        ws = FakeWebSocket()
+        connection = await manager.connect(ws, "room", "alice")
+        connection.rate, connection.burst, connection._tokens = 0.0, 3, 3.0
+
+        allowed = [manager.receive(connection) for _ in range(5)]
+        await asyncio.sleep(0.01)
+
+        assert allowed == [True, True, True, False, False]
+        assert manager.metrics()["frames_rate_limited"] == 2
+        assert json.loads(ws.sent[-1]) == {"type": "error", "detail": "rate limited"}
+
+    @pytest.mark.asyncio
+    async def test_connection_cap_evicts_oldest(self):
+        manager = ConnectionManager(ping_interval=0, max_connections_per_user=2)
+        sockets = [FakeWebSocket() for _ in range(3)]
+        for ws in sockets:
+            await manager.connect(ws, "room", "alice")
+
+        assert sockets[0].closed and sockets[0].close_code == 1008
+        assert [c.websocket for c in manager.online["alice"]] == sockets[1:]
+        metrics = manager.metrics()
+        assert (metrics["connections"], metrics["users_online"], metrics["evicted_over_cap"]) == (2, 1, 1)
+
+    def test_metrics_endpoint(self, db_session):
+        alice, bob, match = create_match(db_session)
+        admin = User(email="admin@test.com", hashed_password="pw", is_superuser=True)
+        db_session.add(admin)
+        db_session.commit()
+        url, admin_headers, user_headers = ws_args(match, alice), auth_header(admin), auth_header(bob)
+
+        with TestClient(app) as client:
+            with client.websocket_connect(**url):
+                metrics = client.get("/chat/metrics", headers=admin_headers).json()
+            assert client.get("/chat/metrics", headers=user_headers).status_code == 403
+            assert client.get("/chat/metrics").status_code in (401, 403)
+
+        assert metrics["connections"] == 1
+        assert metrics["users_online"] == 1
+
+
+class TestChatRooms:
+    """Tests for GET /chat/rooms"""
+
+    def add_partner(self, db_session, user, name, status=MatchStatus.ACCEPTED.value):
+        partner = User(email=f"{name.lower()}@test.com", hashed_password="pw", full_name=name)
+        db_session.add(partner)
+        db_session.flush()
+        match = Match(user_a_id=partner.id, user_b_id=user.id, overall_score=70.0, status=status)
+        db_session.add(match)
+        db_session.commit()
+        return partner, match
+
+    def test_rooms_with_last_message_and_unread(self, db_session):
+        alice, bob, bob_match = create_match(db_session)
+        carol, carol_match = self.add_partner(db_session, alice, "Carol")
+        self.add_partner(db_session, alice, "Dave", status=MatchStatus.PENDING.value)
+
+        add_message(db_session, bob_match, bob, "Gym at 6?", minutes_ago=30, is_read=True)
+        add_message(db_session, bob_match, bob, "Or 7?", minutes_ago=20)
+        add_message(db_session, bob_match, alice, "7 works", minutes_ago=10)
+        add_message(db_session, bob_match, bob, "See you", minutes_ago=5)
+
+        response = client.get("/chat/rooms", headers=auth_header(alice))
+        assert response.status_code == 200
+        rooms = response.json()
+
+        assert [r["partner_name"] for r in rooms] == ["Carol", "Bob"]
+        carol_room, bob_room = rooms
+        assert carol_room["last_message"] is None
+        assert carol_room["unread_count"] == 0
+        assert bob_room["match_id"] == bob_match.id
+        assert bob_room["partner_id"] == bob.id
+        assert bob_room["last_message"]["content"] == "See you"
+        assert bob_room["unread_count"] == 2
+
+        bob_rooms = client.get("/chat/rooms", headers=auth_header(bob)).json()
+        assert [(r["partner_name"], r["unread_count"]) for r in bob_rooms] == [("Alice", 1)]
+
+    def test_reading_clears_unread(self, db_session):
+        alice, bob, match = create_match(db_session)
+        add_message(db_session, match, bob, "Spot me?", minutes_ago=2)
+        last = add_message(db_session, match, bob, "Bench", minutes_ago=1)
+        match_id, last_id = match.id, last.id
+        headers = auth_header(alice)
+
+        client.get(f"/chat/{match_id}/messages", headers=headers)
+        message_writer.flush()
+
+        rooms = client.get("/chat/rooms", headers=headers).json()
+        assert rooms[0]["unread_count"] == 0
+        state = db_session.query(ChatReadState).filter_by(match_id=match_id, user_id=alice.id).one()
+        assert state.last_read_message_id == last_id
+        assert db_session.query(Message).filter(Message.is_read == False).count() == 0
+
+    def test_query_count_does_not_grow_with_rooms(self, db_session):
+        alice, bob, bob_match = create_match(db_session)
+        add_message(db_session, bob_match, bob, "hi", minutes_ago=1)
+        headers = auth_header(alice)
+
+        def count_queries():
+            statements = []
+            bind = db_session.get_bind()
+            listener = lambda *args: statements.append(args[2])
+            event.listen(bind, "before_cursor_execute", listener)
+            try:
+                rooms = client.get("/chat/rooms", headers=headers).json()
+            finally:
+                event.remove(bind, "before_cursor_execute", listener)
+            return len(rooms), len(statements)
+
+        one_room = count_queries()
+        for i in range(5):
+            partner, match = self.add_partner(db_session, alice, f"Partner{i}")
+            add_message(db_session, match, partner, "hey", minutes_ago=i)
+        many_rooms = count_queries()
+
+        assert one_room[0] == 1 and many_rooms[0] == 6
+        assert many_rooms[1] == one_room[1] == 2  # current user + rooms
+
+
+class TestReadReceipts:
+    """Tests for POST /chat/{match_id}/read and read-receipt events"""
+
+    def test_mark_read_is_one_update(self, db_session):
+        alice, bob, match = create_match(db_session)
+        for i in range(5):
+            add_message(db_session, match, bob, f"msg {i}", minutes_ago=10 - i)
+        add_message(db_session, match, alice, "mine", minutes_ago=1)
+        match_id, alice_id, headers = match.id, alice.id, auth_header(alice)
+
+        response = client.post(f"/chat/{match_id}/read", headers=headers)
+        assert response.status_code == 200
+
+        statements = []
+        bind = db_session.get_bind()
+        listener = lambda *args: statements.append(args[2])
+        event.listen(bind, "before_cursor_execute", listener)
+        try:
+            message_writer.flush()
+        finally:
+            event.remove(bind, "before_cursor_execute", listener)
+
+        assert len([s for s in statements if s.startswith("UPDATE messages")]) == 1
+        unread = db_session.query(Message).filter(Message.is_read == False).all()
+        assert [m.content for m in unread] == ["mine"]
+        state = db_session.query(ChatReadState).filter_by(match_id=match_id, user_id=alice_id).one()
+        assert state.unread_count == 0
+
+    def test_mark_read_up_to_cursor(self, db_session):
+        alice, bob, match = create_match(db_session)
+        older = add_message(db_session, match, bob, "older", minutes_ago=2)
+        add_message(db_session, match, bob, "newer", minutes_ago=1)
+        cursor = f"{older.created_at.isoformat()},{older.id}"
+
+        response = client.post(f"/chat/{match.id}/read", headers=auth_header(alice), params={"up_to": cursor})
+        message_writer.flush()
+
+        assert response.json()["read_up_to"] == older.id
+        assert [m.content for m in db_session.query(Message).filter(Message.is_read == False)] == ["newer"]
+        rooms = client.get("/chat/rooms", headers=auth_header(alice)).json()
+        assert rooms[0]["unread_count"] == 1
+
+    def test_read_pointer_only_moves_forward(self, db_session):
+        alice, bob, match = create_match(db_session)
+        m1 = add_message(db_session, match, bob, "first", minutes_ago=2)
+        m2 = add_message(db_session, match, bob, "second", minutes_ago=1)
+        headers = auth_header(alice)
+
+        client.post(f"/chat/{match.id}/read", headers=headers)
+        message_writer.flush()
+        client.post(f"/chat/{match.id}/read", headers=headers, params={"up_to": f"{m1.created_at.isoformat()},{m1.id}"})
+        message_writer.flush()
+
+        state = db_session.query(ChatReadState).filter_by(match_id=match.id, user_id=alice.id).one()
+        db_session.refresh(state)
+        assert state.last_read_message_id == m2.id
+
+    def test_mark_read_rejects_unknown_or_foreign_cursor(self, db_session):
+        alice, bob, match = create_match(db_session)
+        carol = User(email="carol@test.com", hashed_password="pw")
+        db_session.add(carol)
+        db_session.flush()
+        other = Match(user_a_id=bob.id, user_b_id=carol.id, overall_score=60.0, status=MatchStatus.ACCEPTED.value)
+        db_session.add(other)
+        db_session.commit()
+        foreign = add_message(db_session, other, carol, "elsewhere", minutes_ago=1)
+        now = datetime.utcnow().isoformat()
+
+        for cursor in (f"{now},not-a-message", f"{foreign.created_at.isoformat()},{foreign.id}"):
+            response = client.post(f"/chat/{match.id}/read", headers=auth_header(alice), params={"up_to": cursor})
+            assert response.status_code == 404
+        message_writer.flush()
+
+        state = db_session.query(ChatReadState).filter_by(match_id=match.id, user_id=alice.id).first()
+        assert state is None or state.last_read_message_id is None
+
+    def test_mark_read_up_to_buffered_message(self, db_session):
+        alice, bob, match = create_match(db_session)
+        # Sent over the socket moments ago, not flushed yet
+        payload = message_writer.enqueue(match.id, bob.id, "just now")
+        cursor = f"{payload['created_at']},{payload['id']}"
+
+        response = client.post(f"/chat/{match.id}/read", headers=auth_header(alice), params={"up_to": cursor})
+
+        assert response.json()["read_up_to"] == payload["id"]
+
+    def test_receipt_is_pushed_to_room(self, db_session):
+        alice, bob, match = create_match(db_session)
+        last = add_message(db_session, match, alice, "Ready?", minutes_ago=1)
+        match_id, last_id, bob_id, headers = match.id, last.id, bob.id, auth_header(bob)
+        url = ws_args(match, alice)
+
+        with TestClient(app) as ws_client:
+            with ws_client.websocket_connect(**url) as ws:
+                ws_client.post(f"/chat/{match_id}/read", headers=headers)
+                receipt = ws.receive_json()
+
+        assert receipt["type"] == "read_receipt"
+        assert receipt["reader_id"] == bob_id
+        assert receipt["up_to"] == last_id
+
+
+class TestChatHistory:
+    """Tests for GET /chat/{match_id}/messages"""
+
+    def test_cursor_pagination(self, db_session):
+        alice, bob, match = create_match(db_session)
+        for i in range(5):
+            add_message(db_session, match, bob, f"msg {i}", minutes_ago=10 - i)
+        add_message(db_session, match, alice, "reply", minutes_ago=4)
+        match_id, headers = match.id, auth_header(alice)
+        expected = [m.content for m in db_session.query(Message).order_by(Message.created_at, Message.id)]
+
+        pages, cursor = [], None
+        while True:
+            params = {"limit": 2, **({"before": cursor} if cursor else {})}
+            response = client.get(f"/chat/{match_id}/messages", headers=headers, params=params)
+            assert response.status_code == 200
+            pages.append([m["content"] for m in response.json()])
+            cursor = response.headers.get("X-Next-Cursor")
+            if len(pages) == 1:
+                # A message arriving mid-scroll must not shift older pages
+                add_message(db_session, match, bob, "new", minutes_ago=0)
+            if not cursor:
+                break
+
+        seen = [content for page in reversed(pages) for content in page]
+        assert seen == expected
+        assert len(pages) == 3
+
+    def test_cursor_header_is_readable_cross_origin(self, db_session):
+        alice, bob, match = create_match(db_session)
+        for i in range(3):
+            add_message(db_session, match, bob, f"msg {i}", minutes_ago=10 - i)
+
+        response = client.get(
+            f"/chat/{match.id}/messages",
+            headers={**auth_header(alice), "Origin": "http://localhost:3000"},
+            params={"limit": 2},
+        )
+
+        assert response.headers["X-Next-Cursor"]
+        assert "X-Next-Cursor" in response.headers["Access-Control-Expose-Headers"]
+
+    def test_cursor_breaks_timestamp_ties_by_id(self, db_session):
+        alice, bob, match = create_match(db_session)
+        same_time = datetime.utcnow()
+        db_session.add_all([
+            Message(match_id=match.id, sender_id=bob.id, content=str(i), created_at=same_time) for i in range(3)
+        ])
+        db_session.commit()
+        match_id, headers = match.id, auth_header(alice)
+
+        seen, cursor = [], None
+        for _ in range(3):
+            params = {"limit": 1, **({"before": cursor} if cursor else {})}
+            response = client.get(f"/chat/{match_id}/messages", headers=headers, params=params)
+            seen += [m["id"] for m in response.json()]
+            cursor = response.headers.get("X-Next-Cursor")
+
+        assert cursor is None
+        assert seen == sorted(seen, reverse=True) and len(set(seen)) == 3
+
+    def test_invalid_cursor(self, db_session):
+        alice, bob, match = create_match(db_session)
+        response = client.get(f"/chat/{match.id}/messages", headers=auth_header(alice), params={"before": "yesterday"})
+        assert response.status_code == 400
+
+
+class TestConnectionManager:
+    """Unit tests for broadcast fan-out"""
+
+    @pytest.mark.asyncio
+    async def test_slow_client_does_not_delay_others(self):
+        manager = ConnectionManager(send_timeout=5.0)
+        fast, slow = FakeWebSocket(), FakeWebSocket(delay=0.5)
+        await manager.connect(fast, "room")
+        await manager.connect(slow, "room")
+
+        await manager.broadcast_to_match({"content": "hi"}, "room")
+        await asyncio.sleep(0.05)
+
+        assert [json.loads(t) for t in fast.sent] == [{"content": "hi"}]
+        assert slow.sent == []
+
+    @pytest.mark.asyncio
+    async def test_dead_and_timed_out_clients_are_dropped(self):
+        manager = ConnectionManager(send_timeout=0.05)
+        ok, dead, stuck = FakeWebSocket(), FakeWebSocket(fail=True), FakeWebSocket(delay=1.0)
+        for ws in (ok, dead, stuck):
+            await manager.connect(ws, "room")
+
+        await manager.broadcast_to_match({"content": "hi"}, "room")
+        await asyncio.sleep(0.2)
+
+        assert [c.websocket for c in manager.active_connections["room"]] == [ok]
+        assert dead.closed and stuck.closed
+
+    @pytest.mark.asyncio
+    async def test_full_queue_drops_client(self):
+        manager = ConnectionManager(queue_size=2, send_timeout=5.0)
+        ok, slow = FakeWebSocket(), FakeWebSocket(delay=1.0)
+        await manager.connect(ok, "room")
+        await manager.connect(slow, "room")
+
+        for i in range(4):
+            await manager.broadcast_to_match({"n": i}, "room")
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+
+        assert slow.closed
+        assert len(ok.sent) == 4
+
+    @pytest.mark.asyncio
+    async def test_shared_broker_reaches_other_manager(self):
+        # Two managers stand in for two workers behind one broker
+        broker = InProcessBroker()
+        worker_a, worker_b = ConnectionManager(broker=broker), ConnectionManager(broker=broker)
+        alice, bob, stranger = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        await worker_a.connect(alice, "room")
+        await worker_b.connect(bob, "room")
+        await worker_b.connect(stranger, "other-room")
+
+        await worker_a.broadcast_to_match({"content": "hi"}, "room")
+        await asyncio.sleep(0.05)
+
+        assert alice.sent == bob.sent == ['{"content":"hi"}']
+        assert stranger.sent == []
+
+    def test_create_broker(self):
+        assert isinstance(create_broker(""), InProcessBroker)
+        with pytest.raises(ValueError):
+            create_broker("amqp://localhost")
+
+    def test_incomplete_broker_fails_at_construction(self):
+        class NoPublish(ChatBroker):
+            async def start(self, handler):
+                pass
+
+        with pytest.raises(TypeError):
+            NoPublish()
+
+    @pytest.mark.asyncio
+    async def test_disconnect_empties_room(self):
+        manager = ConnectionManager()
+        ws = FakeWebSocket()
+        await manager.connect(ws, "room")
+        manager.disconnect(ws, "room")
+        manager.disconnect(ws, "room")
+
+        assert manager.active_connections == {}
+        await manager.broadcast_to_match({"content": "hi"}, "room")
+
+    @pytest.mark.asyncio
+    async def test_binary_clients_share_one_encoding(self):
+        manager = ConnectionManager()
+        json_ws, first, second = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        await manager.connect(json_ws, "room")
+        await manager.connect(first, "room", subprotocol=MSGPACK_SUBPROTOCOL)
+        await manager.connect(second, "room", subprotocol=MSGPACK_SUBPROTOCOL)
+
+        await manager.broadcast_to_match({"type": "typing", "match_id": "room", "user_id": "u1"}, "room")
+        await asyncio.sleep(0.05)
+
+        assert json.loads(json_ws.sent[0])["user_id"] == "u1"
+        assert first.sent[0] is second.sent[0]
+        assert from_msgpack(first.sent[0]) == {"type": "typing", "match_id": "room", "user_id": "u1"}
+
+
+def redis_broker(server, **kwargs):
+    """RedisBroker on an in-memory fakeredis server (no network needed)."""
+    fakeredis = pytest.importorskip("fakeredis")
+    client = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+    return RedisBroker(client=client, retry_max=0.1, poll_timeout=0.05, **kwargs)
+
+
+async def wait_for(condition, timeout=2.0):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+
+
+class TestRedisBroker:
+    """Tests for cross-worker fan-out over Redis pub/sub"""
+
+    @pytest.mark.asyncio
+    async def test_workers_subscribe_only_to_their_rooms(self):
+        fakeredis = pytest.importorskip("fakeredis")
+        server = fakeredis.FakeServer()
+        worker_a = ConnectionManager(broker=redis_broker(server), ping_interval=0)
+        worker_b = ConnectionManager(broker=redis_broker(server), ping_interval=0)
+        alice, bob, stranger = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        await worker_a.connect(alice, "room")
+        await worker_b.connect(bob, "room")
+        await worker_b.connect(stranger, "other-room")
+
+        assert worker_a.broker.rooms == {"presence", "room"}
+        assert worker_b.broker.rooms == {"presence", "room", "other-room"}
+
+        await worker_a.broadcast_to_match({"content": "hi"}, "room")
+        await worker_a.broadcast_to_match({"content": "elsewhere"}, "other-room")
+        await wait_for(lambda: alice.sent and bob.sent and stranger.sent)
+
+        assert alice.sent == bob.sent == ['{"content":"hi"}']
+        assert stranger.sent == ['{"content":"elsewhere"}']
+
+        # The last local socket leaving a room drops the subscription
+        await worker_b.leave(stranger, "other-room")
+        assert worker_b.broker.rooms == {"presence", "room"}
+
+        await worker_a.close()
+        await worker_b.close()
+
+    @pytest.mark.asyncio
+    async def test_listener_survives_handler_errors_and_reconnects(self):
+        fakeredis = pytest.importorskip("fakeredis")
+        server = fakeredis.FakeServer()
+        received = []
+
+        async def handler(match_id, text):
+            if text == "boom":
+                raise RuntimeError("bad frame")
+            received.append((match_id, text))
+
+        broker, publisher = redis_broker(server), redis_broker(server)
+        await broker.start(handler)
+        await broker.subscribe("room")
+
+        await publisher.publish("room", "boom")
+        await publisher.publish("room", "after error")
+        await wait_for(lambda: received)
+        assert received == [("room", "after error")]
+
+        # Redis goes away and comes back: the listener resubscribes on its own
+        server.connected = False
+        await asyncio.sleep(0.2)
+        server.connected = True
+        for _ in range(200):
+            await publisher.publish("room", "after reconnect")
+            await asyncio.sleep(0.01)
+            if len(received) > 1:
+                break
+        assert received[1] == ("room", "after reconnect")
+
+        await broker.stop()
+        await publisher.stop()
+
+
+class TestMessageWriteBehind:
+    """Unit tests for batched chat persistence"""
+
+    def make_writer(self, db_session, **kwargs):
+        return MessageWriteBehind(session_factory=sessionmaker(bind=db_session.get_bind()), **kwargs)
+
+    def make_flaky_writer(self, db_session, failures, **kwargs):
+        """Writer whose first `failures` commits fail as if the database were locked."""
+        factory = sessionmaker(bind=db_session.get_bind())
+        attempts = []
+
+        def session_factory():
+            session = factory()
+            commit = session.commit
+
+            def flaky_commit():
+                attempts.append(1)
+                if len(attempts) <= failures:
+                    raise OperationalError("COMMIT", {}, Exception("database is locked"))
+                commit()
+
+            session.commit = flaky_commit
+            return session
+
+        return MessageWriteBehind(session_factory=session_factory, **kwargs), attempts
+
+    def test_batch_is_one_insert(self, db_session):
+        alice, bob, match = create_match(db_session)
+        writer = self.make_writer(db_session, flush_interval=60, batch_size=100)
+
+        payloads = [writer.enqueue(match.id, alice.id, f"set {i}") for i in range(5)]
+        assert db_session.query(Message).count() == 0
+
+        inserts = []
+        bind = db_session.get_bind()
+        listener = lambda conn, cursor, statement, *args: inserts.append(statement)
+        event.listen(bind, "before_cursor_execute", listener)
+        try:
+            writer.stop()
+        finally:
+            event.remove(bind, "before_cursor_execute", listener)
+
+        assert len([s for s in inserts if s.startswith("INSERT INTO messages")]) == 1
+        stored = {m.id: m.content for m in db_session.query(Message)}
+        assert stored == {p["id"]: p["content"] for p in payloads}
+
+    def test_full_batch_flushes_early(self, db_session):
+        alice, bob, match = create_match(db_session)
+        writer = self.make_writer(db_session, flush_interval=60, batch_size=3)
+
+        for i in range(3):
+            writer.enqueue(match.id, bob.id, f"rep {i}")
+        for _ in range(100):
+            if db_session.query(Message).count() == 3:
+                break
+            db_session.rollback()
+            threading.Event().wait(0.01)
+
+        assert db_session.query(Message).count() == 3
+        writer.stop()
+
+    def test_bad_message_does_not_sink_batch(self, db_session):
+        alice, bob, match = create_match(db_session)
+        writer = self.make_writer(db_session, flush_interval=60)
+
+        writer.enqueue(match.id, alice.id, "ok")
+        writer.enqueue(match.id, alice.id, None)
+        writer.stop()
+
+        assert [m.content for m in db_session.query(Message)] == ["ok"]
+
+    def test_bad_receipt_does_not_sink_others(self, db_session):
+        alice, bob, match = create_match(db_session)
+        add_message(db_session, match, bob, "hi", minutes_ago=1)
+        writer = self.make_writer(db_session, flush_interval=60)
+
+        writer.enqueue_read(match.id, alice.id, "not a timestamp")
+        writer.enqueue_read(match.id, alice.id, datetime.utcnow())
+        writer.stop()
+
+        assert [m.is_read for m in db_session.query(Message)] == [True]
+
+    def test_transient_error_keeps_batch_queued(self, db_session):
+        alice, bob, match = create_match(db_session)
+        writer, attempts = self.make_flaky_writer(db_session, failures=1, flush_interval=60)
+
+        payloads = [writer.enqueue(match.id, alice.id, f"set {i}") for i in range(3)]
+        assert writer.flush() is False
+        assert db_session.query(Message).count() == 0
+
+        later = writer.enqueue(match.id, bob.id, "after the outage")
+        assert writer.flush() is True
+        writer.stop()
+
+        stored = [m.id for m in db_session.query(Message).order_by(Message.created_at)]
+        assert stored == [p["id"] for p in payloads] + [later["id"]]
+        assert len(attempts) == 2
+
+    def test_writer_thread_retries_with_backoff(self, db_session):
+        alice, bob, match = create_match(db_session)
+        writer, attempts = self.make_flaky_writer(db_session, failures=2, flush_interval=0.01, retry_max=0.05)
+
+        for i in range(3):
+            writer.enqueue(match.id, alice.id, f"rep {i}")
+        # Two failed commits, then the one that succeeds
+        for _ in range(100):
+            if len(attempts) >= 3:
+                break
+            threading.Event().wait(0.01)
+        writer.stop()
+
+        assert len(attempts) == 3
+        assert db_session.query(Message).count() == 3
+
+    def test_stop_gives_up_when_database_stays_down(self, db_session):
+        alice, bob, match = create_match(db_session)
+        writer, attempts = self.make_flaky_writer(db_session, failures=100, flush_interval=0.01, retry_max=0.05)
+
+        writer.enqueue(match.id, alice.id, "lost")
+        writer.stop()
+
+        assert db_session.query(Message).count() == 0
+        assert writer.flush() is True
+
+    def test_flush_updates_read_state(self, db_session):
+        alice, bob, match = create_match(db_session)
+        writer = self.make_writer(db_session, flush_interval=60)
+
+        writer.enqueue(match.id, alice.id, "one")
+        writer.enqueue(match.id, alice.id, "two")
+        last = writer.enqueue(match.id, bob.id, "three")
+        writer.stop()
+
+        states = {s.user_id: s for s in db_session.query(ChatReadState).filter_by(match_id=match.id)}
+        assert states[alice.id].unread_count == 1
+        assert states[bob.id].unread_count == 2
+        assert states[alice.id].last_message_id == states[bob.id].last_message_id == last["id"]
@@ -0,0 +1,63 @@
+"""
+Tests for the Bitset Compatibility Kernel
+"""
+
+import numpy as np
+import pytest
+from app.models import FitnessProfile
+from app.services.compatibility import (
+    GOALS,
+    jaccard,
+    jaccard_many,
+    popcount,
+    pack_profile,
+    pack_profiles,
+    goal_alignment,
+    goal_alignment_many,
+    days_overlap_many,
+)
+
+
+class TestBitsetKernel:
+    """Unit tests for bitmask packing and popcount scoring"""
+
+    def test_enum_values_have_fixed_bits(self):
+        assert GOALS.mask(["build_muscle"]) == 1
+        assert GOALS.mask(["build_muscle", "lose_weight"]) == 0b11
+        assert GOALS.mask([]) == 0
+
+    def test_values_outside_the_enum_are_ignored(self):
+        assert GOALS.mask(["legacy_goal", "build_muscle", "another_legacy_goal"]) == 1
+        assert GOALS.bit("legacy_goal") is None
+
+        # Legacy-only profiles share nothing, however many distinct values they hold
+        a = pack_profile(FitnessProfile(goals=[f"old_{i}" for i in range(100)], workout_types=[], preferred_days=[]))
+        b = pack_profile(FitnessProfile(goals=[f"old_{i}" for i in range(100, 200)], workout_types=[], preferred_days=[]))
+        assert a.goals == b.goals == 0
+        assert goal_alignment(a, b) == 0.0
+
+    def test_jaccard(self):
+        assert jaccard(0b011, 0b110) == pytest.approx(1 / 3)
+        assert jaccard(0b1, 0b1) == 1.0
+        assert jaccard(0, 0) == 0.0
+
+    def test_popcount_high_bit(self):
+        masks = np.array([0, 1, 2**63 + 1, 2**64 - 1], dtype=np.uint64)
+        assert popcount(masks).tolist() == [0, 1, 2, 64]
+
+    def test_batched_matches_scalar(self):
+        user = FitnessProfile(goals=["build_muscle", "stay_fit"], workout_types=["strength"], preferred_days=["monday"])
+        candidates = [
+            FitnessProfile(goals=["build_muscle"], workout_types=["strength", "yoga"], preferred_days=["monday", "friday"]),
+            FitnessProfile(goals=[], workout_types=["strength"], preferred_days=[]),
+            FitnessProfile(goals=["flexibility"], workout_types=[], preferred_days=["sunday"]),
+            FitnessProfile(goals=["custom_goal"], workout_types=["custom_type"], preferred_days=["monday"]),
+        ]
+        bits = pack_profile(user)
+        goals, types, days = pack_profiles(candidates)
+
+        expected = [goal_alignment(bits, pack_profile(c)) for c in candidates]
+        assert goal_alignment_many(bits, goals, types).tolist() == pytest.approx(expected)
+        assert expected[3] == 0.0
+        assert jaccard_many(bits.days, days).tolist() == pytest.approx([0.5, 0.0, 0.0, 1.0])
+        assert days_overlap_many(bits, days).tolist() == pytest.approx([0.5, 0.0, 0.0, 1.0])
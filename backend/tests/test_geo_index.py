@@ -0,0 +1,78 @@
+"""
+Tests for the Gym Geo Index
+"""
+
+import time
+
+import pytest
+from sqlalchemy import event
+from app.models import Gym
+from app.services.geo_index import GymGeoIndex
+
+
+class TestGymGeoIndex:
+    """Integration tests for loading and querying the spatial index"""
+
+    def test_within_radius_sorted_by_distance(self, db_session):
+        near = Gym(name="Near", latitude=10.0, longitude=10.1)
+        here = Gym(name="Here", latitude=10.0, longitude=10.0)
+        far = Gym(name="Far", latitude=20.0, longitude=20.0)
+        no_coords = Gym(name="Unknown")
+        inactive = Gym(name="Closed", latitude=10.0, longitude=10.0, is_active=False)
+        db_session.add_all([near, here, far, no_coords, inactive])
+        db_session.commit()
+
+        index = GymGeoIndex()
+        index.ensure_loaded(db_session)
+        results = index.within(10.0, 10.0, 50)
+
+        assert [gym_id for gym_id, _ in results] == [here.id, near.id]
+        assert results[0][1] == pytest.approx(0.0)
+        assert results[1][1] == pytest.approx(10.95, abs=0.1)
+
+    def test_upsert_and_remove(self, db_session):
+        index = GymGeoIndex()
+        index.ensure_loaded(db_session)
+        assert index.within(10.0, 10.0, 50) == []
+
+        gym = Gym(id="g1", name="New", latitude=10.0, longitude=10.0, is_active=True)
+        index.upsert(gym)
+        assert [gym_id for gym_id, _ in index.within(10.0, 10.0, 1)] == ["g1"]
+
+        index.remove("g1")
+        assert index.within(10.0, 10.0, 1) == []
+
+    def test_gyms_from_other_workers_appear_after_reload(self, db_session):
+        index = GymGeoIndex(reload_interval=60)
+        index.ensure_loaded(db_session)
+
+        # Committed by another worker: this index never saw an upsert
+        gym = Gym(name="Elsewhere", latitude=10.0, longitude=10.0)
+        db_session.add(gym)
+        db_session.commit()
+        index.ensure_loaded(db_session)
+        assert index.within(10.0, 10.0, 1) == []
+
+        index._reload.loaded_at = time.monotonic() - 61
+        index.ensure_loaded(db_session)
+        assert [gym_id for gym_id, _ in index.within(10.0, 10.0, 1)] == [gym.id]
+
+    def test_upsert_during_reload_is_not_lost(self, db_session):
+        index = GymGeoIndex(reload_interval=60)
+        index.ensure_loaded(db_session)
+        index._reload.loaded_at = time.monotonic() - 61
+        gym = Gym(id="g1", name="New", latitude=10.0, longitude=10.0, is_active=True)
+
+        def upsert_while_loading(conn, cursor, statement, *args):
+            # Created here after the reload read the table
+            if "FROM gyms" in statement:
+                index.upsert(gym)
+
+        bind = db_session.get_bind()
+        event.listen(bind, "after_cursor_execute", upsert_while_loading)
+        try:
+            index.ensure_loaded(db_session)
+        finally:
+            event.remove(bind, "after_cursor_execute", upsert_while_loading)
+
+        assert [gym_id for gym_id, _ in index.within(10.0, 10.0, 1)] == ["g1"]
@@ -0,0 +1,279 @@
+"""
+Tests for Gym endpoints
+"""
+
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from app.main import app
+from app.models import Gym, User, FitnessProfile
+from app.services.gym_search import GymSearchIndex, _SearchState, gym_search, normalize
+
+client = TestClient(app)
+
+
+def get_auth_header():
+    """Helper to register and login, return auth header."""
+    client.post(
+        "/auth/register",
+        json={"email": "gymgoer@example.com", "password": "password123", "full_name": "Gym Goer"},
+    )
+    response = client.post(
+        "/auth/login",
+        json={"email": "gymgoer@example.com", "password": "password123"},
+    )
+    token = response.json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+def add_gyms(db_session, count, city="Springfield"):
+    """Add gyms spaced ~11km apart eastwards from (10, 10)."""
+    gyms = [
+        Gym(name=f"Gym {i}", city=city, latitude=10.0, longitude=10.0 + 0.1 * i)
+        for i in range(count)
+    ]
+    db_session.add_all(gyms)
+    db_session.commit()
+    return gyms
+
+
+class TestGymSearch:
+    """Tests for GET /gyms"""
+
+    def test_nearest_gyms_first(self, db_session):
+        headers = get_auth_header()
+        # Insert far gyms first so an unordered LIMIT would miss the nearest ones
+        add_gyms(db_session, 60)
+
+        response = client.get("/gyms", headers=headers, params={"lat": 10.0, "lon": 15.9, "limit": 3})
+        assert response.status_code == 200
+        names = [g["name"] for g in response.json()]
+        assert names == ["Gym 59", "Gym 58", "Gym 57"]
+
+    def test_radius_and_pagination(self, db_session):
+        headers = get_auth_header()
+        add_gyms(db_session, 10)
+
+        params = {"lat": 10.0, "lon": 10.0, "radius_km": 35, "limit": 2}
+        first = client.get("/gyms", headers=headers, params=params).json()
+        second = client.get("/gyms", headers=headers, params={**params, "offset": 2}).json()
+
+        assert [g["name"] for g in first] == ["Gym 0", "Gym 1"]
+        assert [g["name"] for g in second] == ["Gym 2", "Gym 3"]
+        assert all(g["distance_km"] <= 35 for g in first + second)
+
+    def test_radius_without_location_is_rejected(self, db_session):
+        headers = get_auth_header()
+        add_gyms(db_session, 3)
+
+        for params in ({"radius_km": 10}, {"radius_km": 10, "lat": 10.0}):
+            response = client.get("/gyms", headers=headers, params=params)
+            assert response.status_code == 422
+
+    def test_query_with_distance(self, db_session):
+        headers = get_auth_header()
+        add_gyms(db_session, 5, city="Springfield")
+        db_session.add(Gym(name="Elsewhere Gym", city="Shelbyville", latitude=10.0, longitude=10.0))
+        db_session.commit()
+
+        response = client.get(
+            "/gyms", headers=headers,
+            params={"query": "springfield", "lat": 10.0, "lon": 10.24, "radius_km": 10},
+        )
+        names = [g["name"] for g in response.json()]
+        assert names == ["Gym 2", "Gym 3"]
+
+    def test_created_gym_is_searchable_by_distance(self, db_session):
+        headers = get_auth_header()
+        add_gyms(db_session, 3)
+        # Load the index before creating the new gym
+        client.get("/gyms", headers=headers, params={"lat": 10.0, "lon": 10.0})
+
+        response = client.post("/gyms", headers=headers, json={"name": "Brand New", "latitude": 50.0, "longitude": 50.0})
+        assert response.status_code == 201
+
+        nearest = client.get("/gyms", headers=headers, params={"lat": 50.0, "lon": 50.0, "limit": 1}).json()
+        assert nearest[0]["name"] == "Brand New"
+
+    def test_popularity_sort_and_member_counts(self, db_session):
+        headers = get_auth_header()
+        quiet, busy, medium = add_gyms(db_session, 3)
+        for i, gym in enumerate([busy, busy, busy, medium, medium]):
+            user = User(email=f"member{i}@test.com", hashed_password="pw")
+            FitnessProfile(user=user, preferred_gym=gym)
+            db_session.add(user)
+        db_session.commit()
+
+        response = client.get("/gyms", headers=headers)
+        results = [(g["name"], g["member_count"]) for g in response.json()]
+        assert results == [(busy.name, 3), (medium.name, 2), (quiet.name, 0)]
+
+        page = client.get("/gyms", headers=headers, params={"limit": 1, "offset": 1}).json()
+        assert [g["name"] for g in page] == [medium.name]
+
+        nearest = client.get("/gyms", headers=headers, params={"lat": 10.0, "lon": 10.1, "limit": 1}).json()
+        assert nearest[0]["member_count"] == 3
+
+    def test_text_search_ranks_name_matches_first(self, db_session):
+        headers = get_auth_header()
+        db_session.add_all([
+            Gym(name="Iron Paradise", city="Goldtown"),
+            Gym(name="Gold's Gym", city="Venice"),
+            Gym(name="Golden Barbell", city="Venice"),
+            Gym(name="Closed Gold", city="Venice", is_active=False),
+        ])
+        db_session.commit()
+
+        names = [g["name"] for g in client.get("/gyms", headers=headers, params={"query": "gold"}).json()]
+        assert names == ["Gold's Gym", "Golden Barbell", "Iron Paradise"]
+
+        names = [g["name"] for g in client.get("/gyms", headers=headers, params={"query": "ven"}).json()]
+        assert names == ["Gold's Gym", "Golden Barbell"]
+
+        response = client.post("/gyms", headers=headers, json={"name": "Goldfish Fitness", "city": "Venice"})
+        assert response.status_code == 201
+        names = [g["name"] for g in client.get("/gyms", headers=headers, params={"query": "goldf"}).json()]
+        assert names == ["Goldfish Fitness"]
+
+
+    def test_gyms_from_other_workers_become_searchable(self, db_session):
+        headers = get_auth_header()
+        assert client.get("/gyms", headers=headers, params={"query": "gold"}).json() == []
+
+        # Created on another worker, so this worker's index never saw an upsert
+        db_session.add(Gym(name="Gold's Gym", city="Venice"))
+        db_session.commit()
+        gym_search._reload.loaded_at = time.monotonic() - gym_search.reload_interval
+
+        names = [g["name"] for g in client.get("/gyms", headers=headers, params={"query": "gold"}).json()]
+        assert names == ["Gold's Gym"]
+
+
+    def test_upsert_during_reload_is_not_lost(self, db_session):
+        index = GymSearchIndex(reload_interval=60)
+        index.ensure_loaded(db_session)
+        index._reload.loaded_at = time.monotonic() - 61
+
+        def upsert_while_loading(conn, cursor, statement, *args):
+            if "FROM gyms" in statement:
+                index.upsert(Gym(id="g1", name="Goldfish Fitness", city="Venice", is_active=True))
+
+        bind = db_session.get_bind()
+        event.listen(bind, "after_cursor_execute", upsert_while_loading)
+        try:
+            index.ensure_loaded(db_session)
+        finally:
+            event.remove(bind, "after_cursor_execute", upsert_while_loading)
+
+        assert index.search("goldf") == ["g1"]
+
+
+class TestGymSuggest:
+    """Tests for GET /gyms/suggest"""
+
+    def test_suggest_by_member_count(self, db_session):
+        headers = get_auth_header()
+        quiet, busy = Gym(name="Iron Works", city="Venice"), Gym(name="Iron Temple", city="Venice")
+        db_session.add_all([quiet, busy, Gym(name="Yoga Loft", city="Ironton")])
+        for i in range(2):
+            user = User(email=f"member{i}@test.com", hashed_password="pw")
+            FitnessProfile(user=user, preferred_gym=busy)
+            db_session.add(user)
+        db_session.commit()
+
+        results = client.get("/gyms/suggest", headers=headers, params={"q": "iron"}).json()
+        assert [(g["name"], g["member_count"]) for g in results] == [
+            ("Iron Temple", 2), ("Iron Works", 0), ("Yoga Loft", 0),
+        ]
+        assert [g["name"] for g in client.get("/gyms/suggest", headers=headers, params={"q": "temp"}).json()] == ["Iron Temple"]
+        assert len(client.get("/gyms/suggest", headers=headers, params={"q": "i", "limit": 1}).json()) == 1
+
+    def test_index_updates_without_queries(self, db_session):
+        headers = get_auth_header()
+        client.get("/profiles/me", headers=headers)
+        add_gyms(db_session, 2)
+        client.get("/gyms/suggest", headers=headers, params={"q": "gym"})
+
+        response = client.post("/gyms", headers=headers, json={"name": "Gym Zero", "city": "Springfield"})
+        gym_id = response.json()["id"]
+        client.post(f"/gyms/{gym_id}/check-in", headers=headers)
+
+        statements = []
+        bind = db_session.get_bind()
+        listener = lambda *args: statements.append(args[2])
+        event.listen(bind, "before_cursor_execute", listener)
+        try:
+            results = client.get("/gyms/suggest", headers=headers, params={"q": "gym"}).json()
+        finally:
+            event.remove(bind, "before_cursor_execute", listener)
+
+        assert statements == []
+        assert results[0]["name"] == "Gym Zero"
+        assert results[0]["member_count"] == 1
+
+    def test_member_counts_catch_up_after_reload(self, db_session):
+        headers = get_auth_header()
+        gym = Gym(name="Iron Temple", city="Venice")
+        db_session.add(gym)
+        db_session.commit()
+        assert client.get("/gyms/suggest", headers=headers, params={"q": "iron"}).json()[0]["member_count"] == 0
+
+        # A check-in handled by another worker
+        user = User(email="member@test.com", hashed_password="pw")
+        FitnessProfile(user=user, preferred_gym=gym)
+        db_session.add(user)
+        db_session.commit()
+        gym_search._reload.loaded_at = time.monotonic() - gym_search.reload_interval
+
+        assert client.get("/gyms/suggest", headers=headers, params={"q": "iron"}).json()[0]["member_count"] == 1
+
+    def test_requires_auth(self):
+        assert client.get("/gyms/suggest", params={"q": "gym"}).status_code in (401, 403)
+
+
+class TestGymSearchIndex:
+    """Unit tests for the in-memory gym text index"""
+
+    def build(self, *gyms):
+        index = GymSearchIndex()
+        index._reload.value = _SearchState()
+        for i, (name, city) in enumerate(gyms):
+            index.upsert(Gym(id=f"g{i}", name=name, city=city, is_active=True))
+        return index
+
+    def test_normalize(self):
+        assert normalize("  Café   Gym-Zürich! ") == "cafe gym zurich"
+
+    def test_substring_and_prefix_matching(self):
+        index = self.build(("Powerhouse Gym", "Berlin"), ("Anytime Fitness", "Bern"), ("Yoga Loft", "Paris"))
+        assert index.search("house") == ["g0"]
+        assert index.search("be") == ["g1", "g0"]
+        assert set(index.search("ber")) == {"g0", "g1"}
+        assert index.search("fitness bern") == ["g1"]
+        assert index.search("gym paris") == []
+        assert index.search("!!") == []
+
+    def test_remove(self):
+        index = self.build(("Powerhouse Gym", "Berlin"))
+        index.remove("g0")
+        assert index.search("power") == []
+
+    def test_word_list_is_kept_sorted_incrementally(self):
+        index = self.build(("Powerhouse Gym", "Berlin"), ("Anytime Fitness", "Bern"))
+        index.upsert(Gym(id="g2", name="Zen Gym", city="Aachen", is_active=True))
+        index.remove("g1")
+        state = index._reload.value
+        assert state.sorted_words == sorted(state.words) == ["aachen", "berlin", "gym", "powerhouse", "zen"]
+        assert index.search("a") == ["g2"]
+
+    def test_suggest_prefixes(self):
+        index = self.build(("Powerhouse Gym", "Berlin"), ("Anytime Fitness", "Bern"), ("Power Yoga", "Paris"))
+        index.move_member(None, "g2")
+        assert [g["id"] for g in index.suggest("power")] == ["g2", "g0"]
+        assert [g["id"] for g in index.suggest("powerhouse g")] == ["g0"]
+        assert [g["id"] for g in index.suggest("BER")] == ["g1", "g0"]
+        assert index.suggest("house") == []
+        index.move_member("g2", "g0")
+        assert [g["member_count"] for g in index.suggest("power")] == [1, 0]
@@ -92,6 +92,27 @@ class TestMatchingAPIIntegration:
         assert len(accepted) == 1
         assert accepted[0]["status"] == "accepted"
 
+    def test_requested_users_leave_recommendations(self, db_session):
+        """Users with an existing match are no longer recommended, in either direction."""
+        user_a = create_user_with_profile(
+            "first@test.com", "password123", "First", "female",
+            ["build_muscle"], "morning"
+        )
+        user_b = create_user_with_profile(
+            "second@test.com", "password123", "Second", "male",
+            ["build_muscle"], "morning"
+        )
+
+        recs = client.get("/matches/recommendations", headers=user_b["headers"]).json()
+        assert user_a["user_id"] in [r["user_id"] for r in recs]
+
+        resp = client.post(f"/matches/{user_b['user_id']}/request", headers=user_a["headers"])
+        assert resp.status_code == 201
+
+        for requester, other in ((user_a, user_b), (user_b, user_a)):
+            recs = client.get("/matches/recommendations", headers=requester["headers"]).json()
+            assert other["user_id"] not in [r["user_id"] for r in recs]
+
     def test_cannot_match_self(self, db_session):
         """Test that a user cannot send match request to themselves."""
         user = create_user_with_profile(
@@ -2,9 +2,16 @@
 Tests for Matching Service
 """
 
+import threading
+import time
+
+import numpy as np
 import pytest
+from sqlalchemy import event
 from app.services.matching_service import MatchingService
-from app.models import User, FitnessProfile, MatchPreference, Gym, FitnessLevel
+from app.services.geo_index import gym_index
+from app.ml.recommender import FitnessRecommender
+from app.models import User, FitnessProfile, MatchPreference, Gym, FitnessLevel, Match
 
 class TestMatchingServiceLogic:
     """Unit tests for scoring logic"""
@@ -13,34 +20,34 @@ class TestMatchingServiceLogic:
         service = MatchingService()
         
         # Perfect match
-        p1 = FitnessProfile(goals=["muscle"], workout_types=["strength"])
-        p2 = FitnessProfile(goals=["muscle"], workout_types=["strength"])
+        p1 = FitnessProfile(goals=["build_muscle"], workout_types=["strength"])
+        p2 = FitnessProfile(goals=["build_muscle"], workout_types=["strength"])
         assert service.calculate_goal_alignment(p1, p2) == 1.0
         
         # Partial match
-        p3 = FitnessProfile(goals=["muscle", "cardio"], workout_types=["strength"])
-        p4 = FitnessProfile(goals=["muscle"], workout_types=["yoga"])
+        p3 = FitnessProfile(goals=["build_muscle", "improve_cardio"], workout_types=["strength"])
+        p4 = FitnessProfile(goals=["build_muscle"], workout_types=["yoga"])
         # Goals: 1/2 = 0.5 * 0.6 = 0.3
         # Types: 0/2 = 0.0 * 0.4 = 0.0
         # Total: 0.3
         assert service.calculate_goal_alignment(p3, p4) == 0.3
         
         # No match
-        p5 = FitnessProfile(goals=["muscle"], workout_types=["strength"])
-        p6 = FitnessProfile(goals=["cardio"], workout_types=["yoga"])
+        p5 = FitnessProfile(goals=["build_muscle"], workout_types=["strength"])
+        p6 = FitnessProfile(goals=["improve_cardio"], workout_types=["yoga"])
         assert service.calculate_goal_alignment(p5, p6) == 0.0
 
     def test_calculate_schedule_compatibility(self):
         service = MatchingService()
         
         # Exact schedule
-        p1 = FitnessProfile(preferred_schedule="morning", preferred_days=["mon"])
-        p2 = FitnessProfile(preferred_schedule="morning", preferred_days=["mon"])
+        p1 = FitnessProfile(preferred_schedule="morning", preferred_days=["monday"])
+        p2 = FitnessProfile(preferred_schedule="morning", preferred_days=["monday"])
         assert service.calculate_schedule_compatibility(p1, p2) == 1.0
         
         # Different schedule, same days
-        p3 = FitnessProfile(preferred_schedule="morning", preferred_days=["mon", "tue"])
-        p4 = FitnessProfile(preferred_schedule="evening", preferred_days=["mon"])
+        p3 = FitnessProfile(preferred_schedule="morning", preferred_days=["monday", "tuesday"])
+        p4 = FitnessProfile(preferred_schedule="evening", preferred_days=["monday"])
         # Schedule: 0 * 0.5 = 0
         # Days: 1/2 = 0.5 * 0.5 = 0.25
         # Total: 0.25
@@ -90,6 +97,37 @@ class TestMatchingServiceLogic:
         p6 = FitnessProfile(preferred_gym=g4)
         assert service.calculate_location_proximity(p5, p6) == 0.0
 
+    def test_score_many_matches_single_scoring(self):
+        service = MatchingService()
+
+        g1 = Gym(id="g1", latitude=10.0, longitude=10.0)
+        g2 = Gym(id="g2", latitude=10.0, longitude=10.1)
+        user = User(fitness_profile=FitnessProfile(
+            fitness_level="beginner", goals=["build_muscle"], workout_types=["strength"],
+            preferred_schedule="morning", preferred_days=["monday", "friday"],
+            preferred_gym_id="g1", preferred_gym=g1,
+        ))
+        candidates = [
+            User(fitness_profile=FitnessProfile(
+                fitness_level="intermediate", goals=["build_muscle", "stay_fit"], workout_types=["strength"],
+                preferred_schedule="morning", preferred_days=["monday"],
+                preferred_gym_id="g2", preferred_gym=g2,
+            )),
+            User(fitness_profile=FitnessProfile(
+                fitness_level="advanced", goals=[], workout_types=["yoga"],
+                preferred_schedule="evening", preferred_days=[],
+                preferred_gym_id="g1", preferred_gym=g1,
+            )),
+            User(fitness_profile=FitnessProfile(
+                fitness_level="beginner", goals=["build_muscle"], workout_types=[],
+                preferred_schedule="morning", preferred_days=["friday"],
+            )),
+            User(),
+        ]
+
+        expected = [service.calculate_match_score(user, c) for c in candidates]
+        assert service.score_many(user, candidates) == expected
+
 
 class TestMatchingServiceIntegration:
     """Integration tests with database"""
@@ -148,3 +186,268 @@ class TestMatchingServiceIntegration:
         assert len(recommendations) == 1
         assert recommendations[0]["user"].id == user_b.id
         assert recommendations[0]["score"] == 80.0
+
+    def test_recommendation_query_count_is_constant(self, db_session):
+        """Candidate loading must not issue per-candidate SELECTs."""
+
+        def add_users(count, offset):
+            gym = Gym(name=f"Gym {offset}", latitude=10.0, longitude=10.0)
+            for i in range(offset, offset + count):
+                user = User(email=f"u{i}@test.com", hashed_password="pw", is_active=True)
+                FitnessProfile(
+                    user=user,
+                    fitness_level="beginner",
+                    goals=["build_muscle"],
+                    workout_types=["strength"],
+                    preferred_schedule="morning",
+                    preferred_days=["monday"],
+                    preferred_gym=gym,
+                )
+                MatchPreference(user=user)
+                db_session.add(user)
+            db_session.commit()
+
+        def count_queries(user_id):
+            # Warm the long-lived in-memory indexes, as a running server would have
+            service = MatchingService()
+            service.load_recommender(db_session)
+            gym_index.clear()
+            gym_index.ensure_loaded(db_session)
+            db_session.expire_all()
+
+            statements = []
+            bind = db_session.get_bind()
+            listener = lambda *args: statements.append(args[2])
+            event.listen(bind, "before_cursor_execute", listener)
+            try:
+                recommendations = service.get_match_recommendations(db_session, user_id, limit=50)
+                for rec in recommendations:
+                    rec["user"].fitness_profile.goals
+            finally:
+                event.remove(bind, "before_cursor_execute", listener)
+            return len(recommendations), len(statements)
+
+        add_users(3, 0)
+        user_id = db_session.query(User).filter(User.email == "u0@test.com").first().id
+        small = count_queries(user_id)
+
+        add_users(12, 3)
+        large = count_queries(user_id)
+
+        assert small[0] == 2
+        assert large[0] == 14
+        assert small[1] == large[1]
+
+    def test_strict_preferences_still_fill_limit(self, db_session):
+        """Filters run before ranking, so better-scoring ineligible users don't crowd out results."""
+        service = MatchingService()
+
+        def add_user(email, gender, goals, age=None):
+            user = User(email=email, hashed_password="pw", is_active=True)
+            FitnessProfile(
+                user=user,
+                fitness_level="beginner",
+                goals=goals,
+                workout_types=["strength"],
+                preferred_schedule="morning",
+                preferred_days=["monday"],
+                gender=gender,
+                age=age,
+            )
+            db_session.add(user)
+            return user
+
+        user_a = add_user("a@test.com", "male", ["build_muscle"])
+        db_session.add(MatchPreference(user=user_a, gender_preference="female", min_age=20, max_age=40))
+
+        # Identical profiles, but the wrong gender
+        for i in range(10):
+            add_user(f"m{i}@test.com", "male", ["build_muscle"])
+        # Less similar, but eligible
+        females = [add_user(f"f{i}@test.com", "female", ["build_muscle", "stay_fit"], age=30) for i in range(3)]
+        # Outside the age range
+        add_user("old@test.com", "female", ["build_muscle"], age=60)
+        # Already matched
+        matched = add_user("matched@test.com", "female", ["build_muscle"], age=30)
+        db_session.commit()
+        db_session.add(Match(user_a_id=matched.id, user_b_id=user_a.id, overall_score=50.0, score_breakdown={}))
+        db_session.commit()
+
+        recommendations = service.get_match_recommendations(db_session, user_a.id, limit=3)
+
+        assert {rec["user"].id for rec in recommendations} == {u.id for u in females}
+
+    def test_max_distance_limits_candidates(self, db_session):
+        service = MatchingService()
+        home = Gym(name="Home", latitude=10.0, longitude=10.0)
+        nearby = Gym(name="Nearby", latitude=10.0, longitude=10.1)   # ~11km
+        distant = Gym(name="Distant", latitude=12.0, longitude=10.0)  # ~220km
+
+        def add_user(email, gym):
+            user = User(email=email, hashed_password="pw", is_active=True)
+            FitnessProfile(
+                user=user,
+                fitness_level="beginner",
+                goals=["build_muscle"],
+                workout_types=["strength"],
+                preferred_schedule="morning",
+                preferred_days=["monday"],
+                preferred_gym=gym,
+            )
+            db_session.add(user)
+            return user
+
+        user_a = add_user("a@test.com", home)
+        db_session.add(MatchPreference(user=user_a, max_distance_km=50))
+        same_gym = add_user("same@test.com", home)
+        close = add_user("close@test.com", nearby)
+        add_user("far@test.com", distant)
+        # Like unknown gender or age, an unknown location does not exclude a candidate
+        no_gym = add_user("nogym@test.com", None)
+        db_session.commit()
+
+        recommendations = service.get_match_recommendations(db_session, user_a.id)
+
+        assert {rec["user"].id for rec in recommendations} == {same_gym.id, close.id, no_gym.id}
+
+    @staticmethod
+    def add_profile_user(db_session, email, goals=("build_muscle",)):
+        user = User(email=email, hashed_password="pw", is_active=True)
+        FitnessProfile(
+            user=user,
+            fitness_level="beginner",
+            goals=list(goals),
+            workout_types=["strength"],
+            preferred_schedule="morning",
+            preferred_days=["monday"],
+        )
+        db_session.add(user)
+        db_session.commit()
+        return user
+
+    def test_profiles_from_other_workers_are_picked_up(self, db_session):
+        service = MatchingService(reload_interval=0)
+        user_a = self.add_profile_user(db_session, "a@test.com")
+        service.load_recommender(db_session)
+
+        # Written by another worker: this process never saw a sync_profile call
+        newcomer = self.add_profile_user(db_session, "new@test.com")
+        assert newcomer.id not in service.recommender
+
+        recommendations = service.get_match_recommendations(db_session, user_a.id)
+
+        assert [rec["user"].id for rec in recommendations] == [newcomer.id]
+
+    def test_periodic_reload_refreshes_stale_rows(self, db_session):
+        service = MatchingService(reload_interval=60)
+        user = self.add_profile_user(db_session, "a@test.com")
+        service.load_recommender(db_session)
+        loaded = service.recommender
+
+        service.load_recommender(db_session)
+        assert service.recommender is loaded
+
+        service._reload.loaded_at = time.monotonic() - 61
+        service.load_recommender(db_session)
+        assert service.recommender is not loaded
+        assert user.id in service.recommender
+
+    def test_sync_during_load_is_not_lost(self, db_session):
+        service = MatchingService()
+        user = self.add_profile_user(db_session, "a@test.com")
+        edited = FitnessProfile(
+            user_id=user.id, fitness_level="advanced", goals=["endurance"], workout_types=["cardio"],
+            preferred_schedule="evening", preferred_days=["sunday"],
+        )
+        syncer = threading.Thread(target=service.sync_profile, args=(edited,))
+
+        def edit_while_loading(conn, cursor, statement, *args):
+            # Another request commits an edit after the load read the old row
+            if "fitness_profiles" in statement and not syncer.is_alive():
+                syncer.start()
+                time.sleep(0.05)
+
+        bind = db_session.get_bind()
+        event.listen(bind, "after_cursor_execute", edit_while_loading)
+        try:
+            service.load_recommender(db_session)
+        finally:
+            event.remove(bind, "after_cursor_execute", edit_while_loading)
+        syncer.join()
+
+        expected = FitnessRecommender()
+        expected.fit([service._profile_features(user.id, edited)])
+        row = service.recommender.user_ids.index(user.id)
+        assert np.allclose(service.recommender.feature_matrix[row], expected.feature_matrix[0])
+
+    def test_matches_from_other_workers_are_excluded(self, db_session):
+        worker_1 = MatchingService()
+        worker_2 = MatchingService()
+        user_a = self.add_profile_user(db_session, "a@test.com")
+        partner = self.add_profile_user(db_session, "partner@test.com")
+        other = self.add_profile_user(db_session, "other@test.com", goals=("build_muscle", "stay_fit"))
+
+        first = worker_1.get_match_recommendations(db_session, user_a.id)
+        assert partner.id in {rec["user"].id for rec in first}
+
+        # The match request is handled by the other worker
+        worker_2.get_match_recommendations(db_session, user_a.id)
+        match = Match(user_a_id=user_a.id, user_b_id=partner.id, overall_score=90.0, score_breakdown={})
+        db_session.add(match)
+        db_session.commit()
+        worker_2.exclusions.record(match.user_a_id, match.user_b_id, match.status)
+
+        recommendations = worker_1.get_match_recommendations(db_session, user_a.id)
+
+        assert [rec["user"].id for rec in recommendations] == [other.id]
+        assert partner.id in worker_1.exclusions.excluded(db_session, user_a.id)
+
+    def test_exclusions_expire_after_ttl(self, db_session):
+        service = MatchingService(reload_interval=60)
+        user_a = self.add_profile_user(db_session, "a@test.com")
+        partner = self.add_profile_user(db_session, "partner@test.com")
+        assert service.exclusions.excluded(db_session, user_a.id) == set()
+
+        db_session.add(Match(user_a_id=partner.id, user_b_id=user_a.id, overall_score=90.0, score_breakdown={}))
+        db_session.commit()
+        assert service.exclusions.excluded(db_session, user_a.id) == set()
+
+        loaded_at, partners = service.exclusions._partners[user_a.id]
+        service.exclusions._partners[user_a.id] = (loaded_at - 61, partners)
+        assert service.exclusions.excluded(db_session, user_a.id) == {partner.id}
+
+    def test_reload_does_not_block_requests(self, db_session):
+        service = MatchingService(reload_interval=60)
+        user = self.add_profile_user(db_session, "a@test.com")
+        service.load_recommender(db_session)
+        serving = service.recommender
+        service._reload.loaded_at = time.monotonic() - 61
+
+        edited = FitnessProfile(
+            user_id=user.id, fitness_level="advanced", goals=["endurance"], workout_types=["cardio"],
+            preferred_schedule="evening", preferred_days=["sunday"],
+        )
+        during_load = {}
+
+        def request_while_loading(conn, cursor, statement, *args):
+            if "fitness_profiles" in statement and not during_load:
+                # Requests keep using the current matrix instead of waiting for the refit
+                syncer = threading.Thread(target=service.sync_profile, args=(edited,))
+                syncer.start()
+                syncer.join(timeout=1)
+                during_load["blocked"] = syncer.is_alive()
+                during_load["recommender"] = service.recommender
+
+        bind = db_session.get_bind()
+        event.listen(bind, "after_cursor_execute", request_while_loading)
+        try:
+            service.load_recommender(db_session)
+        finally:
+            event.remove(bind, "after_cursor_execute", request_while_loading)
+
+        assert during_load == {"blocked": False, "recommender": serving}
+        assert service.recommender is not serving
+        expected = FitnessRecommender()
+        expected.fit([service._profile_features(user.id, edited)])
+        row = service.recommender.user_ids.index(user.id)
+        assert np.allclose(service.recommender.feature_matrix[row], expected.feature_matrix[0])
@@ -0,0 +1,76 @@
+"""
+Tests for the shared periodic reload policy
+"""
+
+import threading
+import time
+
+from app.services.periodic_reload import PeriodicReload
+
+
+def make_reload(source, interval=60, during_load=None):
+    """Reload of a dict copied from `source`; `during_load` runs mid-load."""
+
+    def load(db):
+        value = dict(source)
+        if during_load:
+            during_load()
+        return value
+
+    def apply(target, key, value):
+        target[key] = value
+
+    return PeriodicReload(load, apply, interval)
+
+
+class TestPeriodicReload:
+
+    def test_loads_once_until_stale(self):
+        source = {"a": 1}
+        reload = make_reload(source)
+        reload.ensure_loaded(None)
+        loaded = reload.value
+
+        source["b"] = 2
+        reload.ensure_loaded(None)
+        assert reload.value is loaded
+
+        reload.loaded_at = time.monotonic() - 61
+        reload.ensure_loaded(None)
+        assert reload.value == {"a": 1, "b": 2}
+
+    def test_changes_before_first_load_are_left_to_the_load(self):
+        reload = make_reload({"a": 1})
+        reload.change("a", 2)
+        assert reload.value is None
+
+        reload.ensure_loaded(None)
+        assert reload.value == {"a": 1}
+
+    def test_change_during_reload_is_replayed_without_blocking(self):
+        source = {"a": 1}
+        seen = {}
+
+        def change_while_loading():
+            # A request changes a row after the load read it
+            changer = threading.Thread(target=reload.change, args=("a", 2))
+            changer.start()
+            changer.join(timeout=1)
+            seen["blocked"] = changer.is_alive()
+            seen["serving"] = dict(reload.value)
+
+        reload = make_reload(source, during_load=change_while_loading)
+        reload.value = {"a": 0}
+        reload.loaded_at = time.monotonic() - 61
+        reload.ensure_loaded(None)
+
+        assert seen == {"blocked": False, "serving": {"a": 2}}
+        assert reload.value == {"a": 2}
+
+    def test_clear_forces_a_reload(self):
+        reload = make_reload({"a": 1})
+        reload.ensure_loaded(None)
+        reload.clear()
+        assert not reload.loaded
+        reload.ensure_loaded(None)
+        assert reload.value == {"a": 1}
@@ -0,0 +1,129 @@
+"""
+Tests for the ML Recommender
+"""
+
+import pytest
+from app.ml.features import ProfileEncoder
+from app.ml.recommender import FitnessRecommender
+
+
+def make_profile(user_id: str, level="beginner", schedule="morning", goals=None, types=None, days=None):
+    """Helper to build a recommender input row."""
+    return {
+        "user_id": user_id,
+        "fitness_level": level,
+        "preferred_schedule": schedule,
+        "goals": goals or [],
+        "workout_types": types or [],
+        "preferred_days": days or [],
+    }
+
+
+class TestProfileEncoder:
+    """Unit tests for the fixed-layout feature encoder"""
+
+    def test_column_layout_is_independent_of_data(self):
+        a = ProfileEncoder().encode_many([make_profile("a", goals=["build_muscle"])])
+        b = ProfileEncoder().encode_many([
+            make_profile("b", schedule="night", types=["yoga"], days=["sunday"]),
+            make_profile("a", goals=["build_muscle"]),
+        ])
+        assert a.shape[1] == b.shape[1]
+        assert (a[0] == b[1]).all()
+
+    def test_encodes_known_values_and_ignores_unknown(self):
+        encoder = ProfileEncoder()
+        row = encoder.encode(make_profile(
+            "a", level="advanced", schedule="evening",
+            goals=["build_muscle", "not_a_goal"], types=["yoga"], days=["monday", "friday"],
+        ))
+        hot = {encoder.columns[i] for i in row.nonzero()[0]}
+        assert hot == {
+            "level_numeric",
+            "preferred_schedule_evening",
+            "goals_build_muscle",
+            "workout_types_yoga",
+            "preferred_days_monday",
+            "preferred_days_friday",
+        }
+        assert row[0] == 1.0
+
+
+class TestFitnessRecommender:
+    """Unit tests for fitting and querying the recommender"""
+
+    def test_recommendations_ranked_by_similarity(self):
+        recommender = FitnessRecommender()
+        recommender.fit([
+            make_profile("a", goals=["build_muscle"], types=["strength"]),
+            make_profile("b", goals=["build_muscle"], types=["strength"]),
+            make_profile("c", level="advanced", schedule="night", goals=["flexibility"], types=["yoga"]),
+        ])
+
+        recs = recommender.get_recommendations("a", top_n=5)
+        assert [r["user_id"] for r in recs] == ["b", "c"]
+        assert recs[0]["score"] == pytest.approx(100.0)
+
+    def test_unknown_user_has_no_recommendations(self):
+        recommender = FitnessRecommender()
+        recommender.fit([make_profile("a"), make_profile("b")])
+        assert recommender.get_recommendations("missing") == []
+
+    def test_upsert_updates_single_row(self):
+        recommender = FitnessRecommender()
+        recommender.fit([
+            make_profile("a", goals=["build_muscle"], types=["strength"]),
+            make_profile("b", goals=["build_muscle"], types=["strength"]),
+            make_profile("c", goals=["flexibility"], types=["yoga"]),
+        ])
+
+        # "c" switches to exactly "a"'s profile and should now rank first alongside "b"
+        recommender.upsert(make_profile("c", goals=["build_muscle"], types=["strength"]))
+        recs = recommender.get_recommendations("a", top_n=5)
+        assert {r["user_id"] for r in recs} == {"b", "c"}
+        assert all(r["score"] == pytest.approx(100.0) for r in recs)
+
+    def test_upsert_new_user_and_remove(self):
+        recommender = FitnessRecommender()
+        recommender.fit([make_profile("a", goals=["build_muscle"])])
+
+        recommender.upsert(make_profile("b", schedule="evening", goals=["build_muscle"], days=["monday"]))
+        assert "b" in recommender
+        assert [r["user_id"] for r in recommender.get_recommendations("a")] == ["b"]
+
+        recommender.remove("b")
+        assert "b" not in recommender
+        assert recommender.get_recommendations("a") == []
+
+    def test_query_keeps_only_normalised_feature_rows(self):
+        recommender = FitnessRecommender()
+        recommender.fit([make_profile(str(i), goals=["build_muscle"] if i % 2 else ["stay_fit"]) for i in range(20)])
+
+        recs = recommender.get_recommendations("0", top_n=3)
+        assert len(recs) == 3
+        # No N x N similarity matrix is materialised
+        assert recommender.feature_matrix.shape == (20, recommender.encoder.n_features)
+        assert all(r["user_id"] != "0" for r in recs)
+
+    def test_buffer_grows_and_remove_keeps_rows_contiguous(self):
+        recommender = FitnessRecommender()
+        recommender.fit([])
+        for i in range(FitnessRecommender.INITIAL_CAPACITY + 5):
+            recommender.upsert(make_profile(f"u{i}", goals=["stay_fit"]))
+        assert len(recommender) == FitnessRecommender.INITIAL_CAPACITY + 5
+
+        recommender.remove("u0")
+        assert "u0" not in recommender
+        recs = recommender.get_recommendations("u1", top_n=100)
+        assert len(recs) == len(recommender) - 1
+        assert "u0" not in {r["user_id"] for r in recs}
+
+    def test_excluded_users_are_skipped(self):
+        recommender = FitnessRecommender()
+        recommender.fit([make_profile(uid, goals=["build_muscle"]) for uid in ("a", "b", "c", "d")])
+
+        recs = recommender.get_recommendations("a", exclude={"b"})
+        assert [r["user_id"] for r in recs] == ["c", "d"]
+
+        recs = recommender.get_recommendations("a", candidates=["b", "c"], exclude={"c"})
+        assert [r["user_id"] for r in recs] == ["b"]
@@ -2,9 +2,7 @@ import { useRouter } from 'next/router';
 import Head from 'next/head';
 import { Layout } from '@/components';
 import { useState, useEffect, useRef } from 'react';
-
-// Mock auth token extraction or service (in real app, we use context/store)
-const getCurrentUserId = () => "mock-user-id"; 
+import { getCurrentUserId, openChatSocket } from '@/services/api';
 
 interface Message {
     id: string;
@@ -21,10 +19,13 @@ export default function ChatRoom() {
     const [messages, setMessages] = useState<Message[]>([]);
     const [inputText, setInputText] = useState("");
     const [isConnected, setIsConnected] = useState(false);
+    const [partnerOnline, setPartnerOnline] = useState(false);
+    const [partnerTyping, setPartnerTyping] = useState(false);
     
     const wsRef = useRef<WebSocket | null>(null);
     const messagesEndRef = useRef<HTMLDivElement>(null);
-    const mockUserId = getCurrentUserId();
+    // The server takes the sender from the access token; this is only used to align bubbles
+    const currentUserId = getCurrentUserId() ?? "mock-user-id";
 
     // Auto-scroll to bottom when messages change
     const scrollToBottom = () => {
@@ -35,6 +36,13 @@ export default function ChatRoom() {
         scrollToBottom();
     }, [messages]);
 
+    // Typing events are sent at most every couple of seconds while typing
+    useEffect(() => {
+        if (!partnerTyping) return;
+        const timer = setTimeout(() => setPartnerTyping(false), 3000);
+        return () => clearTimeout(timer);
+    }, [partnerTyping]);
+
     useEffect(() => {
         if (!id) return;
 
@@ -57,7 +65,7 @@ export default function ChatRoom() {
                     },
                     {
                         id: 'msg2',
-                        sender_id: mockUserId,
+                        sender_id: currentUserId,
                         content: 'Yeah definitely! Im planning to do legs around 7 AM.',
                         created_at: new Date(Date.now() - 3500000).toISOString(),
                         is_read: true,
@@ -70,16 +78,35 @@ export default function ChatRoom() {
 
         fetchHistory();
 
-        // Connect WebSocket
-        const ws = new WebSocket(`ws://localhost:8000/chat/ws/${id}`);
+        // Connect WebSocket (authenticated with the stored access token)
+        const ws = openChatSocket(id as string);
         
         ws.onopen = () => setIsConnected(true);
         ws.onclose = () => setIsConnected(false);
         ws.onerror = (e) => console.error("WebSocket error", e);
         
         ws.onmessage = (event) => {
-            const newMsg = JSON.parse(event.data);
-            setMessages(prev => [...prev, newMsg]);
+            const frame = JSON.parse(event.data);
+            switch (frame.type) {
+                case 'ping':
+                    // The server closes sockets that stay silent, so answer every ping
+                    ws.send(JSON.stringify({ type: 'pong' }));
+                    return;
+                case 'presence':
+                    if (frame.user_id !== currentUserId) setPartnerOnline(frame.online);
+                    return;
+                case 'typing':
+                    if (frame.user_id !== currentUserId) setPartnerTyping(true);
+                    return;
+                case undefined:
+                    // Chat messages are the only frames without a type
+                    setPartnerTyping(false);
+                    setMessages(prev => [...prev, frame as Message]);
+                    return;
+                default:
+                    // read_receipt, error: nothing to render yet
+                    return;
+            }
         };
         
         wsRef.current = ws;
@@ -93,8 +120,8 @@ export default function ChatRoom() {
         e.preventDefault();
         if (!inputText.trim() || !wsRef.current) return;
         
+        // The sender is taken from the socket's access token, not the payload
         const payload = {
-            sender_id: mockUserId,
             content: inputText.trim()
         };
         
@@ -105,7 +132,7 @@ export default function ChatRoom() {
             // For Demo Purposes if Server is offline: simulate it instantly
             setMessages(prev => [...prev, {
                 id: Math.random().toString(),
-                sender_id: mockUserId,
+                sender_id: currentUserId,
                 content: payload.content,
                 created_at: new Date().toISOString(),
                 is_read: true
@@ -139,8 +166,8 @@ export default function ChatRoom() {
                                 <div>
                                     <h2 className="font-semibold text-white">Your Match</h2>
                                     <div className="flex items-center text-xs text-gray-400 space-x-1">
-                                        <span className={`w-2 h-2 rounded-full ${isConnected ? 'bg-green-500' : 'bg-red-500'}`}></span>
-                                        <span>{isConnected ? 'Online' : 'Offline'}</span>
+                                        <span className={`w-2 h-2 rounded-full ${isConnected && partnerOnline ? 'bg-green-500' : 'bg-red-500'}`}></span>
+                                        <span>{!isConnected || !partnerOnline ? 'Offline' : partnerTyping ? 'Typing…' : 'Online'}</span>
                                     </div>
                                 </div>
                             </div>
@@ -149,7 +176,7 @@ export default function ChatRoom() {
                         {/* Messages Area */}
                         <div className="flex-1 overflow-y-auto p-6 space-y-4">
                             {messages.map((msg) => {
-                                const isMe = msg.sender_id === mockUserId;
+                                const isMe = msg.sender_id === currentUserId;
                                 return (
                                     <div key={msg.id} className={`flex ${isMe ? 'justify-end' : 'justify-start'}`}>
                                         <div className={`max-w-[75%] rounded-2xl px-5 py-3 ${
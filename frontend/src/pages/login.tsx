@@ -1,16 +1,25 @@
 import Head from 'next/head';
 import Link from 'next/link';
+import { useRouter } from 'next/router';
 import { useState } from 'react';
 import { Layout } from '@/components';
+import { login } from '@/services/api';
 
 export default function Login() {
     const [email, setEmail] = useState('');
     const [password, setPassword] = useState('');
+    const [error, setError] = useState<string | null>(null);
+    const router = useRouter();
 
-    const handleSubmit = (e: React.FormEvent) => {
+    const handleSubmit = async (e: React.FormEvent) => {
         e.preventDefault();
-        // TODO: Implement login logic
-        console.log('Login:', { email, password });
+        setError(null);
+        try {
+            await login(email, password);
+            router.push('/matches');
+        } catch (err) {
+            setError(err instanceof Error ? err.message : 'Login failed');
+        }
     };
 
     return (
@@ -36,6 +45,10 @@ export default function Login() {
                             <p className="text-gray-400 text-center mb-8">Sign in to find your workout partners</p>
 
                             <form onSubmit={handleSubmit} className="space-y-5">
+                                {error && (
+                                    <p className="text-red-400 text-sm text-center">{error}</p>
+                                )}
+
                                 <div>
                                     <label className="block text-gray-300 text-sm font-medium mb-2">
                                         Email
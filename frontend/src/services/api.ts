@@ -13,3 +13,59 @@ export async function fetchRoot() {
     const response = await fetch(`${API_BASE_URL}/`);
     return response.json();
 }
+
+export const WS_BASE_URL = API_BASE_URL.replace(/^http/, 'ws');
+
+/**
+ * Sign in and keep the returned access token (under `access_token`) for
+ * authenticated requests and chat sockets. Throws on bad credentials.
+ */
+export async function login(email: string, password: string): Promise<void> {
+    const response = await fetch(`${API_BASE_URL}/auth/login`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ email, password }),
+    });
+    if (!response.ok) {
+        const body = await response.json().catch(() => ({}));
+        throw new Error(body.detail || 'Login failed');
+    }
+    const { access_token } = await response.json();
+    window.localStorage.setItem('access_token', access_token);
+}
+
+/**
+ * Access token saved by `login` (stored under `access_token`).
+ */
+export function getAccessToken(): string | null {
+    if (typeof window === 'undefined') return null;
+    return window.localStorage.getItem('access_token');
+}
+
+/**
+ * User id (`sub`) from the stored access token, without verifying it.
+ */
+export function getCurrentUserId(): string | null {
+    const token = getAccessToken();
+    if (!token) return null;
+    try {
+        const payload = token.split('.')[1].replace(/-/g, '+').replace(/_/g, '/');
+        return JSON.parse(atob(payload)).sub ?? null;
+    } catch {
+        return null;
+    }
+}
+
+/**
+ * Open a chat socket for a match. Browsers cannot set headers on a WebSocket,
+ * so the token is offered as the subprotocol pair ["gymbuddy.bearer", token],
+ * which keeps it out of URLs and access logs. Without a token the server
+ * closes the socket with code 1008.
+ */
+export function openChatSocket(matchId: string): WebSocket {
+    const token = getAccessToken();
+    return new WebSocket(
+        `${WS_BASE_URL}/chat/ws/${matchId}`,
+        token ? ['gymbuddy.bearer', token] : undefined,
+    );
+}